@@ -3,33 +3,58 @@ import torchaudio
 import numpy as np
 from transformers import Wav2Vec2Processor, Wav2Vec2Model
 from scipy import signal
+from .backends import InferenceRunner, backend_for
+from .bundle import get_bundle
+from .cancellation import Cancelled, check
+from .telemetry import span
 
 class AudioAnalyzer:
-    def __init__(self):
-        self.wav2vec_processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h")
-        self.wav2vec_model = Wav2Vec2Model.from_pretrained("facebook/wav2vec2-base-960h")
+    def __init__(self, backend=None, window_seconds=30.0):
+        bundle = get_bundle()
+        self.wav2vec_processor = bundle.load_processor("wav2vec2", Wav2Vec2Processor)
+        self.wav2vec_model = bundle.load_model("wav2vec2", Wav2Vec2Model)
+        self.wav2vec_encoder = InferenceRunner(
+            self.wav2vec_model,
+            backend=backend or backend_for("wav2vec2"),
+            output_names=("last_hidden_state",),
+            name="wav2vec2"
+        )
+        # Long recordings are encoded in windows of this length
+        self.window_seconds = window_seconds
         
-    def analyze_audio(self, audio_path):
+    def analyze_audio(self, audio_path, cancel=None):
         """
         Analyze audio for medical conditions
+        
+        The recording is encoded in `window_seconds` windows and a `cancel`
+        token is checked before each one.
         """
         try:
             # Load audio
-            waveform, sample_rate = torchaudio.load(audio_path)
+            with span("audio.decode"):
+                waveform, sample_rate = torchaudio.load(audio_path)
             
-            # Process audio
-            inputs = self.wav2vec_processor(waveform, sampling_rate=sample_rate, return_tensors="pt")
-            features = self.wav2vec_model(**inputs).last_hidden_state
+            # Process audio one window at a time
+            window = max(1, int(self.window_seconds * sample_rate))
+            features = []
+            for start in range(0, waveform.shape[1], window):
+                check(cancel)
+                with span("preprocess", model="wav2vec2"):
+                    inputs = self.wav2vec_processor(waveform[:, start:start + window], sampling_rate=sample_rate, return_tensors="pt")
+                features.append(self.wav2vec_encoder(input_values=inputs["input_values"])["last_hidden_state"])
+            features = torch.cat(features, dim=1)
             
             # Extract features
             analysis = {
-                "features": features.detach().numpy().tolist(),
+                "features": features.numpy(),
                 "sample_rate": sample_rate,
                 "duration": waveform.shape[1] / sample_rate
             }
             
             return analysis
             
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
             
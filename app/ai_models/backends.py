@@ -0,0 +1,262 @@
+import hashlib
+import inspect
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from .telemetry import span
+
+BACKENDS = ("eager", "int8", "onnx")
+
+# CLIP submodules behind get_image_features; the text tower stays fp32 under int8
+CLIP_IMAGE_MODULES = ("vision_model", "visual_projection")
+
+
+def backend_for(model_key: str, default: str = "eager") -> str:
+    """
+    Return the inference backend configured for a model.
+
+    `<MODEL_KEY>_BACKEND` (e.g. CLIP_BACKEND=int8) wins over the global
+    INFERENCE_BACKEND setting.
+    """
+    backend = os.getenv(f"{model_key.upper()}_BACKEND") or os.getenv("INFERENCE_BACKEND", default)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}' for {model_key}, expected one of {BACKENDS}")
+    return backend
+
+
+class _EntryPoint(torch.nn.Module):
+    """Expose one model method with positional inputs so it can be exported"""
+
+    def __init__(self, model: torch.nn.Module, method: str, input_names: Sequence[str], output_names: Sequence[str]):
+        super().__init__()
+        self.model = model
+        self.method = method
+        self.input_names = list(input_names)
+        self.output_names = list(output_names)
+
+    def forward(self, *args):
+        outputs = getattr(self.model, self.method)(**dict(zip(self.input_names, args)))
+        if isinstance(outputs, torch.Tensor):
+            return outputs
+        return tuple(outputs[name] for name in self.output_names)
+
+
+class InferenceRunner:
+    """
+    Run one entry point of a model on a CPU inference backend.
+
+    - eager: fp32 PyTorch under inference mode
+    - int8: Linear layers dynamically quantized to int8, in place, so the
+      fp32 weights are freed and every holder of the model runs int8;
+      `quantize` limits this to the named submodules (e.g. CLIP's vision
+      tower, leaving the text tower that encodes label prompts in fp32)
+    - onnx: the entry point is exported on first call and run with onnxruntime
+
+    Calling the runner returns a dict of output name -> tensor.
+    """
+
+    def __init__(self,
+                 model: torch.nn.Module,
+                 backend: str = "eager",
+                 method: str = "forward",
+                 output_names: Sequence[str] = ("logits",),
+                 name: Optional[str] = None,
+                 export_dir: Optional[str] = None,
+                 quantize: Optional[Sequence[str]] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+        self.backend = backend
+        self.method = method
+        self.output_names = list(output_names)
+        self.name = name or type(model).__name__
+        self.export_dir = export_dir or os.getenv("ONNX_EXPORT_DIR") or tempfile.gettempdir()
+        self._session = None
+        self._session_inputs: List[str] = []
+        self._lock = threading.Lock()
+
+        model.eval()
+        if backend == "int8":
+            # In place: analyzers keep references to the model for other methods
+            # (text features, label banks), and a copy would keep the fp32 weights alive
+            # Submodules named in `quantize` get every layer type torch can quantize, so map Linear only
+            torch.ao.quantization.quantize_dynamic(
+                model,
+                set(quantize) if quantize else {torch.nn.Linear},
+                dtype=torch.qint8,
+                mapping={torch.nn.Linear: torch.ao.nn.quantized.dynamic.Linear},
+                inplace=True
+            )
+        self.model = model
+
+    def __call__(self, **inputs) -> Dict[str, torch.Tensor]:
+        with span("model.forward", model=self.name):
+            return self._forward(inputs)
+
+    def _forward(self, inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        if self.backend == "onnx":
+            return self._run_onnx(inputs)
+
+        with torch.inference_mode():
+            outputs = getattr(self.model, self.method)(**inputs)
+        if isinstance(outputs, torch.Tensor):
+            return {self.output_names[0]: outputs}
+        return {name: outputs[name] for name in self.output_names}
+
+    def _run_onnx(self, inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Run the exported graph, exporting it first if needed"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._export(inputs)
+
+        feed = {name: inputs[name].numpy() for name in self._session_inputs}
+        outputs = self._session.run(self.output_names, feed)
+        return {name: torch.from_numpy(value) for name, value in zip(self.output_names, outputs)}
+
+    def _export(self, example_inputs: Dict[str, torch.Tensor]):
+        """Export the entry point with fully dynamic axes and open a runtime session"""
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx inference backend requires the onnxruntime package") from e
+
+        input_names = list(example_inputs.keys())
+        path = self._export_path(input_names)
+        if path is None or not os.path.exists(path):
+            path = self._export_graph(example_inputs, input_names, path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Sized by the thread budget (app/threads.py); 0 keeps onnxruntime's default
+        options.intra_op_num_threads = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+        options.inter_op_num_threads = 1
+        session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._session_inputs = [i.name for i in session.get_inputs()]
+        return session
+
+    def _export_path(self, input_names: List[str]) -> Optional[str]:
+        """
+        Where the export of this model revision is kept, shared by every
+        process; None when the revision is unknown and an export can't be reused
+        """
+        revision = getattr(getattr(self.model, "config", None), "_commit_hash", None)
+        if not revision:
+            return None
+        key = hashlib.sha256(
+            "|".join([revision, self.method, torch.__version__] + input_names + self.output_names).encode()
+        ).hexdigest()[:16]
+        return os.path.join(self.export_dir, f"{self.name}.{self.method}.{key}.onnx")
+
+    def _export_graph(self, example_inputs: Dict[str, torch.Tensor], input_names: List[str],
+                      path: Optional[str]) -> str:
+        """
+        Export to a private temporary file, then move it into place, so
+        concurrent exporters (forked workers) never load a partial file
+        """
+        dynamic_axes = {
+            name: {axis: f"{name}_{axis}" for axis in range(tensor.dim())}
+            for name, tensor in example_inputs.items()
+        }
+        entry_point = _EntryPoint(self.model, self.method, input_names, self.output_names)
+        with torch.inference_mode():
+            reference = entry_point(*example_inputs.values())
+        reference = (reference,) if isinstance(reference, torch.Tensor) else reference
+        for name, tensor in zip(self.output_names, reference):
+            dynamic_axes[name] = {axis: f"{name}_{axis}" for axis in range(tensor.dim())}
+
+        # The TorchScript exporter takes dynamic_axes; newer torch defaults to the dynamo one
+        legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+        os.makedirs(self.export_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f"{self.name}.{self.method}.", suffix=".onnx.tmp", dir=self.export_dir)
+        os.close(fd)
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    entry_point,
+                    tuple(example_inputs.values()),
+                    tmp,
+                    input_names=input_names,
+                    output_names=self.output_names,
+                    dynamic_axes=dynamic_axes,
+                    opset_version=17,
+                    **legacy
+                )
+        except Exception:
+            os.remove(tmp)
+            raise
+        if path is None:
+            # Unknown revision: this process keeps its own export
+            path = tmp[:-len(".tmp")]
+        os.replace(tmp, path)
+        return path
+
+
+def compare_outputs(reference: Dict[str, torch.Tensor], candidate: Dict[str, torch.Tensor]) -> Dict[str, Dict]:
+    """
+    Compare backend outputs against the fp32 reference
+    """
+    report = {}
+    for name, expected in reference.items():
+        expected = expected.float().flatten()
+        actual = candidate[name].float().flatten()
+        cosine = torch.nn.functional.cosine_similarity(expected, actual, dim=0)
+        report[name] = {
+            "max_abs_diff": float((expected - actual).abs().max()),
+            "cosine_similarity": float(cosine),
+            "argmax_agrees": bool(expected.argmax() == actual.argmax())
+        }
+    return report
+
+
+def check_parity(reference: InferenceRunner,
+                 candidate: InferenceRunner,
+                 fixtures: List[Dict[str, torch.Tensor]],
+                 min_cosine: float = 0.99) -> Dict:
+    """
+    Run fixture inputs through both runners and check the candidate stays
+    within `min_cosine` of the reference on every output
+    """
+    cases = [compare_outputs(reference(**inputs), candidate(**inputs)) for inputs in fixtures]
+    worst = {
+        name: {
+            "max_abs_diff": max(case[name]["max_abs_diff"] for case in cases),
+            "min_cosine_similarity": min(case[name]["cosine_similarity"] for case in cases),
+            "argmax_agreement": float(np.mean([case[name]["argmax_agrees"] for case in cases]))
+        }
+        for name in reference.output_names
+    }
+    return {
+        "backend": candidate.backend,
+        "passed": all(w["min_cosine_similarity"] >= min_cosine for w in worst.values()),
+        "outputs": worst
+    }
+
+
+def benchmark(runner: Callable, fixtures: List[Dict[str, torch.Tensor]], repeats: int = 10, warmup: int = 2) -> Dict:
+    """
+    Time a runner over fixture inputs and return latency percentiles in milliseconds
+    """
+    for _ in range(warmup):
+        for inputs in fixtures:
+            runner(**inputs)
+
+    timings = []
+    for _ in range(repeats):
+        for inputs in fixtures:
+            start = time.perf_counter()
+            runner(**inputs)
+            timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+    return {
+        "calls": len(timings),
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95))
+    }
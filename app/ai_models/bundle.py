@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUNDLE_DIR = "models"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = 1
+
+# Hub id and bundle sub-directory for every model the app loads
+MODEL_SPECS = {
+    "clip": {"id": "openai/clip-vit-base-patch32", "path": "clip"},
+    "wav2vec2": {"id": "facebook/wav2vec2-base-960h", "path": "wav2vec2"},
+    "bio_clinical_bert": {"id": "emilyalsentzer/Bio_ClinicalBERT", "path": "bio_clinical_bert"},
+    "yolov8n": {"id": "yolov8n.pt", "path": "yolo", "weights": "yolov8n.pt"},
+}
+
+# safetensors dtype codes and the torch dtypes they map to
+SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8",
+    "U8": "uint8", "BOOL": "bool",
+}
+
+VERIFY_MODES = ("full", "stamp", "off")
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mmap_safetensors(path: str) -> Dict:
+    """
+    Tensors of a .safetensors file backed directly by a file mapping.
+
+    Nothing is copied: pages are read from the page cache on first touch
+    and shared by every process mapping the same file. The mapping is
+    private, so an in-place write copies only the page it touches.
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_size = struct.unpack("<Q", mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_size])
+    base = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        count = (end - start) // dtype.itemsize
+        if count:
+            tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=base + start)
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+
+class ModelBundle:
+    """
+    Local, verified model artifacts described by `models/manifest.json`.
+
+    The manifest lists, per model key, the hub id and revision it was built
+    from, a path relative to the bundle directory and the sha256 of every
+    file. Weights are stored as safetensors and memory mapped at load time.
+    Files are verified before first use: `full` hashes them on every
+    start, `stamp` (default) rehashes only files whose size or mtime changed
+    since the last verification, `off` skips checks.
+
+    Without a manifest (or for keys it doesn't list) models are loaded from
+    the Hugging Face hub as before.
+    """
+
+    def __init__(self, root: str, manifest: Optional[Dict] = None, verify: str = "stamp"):
+        if verify not in VERIFY_MODES:
+            raise ValueError(f"Unknown verify mode '{verify}', expected one of {VERIFY_MODES}")
+        self.root = root
+        self.manifest = manifest or {"format": MANIFEST_FORMAT, "models": {}}
+        self.verify_mode = verify
+        self._verified = set()
+        self._locks = {key: threading.Lock() for key in self.models}
+        self._stamp_lock = threading.Lock()
+
+    @classmethod
+    def from_dir(cls, root: Optional[str] = None, verify: Optional[str] = None) -> "ModelBundle":
+        root = root or os.getenv("MODEL_BUNDLE_DIR", DEFAULT_BUNDLE_DIR)
+        verify = verify or os.getenv("MODEL_BUNDLE_VERIFY", "stamp")
+        path = os.path.join(root, MANIFEST_NAME)
+        manifest = None
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("format") != MANIFEST_FORMAT:
+                raise ValueError(f"Unsupported model bundle format {manifest.get('format')} in {path}")
+        return cls(root, manifest, verify)
+
+    @property
+    def models(self) -> Dict[str, Dict]:
+        return self.manifest["models"]
+
+    def has(self, key: str) -> bool:
+        return key in self.models
+
+    def model_dir(self, key: str) -> str:
+        return os.path.join(self.root, self.models[key]["path"])
+
+    def hub_id(self, key: str) -> str:
+        return self.models.get(key, MODEL_SPECS.get(key, {})).get("id", key)
+
+    def _stamp_path(self) -> str:
+        return os.path.join(self.root, ".verified.json")
+
+    def _read_stamps(self) -> Dict:
+        try:
+            with open(self._stamp_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def verify(self, key: str):
+        """Check every file of a model against its manifest checksum (once per process)"""
+        if key in self._verified or self.verify_mode == "off":
+            return
+        with self._locks[key]:
+            if key in self._verified:
+                return
+            entry = self.models[key]
+            stamps = self._read_stamps() if self.verify_mode == "stamp" else {}
+            updated = {}
+            for name, expected in entry["files"].items():
+                path = os.path.join(self.model_dir(key), name)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Model bundle file missing: {path}")
+                stat = os.stat(path)
+                stamp = [stat.st_size, stat.st_mtime_ns, expected]
+                if stamps.get(path) == stamp:
+                    continue
+                actual = sha256_file(path)
+                if actual != expected:
+                    raise ValueError(f"Checksum mismatch for {path}: expected {expected}, got {actual}")
+                updated[path] = stamp
+            if updated and self.verify_mode == "stamp":
+                with self._stamp_lock:
+                    stamps = self._read_stamps()
+                    stamps.update(updated)
+                    try:
+                        with open(self._stamp_path(), "w") as f:
+                            json.dump(stamps, f)
+                    except OSError as e:
+                        logger.warning(f"Could not record verified model files: {str(e)}")
+            self._verified.add(key)
+
+    def load_model(self, key: str, model_cls, **kwargs):
+        """
+        Load a transformers model with memory-mapped weights from the bundle,
+        or from the hub when the bundle doesn't have it.
+        """
+        if not self.has(key):
+            return model_cls.from_pretrained(self.hub_id(key), **kwargs)
+        self.verify(key)
+        from transformers import AutoConfig
+        from transformers.modeling_utils import no_init_weights
+
+        entry = self.models[key]
+        directory = self.model_dir(key)
+        config = AutoConfig.from_pretrained(directory, local_files_only=True, **kwargs)
+        # Keep the hub identity so caches keyed on it (label bank) stay valid
+        config._name_or_path = entry["id"]
+        config._commit_hash = entry.get("revision")
+
+        # Allocate without initializing; every tensor is replaced by a mapped one
+        with no_init_weights():
+            # Auto classes can't be instantiated directly; they pick the class from the config
+            model = model_cls.from_config(config) if hasattr(model_cls, "from_config") else model_cls(config)
+        state = mmap_safetensors(os.path.join(directory, entry.get("weights", "model.safetensors")))
+        expected = set(model.state_dict())
+        prefix = f"{model.base_model_prefix}."
+        if not expected & set(state) and any(name.startswith(prefix) for name in state):
+            # Base model loaded from a checkpoint with a task head (e.g. Wav2Vec2Model from ForCTC)
+            state = {name[len(prefix):]: tensor for name, tensor in state.items() if name.startswith(prefix)}
+        missing = expected - set(state)
+        if missing:
+            # Heads the checkpoint lacks need real initialization; take the regular path
+            logger.info(f"{key}: {len(missing)} tensors not in the bundle, loading with from_pretrained")
+            return model_cls.from_pretrained(directory, local_files_only=True, **kwargs)
+
+        model.load_state_dict({name: state[name] for name in expected}, strict=False, assign=True)
+        model.tie_weights()
+        model.eval()
+        # Marks file-backed weights, which are already shared across processes
+        model._mmap_weights = True
+        return model
+
+    def load_processor(self, key: str, processor_cls, **kwargs):
+        """Load a tokenizer/processor from the bundle, or from the hub"""
+        if not self.has(key):
+            return processor_cls.from_pretrained(self.hub_id(key), **kwargs)
+        self.verify(key)
+        return processor_cls.from_pretrained(self.model_dir(key), local_files_only=True, **kwargs)
+
+    def weights_path(self, key: str) -> str:
+        """Local path of a single-file checkpoint (YOLO), or its hub name"""
+        if not self.has(key):
+            return MODEL_SPECS[key]["weights"]
+        self.verify(key)
+        return os.path.join(self.model_dir(key), self.models[key]["weights"])
+
+
+@lru_cache(maxsize=None)
+def get_bundle() -> ModelBundle:
+    """The process-wide model bundle (MODEL_BUNDLE_DIR, default models/)"""
+    return ModelBundle.from_dir()
+
+
+def load_parallel(loaders: Dict[str, Callable], max_workers: Optional[int] = None) -> Dict:
+    """
+    Run independent loaders concurrently and return their results by name.
+
+    Deserialization is mostly page faults and GIL-free tensor work, so
+    independent models load in roughly the time of the slowest one.
+    """
+    max_workers = max_workers or int(os.getenv("MODEL_LOAD_WORKERS", "4"))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-load") as pool:
+        futures = {name: pool.submit(loader) for name, loader in loaders.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,67 @@
+import threading
+import time
+from typing import Optional
+
+
+class Cancelled(Exception):
+    """Raised by CancelToken.check() once work should stop"""
+
+
+class CancelToken:
+    """
+    Cooperative cancellation with an optional deadline.
+
+    Long-running loops call `check()` once per frame, window or batch; it
+    raises Cancelled after `cancel()` was called (client disconnected, job
+    deleted) or the deadline passed. Analyzers re-raise Cancelled instead
+    of turning it into an error result, so the orchestrator can stop and
+    return what it has.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        # Deadline on the time.monotonic() clock
+        self.deadline = deadline
+        self._event = threading.Event()
+        self._reason: Optional[str] = None
+
+    @classmethod
+    def with_timeout(cls, seconds: Optional[float]) -> "CancelToken":
+        """A token expiring `seconds` from now (no deadline if None or <= 0)"""
+        if not seconds or seconds <= 0:
+            return cls()
+        return cls(time.monotonic() + seconds)
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline exceeded")
+            return True
+        return False
+
+    @property
+    def reason(self) -> Optional[str]:
+        return self._reason if self.cancelled else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise Cancelled if the token was cancelled or has expired"""
+        if self.cancelled:
+            raise Cancelled(self._reason)
+
+
+def check(token: Optional[CancelToken]):
+    """`token.check()` that accepts None, for optional token parameters"""
+    if token is not None:
+        token.check()
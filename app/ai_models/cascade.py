@@ -0,0 +1,76 @@
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from .cancellation import check
+from .telemetry import span
+
+# Every cascade created in this process, by name, for the stats endpoint
+_registry: Dict[str, "Cascade"] = {}
+
+
+class Cascade:
+    """
+    Early-exit chain of analysis stages, cheapest first.
+
+    Each stage is a callable that fills in a shared `state` dict and returns
+    True when it is confident enough to answer on its own; later (more
+    expensive) stages then don't run. The last stage always answers. Per
+    stage entry, exit and latency counters are kept for `stats()`. A
+    CancelToken in `state["cancel"]` is checked before each stage.
+    """
+
+    def __init__(self, name: str, stages: List[Tuple[str, Callable[[Dict], bool]]]):
+        if not stages:
+            raise ValueError("A cascade needs at least one stage")
+        self.name = name
+        self.stages = stages
+        self._lock = threading.Lock()
+        self._counts = {
+            stage: {"entered": 0, "exits": 0, "total_ms": 0.0}
+            for stage, _ in stages
+        }
+        _registry[name] = self
+
+    def run(self, state: Dict) -> str:
+        """Run stages until one exits; returns the name of the answering stage"""
+        last = len(self.stages) - 1
+        for index, (stage, run_stage) in enumerate(self.stages):
+            check(state.get("cancel"))
+            start = time.perf_counter()
+            with span(f"cascade.{self.name}.{stage}"):
+                done = run_stage(state)
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                counts = self._counts[stage]
+                counts["entered"] += 1
+                counts["total_ms"] += elapsed
+                if done or index == last:
+                    counts["exits"] += 1
+            if done or index == last:
+                state["cascade_stage"] = stage
+                return stage
+        return self.stages[last][0]
+
+    def stats(self) -> Dict:
+        """Per-stage request counts, exit rates and mean latency"""
+        with self._lock:
+            total = self._counts[self.stages[0][0]]["entered"]
+            return {
+                "requests": total,
+                "stages": {
+                    stage: {
+                        "entered": c["entered"],
+                        "exits": c["exits"],
+                        "exit_rate": c["exits"] / c["entered"] if c["entered"] else 0.0,
+                        "share_of_requests": c["exits"] / total if total else 0.0,
+                        "mean_ms": c["total_ms"] / c["entered"] if c["entered"] else 0.0
+                    }
+                    for stage, c in self._counts.items()
+                }
+            }
+
+
+def cascade_stats() -> Dict[str, Dict]:
+    """Stats for every cascade in this process"""
+    return {name: cascade.stats() for name, cascade in _registry.items()}
@@ -0,0 +1,114 @@
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+MASK_FORMATS = ("rle", "polygon")
+
+
+def rle_encode(mask: np.ndarray) -> Dict:
+    """
+    Run-length encode a binary mask (COCO-style uncompressed RLE).
+
+    Pixels are read in column-major order and `counts` alternates runs of
+    0s and 1s, starting with 0s.
+    """
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(boundaries)
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts.tolist()}
+
+
+def rle_decode(rle: Dict) -> np.ndarray:
+    """Inverse of rle_encode"""
+    height, width = rle["size"]
+    values = np.zeros(len(rle["counts"]), dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, rle["counts"])
+    return flat.reshape((height, width), order="F")
+
+
+def mask_to_polygons(mask: np.ndarray, tolerance: float = 1.0) -> List[List[int]]:
+    """Outer contours of a binary mask as flat [x0, y0, x1, y1, ...] lists"""
+    contours, _ = cv2.findContours(
+        np.asarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    )
+    polygons = []
+    for contour in contours:
+        if tolerance > 0:
+            contour = cv2.approxPolyDP(contour, tolerance, True)
+        if len(contour) >= 3:
+            polygons.append(contour.reshape(-1).astype(int).tolist())
+    return polygons
+
+
+def encode_masks(masks: np.ndarray,
+                 mask_format: str = "rle",
+                 threshold: float = 0.5,
+                 downsample: int = 1,
+                 letterbox=None) -> Dict:
+    """
+    Encode an (N, H, W) stack of soft masks compactly.
+
+    Masks are thresholded to binary, optionally mapped out of the YOLO
+    letterbox back to the original image frame, and downsampled by an
+    integer factor before RLE or polygon encoding.
+    """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format '{mask_format}', expected one of {MASK_FORMATS}")
+    downsample = max(1, int(downsample))
+
+    encoded = []
+    size = None
+    for mask in np.asarray(masks):
+        binary = (mask > threshold).astype(np.uint8)
+        if letterbox is not None:
+            height, width = letterbox.original_shape
+            size = (max(1, height // downsample), max(1, width // downsample))
+            binary = letterbox.mask_to_original(binary, size=size)
+        elif downsample > 1:
+            size = (max(1, binary.shape[0] // downsample), max(1, binary.shape[1] // downsample))
+            binary = cv2.resize(binary, (size[1], size[0]), interpolation=cv2.INTER_NEAREST)
+        else:
+            size = binary.shape
+
+        if mask_format == "rle":
+            encoded.append(rle_encode(binary))
+        else:
+            encoded.append(mask_to_polygons(binary))
+
+    return {
+        "format": mask_format,
+        "size": [int(size[0]), int(size[1])] if size is not None else None,
+        "downsample": downsample,
+        "masks": encoded
+    }
+
+
+def encode_detections(boxes: np.ndarray,
+                      scores: np.ndarray,
+                      class_ids: np.ndarray,
+                      names=None,
+                      decimals: int = 1) -> Dict:
+    """
+    Detections as parallel typed columns instead of one nested list per box.
+
+    `names` is the model's class-name mapping (dict or list).
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    class_ids = np.asarray(class_ids).astype(np.int32).reshape(-1).tolist()
+    if isinstance(names, dict):
+        class_names = [names.get(i, str(i)) for i in class_ids]
+    elif names is not None:
+        class_names = [names[i] if i < len(names) else str(i) for i in class_ids]
+    else:
+        class_names = [str(i) for i in class_ids]
+    return {
+        "boxes": boxes.round(decimals).tolist(),
+        "scores": np.asarray(scores, dtype=np.float32).reshape(-1).round(3).tolist(),
+        "class_ids": class_ids,
+        "class_names": class_names
+    }
@@ -0,0 +1,176 @@
+import os
+from typing import Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from .telemetry import span
+
+
+class Letterbox:
+    """A resized-and-padded copy of an image plus the transform back to the original"""
+
+    def __init__(self, array: np.ndarray, scale: float, pad: Tuple[int, int], original_shape: Tuple[int, int]):
+        self.array = array
+        self.scale = scale
+        self.pad = pad
+        self.original_shape = original_shape
+
+    def boxes_to_original(self, boxes: np.ndarray) -> np.ndarray:
+        """Map xyxy boxes (first four columns) from letterbox to original pixels"""
+        boxes = np.array(boxes, dtype=np.float32, copy=True)
+        if boxes.size == 0:
+            return boxes
+        pad_x, pad_y = self.pad
+        height, width = self.original_shape
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / self.scale).clip(0, width)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / self.scale).clip(0, height)
+        return boxes
+
+    def mask_to_original(self, mask: np.ndarray, size: Tuple[int, int] = None) -> np.ndarray:
+        """
+        Crop the padding off a letterbox-frame mask and resize it to the
+        original image, or to `size` (height, width) if given
+        """
+        pad_x, pad_y = self.pad
+        height, width = self.original_shape
+        # Masks may come back at a lower resolution than the letterbox
+        ratio = mask.shape[0] / self.array.shape[0]
+        top, left = int(round(pad_y * ratio)), int(round(pad_x * ratio))
+        content_h = int(round(height * self.scale * ratio))
+        content_w = int(round(width * self.scale * ratio))
+        cropped = mask[top:top + content_h, left:left + content_w]
+        out_h, out_w = size or (height, width)
+        return cv2.resize(cropped, (out_w, out_h), interpolation=cv2.INTER_NEAREST)
+
+
+class ImageInput:
+    """
+    One decoded image shared by every analyzer handling a request.
+
+    The image is decoded once into an RGB uint8 buffer. Model-specific views
+    (resized arrays, the CLIP pixel tensor, the YOLO letterbox) are derived
+    from that buffer on first use and cached, so no analyzer re-decodes the
+    file or round-trips it through float64 or PIL.
+    """
+
+    def __init__(self, rgb: np.ndarray, source: str = None):
+        if rgb.dtype != np.uint8 or rgb.ndim != 3 or rgb.shape[2] != 3:
+            raise ValueError("ImageInput expects an RGB uint8 array of shape (height, width, 3)")
+        self.rgb = rgb
+        self.source = source
+        self._views = {}
+
+    @classmethod
+    def from_path(cls, path: str) -> "ImageInput":
+        """Decode an image file"""
+        with span("image.decode"):
+            bgr = cv2.imread(path, cv2.IMREAD_COLOR)
+            if bgr is None:
+                raise ValueError(f"Could not read image {os.path.basename(path)}")
+            return cls(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=bgr), source=path)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, source: str = None) -> "ImageInput":
+        """Decode an encoded image held in memory (e.g. an upload)"""
+        with span("image.decode"):
+            bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if bgr is None:
+                raise ValueError("Could not decode image")
+            return cls(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=bgr), source=source)
+
+    @classmethod
+    def coerce(cls, image: Union["ImageInput", str, bytes, np.ndarray, Image.Image]) -> "ImageInput":
+        """Accept an ImageInput, a path, encoded bytes, an RGB array or a PIL image"""
+        if isinstance(image, ImageInput):
+            return image
+        if isinstance(image, (str, os.PathLike)):
+            return cls.from_path(str(image))
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return cls.from_bytes(bytes(image))
+        if isinstance(image, Image.Image):
+            return cls(np.asarray(image.convert("RGB")))
+        if isinstance(image, np.ndarray):
+            return cls(np.ascontiguousarray(image))
+        raise TypeError(f"Unsupported image type {type(image).__name__}")
+
+    @property
+    def height(self) -> int:
+        return self.rgb.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.rgb.shape[1]
+
+    def view(self, key, build):
+        """Return a cached derived view of the image, building it on first use"""
+        view = self._views.get(key)
+        if view is None:
+            # Timed per view kind: resize, CLIP tensor, YOLO letterbox, embeddings
+            with span("image.view", model=key[0] if isinstance(key, tuple) else key):
+                view = self._views[key] = build()
+        return view
+
+    def resized(self, size: Tuple[int, int] = (224, 224)) -> np.ndarray:
+        """RGB uint8 array resized to (width, height)"""
+        def build():
+            shrinking = size[0] < self.width or size[1] < self.height
+            return cv2.resize(self.rgb, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+        return self.view(("resized", size), build)
+
+    def pil(self) -> Image.Image:
+        """PIL view of the decoded buffer, for APIs that insist on one"""
+        return self.view("pil", lambda: Image.fromarray(self.rgb))
+
+    def clip_pixel_values(self, processor) -> torch.Tensor:
+        """
+        The (1, 3, H, W) float32 tensor CLIP expects: shortest-edge resize,
+        center crop and mean/std normalization, done straight from uint8.
+
+        The resize goes through PIL with the processor's resampling filter
+        (bicubic) and its output size rounding, as CLIPImageProcessor does;
+        cv2's bicubic and area filters differ from PIL's by up to 0.18 after
+        normalization, enough to move zero-shot scores.
+        """
+        def build():
+            image_processor = getattr(processor, "image_processor", processor)
+            shortest_edge = image_processor.size.get("shortest_edge", 224)
+            crop_h = image_processor.crop_size["height"]
+            crop_w = image_processor.crop_size["width"]
+
+            short, long = sorted((self.height, self.width))
+            long = int(shortest_edge * long / short)
+            new_h, new_w = (long, shortest_edge) if self.width <= self.height else (shortest_edge, long)
+            new_w, new_h = max(crop_w, new_w), max(crop_h, new_h)
+            resample = getattr(image_processor, "resample", Image.BICUBIC)
+            resized = np.asarray(self.pil().resize((new_w, new_h), resample=resample))
+
+            top = (new_h - crop_h) // 2
+            left = (new_w - crop_w) // 2
+            crop = resized[top:top + crop_h, left:left + crop_w]
+
+            mean = np.asarray(image_processor.image_mean, dtype=np.float32) * 255.0
+            inv_std = 1.0 / (np.asarray(image_processor.image_std, dtype=np.float32) * 255.0)
+            pixels = (crop.astype(np.float32) - mean) * inv_std
+            return torch.from_numpy(np.ascontiguousarray(pixels.transpose(2, 0, 1)))[None]
+        return self.view(("clip", id(processor)), build)
+
+    def yolo_letterbox(self, size: int = 640, pad_value: int = 114) -> Letterbox:
+        """
+        BGR uint8 square letterbox for YOLO, so the detector neither converts
+        nor resizes the image again
+        """
+        def build():
+            scale = min(size / self.height, size / self.width)
+            new_w, new_h = int(round(self.width * scale)), int(round(self.height * scale))
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            resized = cv2.resize(self.rgb, (new_w, new_h), interpolation=interpolation)
+
+            pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+            canvas = np.full((size, size, 3), pad_value, dtype=np.uint8)
+            canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+            cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR, dst=canvas)
+            return Letterbox(canvas, scale, (pad_x, pad_y), (self.height, self.width))
+        return self.view(("yolo", size), build)
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LABELS_PATH = os.path.join(os.path.dirname(__file__), "data", "clip_labels.json")
+DEFAULT_CACHE_DIR = os.path.join("models", "label_bank")
+
+# Banks whose encoding build() deferred, for encode_pending()
+_pending: List["LabelBank"] = []
+_pending_lock = threading.Lock()
+
+
+def encode_pending() -> int:
+    """Encode every label bank whose encoding was deferred; returns how many"""
+    with _pending_lock:
+        banks = list(_pending)
+        _pending.clear()
+    for bank in banks:
+        bank.encode()
+    return len(banks)
+
+
+def text_variant(model) -> str:
+    """
+    dtype of the text tower and whether its Linear layers are quantized, so
+    embeddings from int8 and fp32 processes never share a cache entry
+    """
+    modules = [module for module in (getattr(model, "text_model", None), getattr(model, "text_projection", None))
+               if module is not None] or [model]
+    dtype = next((p.dtype for module in modules for p in module.parameters()), torch.float32)
+    quantized = any(
+        type(sub).__module__.startswith("torch.ao.nn.quantized")
+        for module in modules for sub in module.modules()
+    )
+    return f"{str(dtype).replace('torch.', '')}{'+int8' if quantized else ''}"
+
+
+class LabelBank:
+    """
+    Zero-shot label set backed by precomputed CLIP text embeddings.
+
+    Each label has a name, a hierarchical group ("chest_xray/abnormal") and
+    one or more prompts. Prompt embeddings are encoded once, averaged per
+    label, L2-normalized and stacked into a (labels x dim) matrix, so scoring
+    an image is a single matrix multiply against its image embedding.
+    """
+
+    def __init__(self, labels: List[Dict], template: str = "{}"):
+        if not labels:
+            raise ValueError("A label bank needs at least one label")
+        self.names = [label["name"] for label in labels]
+        self.groups = [label.get("group", "") for label in labels]
+        self.prompts = [label.get("prompts") or [template.format(label["name"])] for label in labels]
+        self.matrix: Optional[np.ndarray] = None
+        self.logit_scale = 100.0
+        self._source = None
+        self._encode_lock = threading.Lock()
+
+        # Every prefix of every group path maps to the label rows under it
+        members: Dict[str, List[int]] = {}
+        for row, group in enumerate(self.groups):
+            parts = group.split("/") if group else []
+            for depth in range(1, len(parts) + 1):
+                members.setdefault("/".join(parts[:depth]), []).append(row)
+        self._group_index = {group: np.array(rows) for group, rows in members.items()}
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "LabelBank":
+        """Load labels from a JSON file with a `labels` list and optional `template`"""
+        path = path or os.getenv("CLIP_LABEL_BANK_PATH", DEFAULT_LABELS_PATH)
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["labels"], template=data.get("template", "{}"))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def group_names(self) -> List[str]:
+        return sorted(self._group_index)
+
+    def fingerprint(self, model_id: str, revision: str, variant: str = "") -> str:
+        """Cache key covering the model revision, its text tower variant and every prompt"""
+        digest = hashlib.sha256(f"{model_id}@{revision}:{variant}".encode())
+        for prompts in self.prompts:
+            digest.update(json.dumps(prompts).encode())
+        return digest.hexdigest()[:24]
+
+    def build(self, model, processor, cache_dir: Optional[str] = None, batch_size: int = 256,
+              defer: Optional[bool] = None) -> "LabelBank":
+        """
+        Encode the prompts with the CLIP text tower, or load them from the
+        on-disk cache if this model revision has encoded them before.
+
+        With `defer` (LABEL_BANK_DEFER_ENCODING, set by the preload-then-fork
+        server) a cache miss is not encoded here but by encode_pending(), or
+        on first use, so the loading process runs no forward pass.
+        """
+        model_id = getattr(model.config, "_name_or_path", "clip")
+        revision = getattr(model.config, "_commit_hash", None) or "unknown"
+        self.logit_scale = float(model.logit_scale.exp())
+
+        cache_dir = cache_dir or os.getenv("LABEL_BANK_CACHE_DIR", DEFAULT_CACHE_DIR)
+        cache_path = os.path.join(cache_dir, f"{self.fingerprint(model_id, revision, text_variant(model))}.npy")
+        if os.path.exists(cache_path):
+            self.matrix = np.load(cache_path)
+            logger.info(f"Loaded {len(self)} label embeddings from {cache_path}")
+            return self
+
+        self._source = (model, processor, cache_path, batch_size)
+        if defer is None:
+            defer = os.getenv("LABEL_BANK_DEFER_ENCODING", "false").lower() in ("1", "true", "yes")
+        if defer:
+            with _pending_lock:
+                _pending.append(self)
+            logger.info(f"Deferred encoding {len(self)} labels")
+            return self
+        return self.encode()
+
+    def encode(self) -> "LabelBank":
+        """Encode the prompts given to build(), unless that is already done"""
+        with self._encode_lock:
+            if self.matrix is not None or self._source is None:
+                return self
+            model, processor, cache_path, batch_size = self._source
+            flat_prompts = [prompt for prompts in self.prompts for prompt in prompts]
+            embeddings = []
+            with torch.inference_mode():
+                for start in range(0, len(flat_prompts), batch_size):
+                    tokens = processor.tokenizer(
+                        flat_prompts[start:start + batch_size],
+                        padding=True,
+                        truncation=True,
+                        return_tensors="pt"
+                    )
+                    embeddings.append(model.get_text_features(**tokens))
+            embeddings = torch.nn.functional.normalize(torch.cat(embeddings), dim=-1).numpy()
+
+            # Average each label's prompt embeddings and renormalize
+            matrix = np.empty((len(self), embeddings.shape[1]), dtype=np.float32)
+            offset = 0
+            for row, prompts in enumerate(self.prompts):
+                matrix[row] = embeddings[offset:offset + len(prompts)].mean(axis=0)
+                offset += len(prompts)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+            self.matrix = matrix
+            self._source = None
+
+            try:
+                # Several workers may encode the same bank; never leave a partial file
+                os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+                tmp = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, matrix)
+                os.replace(tmp, cache_path)
+            except OSError as e:
+                logger.warning(f"Could not persist label embeddings to {cache_path}: {str(e)}")
+            logger.info(f"Encoded {len(self)} labels ({len(flat_prompts)} prompts)")
+        return self
+
+    def _encoded(self) -> np.ndarray:
+        if self.matrix is None:
+            self.encode()
+        if self.matrix is None:
+            raise RuntimeError("Label bank has not been built")
+        return self.matrix
+
+    def probabilities(self, image_embeds, group: Optional[str] = None):
+        """
+        Softmax over label similarities for one image embedding.
+
+        With `group`, only labels under that group prefix compete. Returns
+        (row indices, probabilities).
+        """
+        self._encoded()
+        if isinstance(image_embeds, torch.Tensor):
+            image_embeds = image_embeds.detach().cpu().numpy()
+        image_embeds = np.asarray(image_embeds, dtype=np.float32).reshape(-1)
+        image_embeds = image_embeds / np.linalg.norm(image_embeds)
+
+        if group:
+            rows = self._group_index[group]
+            logits = self.logit_scale * (self.matrix[rows] @ image_embeds)
+        else:
+            rows = np.arange(len(self))
+            logits = self.logit_scale * (self.matrix @ image_embeds)
+        logits -= logits.max()
+        probs = np.exp(logits)
+        return rows, probs / probs.sum()
+
+    def subgroups(self, leaf: str) -> List[str]:
+        """Every group whose last path segment is `leaf` (e.g. all ".../normal" groups)"""
+        return [group for group in self._group_index if group.split("/")[-1] == leaf]
+
+    def group_probability(self, image_embeds, groups: List[str], within: Optional[str] = None) -> np.ndarray:
+        """
+        Probability mass of `groups` for a batch of image embeddings (batch x dim).
+
+        With `within`, only labels under that group compete in the softmax.
+        """
+        self._encoded()
+        if isinstance(image_embeds, torch.Tensor):
+            image_embeds = image_embeds.detach().cpu().numpy()
+        image_embeds = np.asarray(image_embeds, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        image_embeds = image_embeds / np.linalg.norm(image_embeds, axis=1, keepdims=True)
+
+        rows = self._group_index[within] if within else np.arange(len(self))
+        logits = self.logit_scale * (image_embeds @ self.matrix[rows].T)
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+
+        selected = np.zeros(len(self), dtype=bool)
+        for group in groups:
+            selected[self._group_index.get(group, [])] = True
+        return probs[:, selected[rows]].sum(axis=1)
+
+    def score(self, image_embeds, top_k: int = 3, group: Optional[str] = None) -> Dict:
+        """
+        Rank labels for an image embedding and aggregate probability per group
+        """
+        rows, probs = self.probabilities(image_embeds, group)
+        k = min(top_k, len(rows))
+        top = np.argpartition(-probs, k - 1)[:k]
+        top = top[np.argsort(-probs[top])]
+
+        full = np.zeros(len(self), dtype=np.float32)
+        full[rows] = probs
+        group_scores = {
+            name: float(full[members].sum())
+            for name, members in self._group_index.items()
+            if not group or name == group or name.startswith(group + "/")
+        }
+        return {
+            "labels": [
+                {
+                    "condition": self.names[rows[i]],
+                    "group": self.groups[rows[i]],
+                    "confidence": float(probs[i])
+                }
+                for i in top
+            ],
+            "groups": group_scores
+        }
@@ -0,0 +1,232 @@
+import json
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(__file__), "data", "medical_lexicon.json")
+
+TERM_CATEGORIES = ("symptoms", "conditions", "medications", "allergies")
+CUE_TYPES = ("negation", "family", "allergy", "terminators")
+
+# Characters that close a negation/family/allergy scope
+SCOPE_BREAKS = ".;!?\n"
+
+# Negation also stops at a clause break: in "no fever, cough" only the fever
+# is denied. Family and allergy scopes carry across commas, which list
+# relatives' conditions or allergens ("allergic to penicillin, sulfa").
+NEGATION_BREAKS = SCOPE_BREAKS + ",:"
+
+
+class AhoCorasick:
+    """
+    Multi-pattern string matcher.
+
+    Patterns are compiled into a trie with failure links once, after which
+    every occurrence of every pattern is found in a single pass over the text.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self._lengths: List[int] = []
+        self._built = False
+
+    def add(self, pattern: str) -> int:
+        """Add a pattern and return its id"""
+        if self._built:
+            raise RuntimeError("Cannot add patterns after the automaton is built")
+        node = 0
+        for char in pattern:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        pattern_id = len(self._lengths)
+        self._out[node].append(pattern_id)
+        self._lengths.append(len(pattern))
+        return pattern_id
+
+    def build(self):
+        """Compute failure links breadth-first and merge their outputs"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield (start, end, pattern_id) for every occurrence in text"""
+        if not self._built:
+            self.build()
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_id in out[node]:
+                yield i + 1 - lengths[pattern_id], i + 1, pattern_id
+
+
+class MedicalTermExtractor:
+    """
+    Extract symptoms, conditions, medications and allergies from free text.
+
+    All lexicon terms, their synonyms and the context cues (negation, family
+    history, allergy) are compiled into one automaton, so extraction is one
+    linear pass over the text regardless of vocabulary size.
+    """
+
+    def __init__(self, lexicon: Dict, negation_window: int = 5, context_window: int = 8):
+        self.negation_window = negation_window
+        self.context_window = context_window
+        self._matcher = AhoCorasick()
+        self._patterns: List[List[Tuple[str, str]]] = []
+        self._pattern_ids: Dict[str, int] = {}
+
+        for category in TERM_CATEGORIES:
+            for canonical, synonyms in lexicon.get(category, {}).items():
+                for surface in [canonical] + list(synonyms):
+                    self._add(surface, category, canonical)
+
+        for cue_type in CUE_TYPES:
+            for surface in lexicon.get("cues", {}).get(cue_type, []):
+                self._add(surface, "cue", cue_type)
+
+        self._matcher.build()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "MedicalTermExtractor":
+        """Build an extractor from a JSON lexicon file"""
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def _add(self, surface: str, category: str, value: str):
+        surface = surface.strip().lower()
+        if not surface:
+            return
+        pattern_id = self._pattern_ids.get(surface)
+        if pattern_id is None:
+            pattern_id = self._matcher.add(surface)
+            self._pattern_ids[surface] = pattern_id
+            self._patterns.append([])
+        if (category, value) not in self._patterns[pattern_id]:
+            self._patterns[pattern_id].append((category, value))
+
+    def _matches(self, text: str) -> List[Tuple[int, int, int]]:
+        """Whole-word matches with overlaps resolved leftmost-longest"""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+        matches = [
+            (start, end, pattern_id)
+            for start, end, pattern_id in self._matcher.iter_matches(lowered)
+            if (start == 0 or not lowered[start - 1].isalnum())
+            and (end == len(lowered) or not lowered[end].isalnum())
+        ]
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+
+        resolved = []
+        last_end = -1
+        for match in matches:
+            if match[0] >= last_end:
+                resolved.append(match)
+                last_end = match[1]
+        return resolved
+
+    def _in_scope(self, text: str, cue_end: Optional[int], start: int, window: int,
+                  breaks: str = SCOPE_BREAKS) -> bool:
+        """Is a term starting at `start` within `window` words of a cue ending at `cue_end`?"""
+        if cue_end is None or start - cue_end > window * 16:
+            return False
+        gap = text[cue_end:start]
+        if any(c in gap for c in breaks):
+            return False
+        return len(gap.split()) <= window
+
+    def extract(self, text: str) -> List[Dict]:
+        """
+        Return every lexicon term mentioned in text with its context flags
+        """
+        mentions = []
+        last_cue = {cue_type: None for cue_type in CUE_TYPES}
+
+        for start, end, pattern_id in self._matches(text):
+            values = self._patterns[pattern_id]
+            cues = [value for category, value in values if category == "cue"]
+            if cues:
+                for cue_type in cues:
+                    last_cue[cue_type] = end
+                if "terminators" in cues:
+                    last_cue = {cue_type: None for cue_type in CUE_TYPES}
+                continue
+
+            negated = self._in_scope(text, last_cue["negation"], start, self.negation_window, NEGATION_BREAKS)
+            family = self._in_scope(text, last_cue["family"], start, self.context_window)
+            allergy = self._in_scope(text, last_cue["allergy"], start, self.context_window)
+
+            # A surface form can belong to several categories (penicillin is both
+            # a medication and an allergen); the allergy cue decides which applies
+            categories = dict(values)
+            if allergy and "allergies" in categories:
+                category = "allergies"
+            else:
+                category = next((c for c, _ in values if c != "allergies"), None)
+                if category is None:
+                    continue
+
+            mentions.append({
+                "term": categories[category],
+                "category": category,
+                "text": text[start:end],
+                "span": [start, end],
+                "negated": negated,
+                "family": family
+            })
+        return mentions
+
+    def summarize(self, text: str) -> Dict[str, List[str]]:
+        """
+        Group extracted terms the way TextAnalyzer reports them
+        """
+        summary = {
+            "symptoms": [],
+            "negated_symptoms": [],
+            "conditions": [],
+            "medications": [],
+            "allergies": [],
+            "family_history": []
+        }
+        for mention in self.extract(text):
+            category = mention["category"]
+            if mention["negated"]:
+                key = "negated_symptoms" if category == "symptoms" else None
+            elif mention["family"] and category == "conditions":
+                key = "family_history"
+            else:
+                key = category
+            if key and mention["term"] not in summary[key]:
+                summary[key].append(mention["term"])
+        return summary
+
+
+@lru_cache(maxsize=None)
+def load_term_extractor(path: Optional[str] = None) -> MedicalTermExtractor:
+    """
+    Build (once per process) the extractor for the configured lexicon file
+    """
+    return MedicalTermExtractor.from_file(path or os.getenv("MEDICAL_LEXICON_PATH", DEFAULT_LEXICON_PATH))
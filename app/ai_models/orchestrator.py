@@ -1,24 +1,100 @@
-from typing import Dict, List, Union
-from .vision import VisionAnalyzer
-from .audio import AudioAnalyzer
-from .video import VideoAnalyzer
-from .text import TextAnalyzer
+import importlib
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Union
+from .cancellation import CancelToken, Cancelled, check
+from .bundle import load_parallel
+from .residency import ResidencyManager
+from .telemetry import span
+
+if TYPE_CHECKING:
+    from .image_input import ImageInput
+
+# Analyzer module and class per modality. Modules are imported on first use,
+# so a process only pays for the frameworks of the modalities it serves.
+ANALYZERS = {
+    "vision": (".vision", "VisionAnalyzer"),
+    "audio": (".audio", "AudioAnalyzer"),
+    "video": (".video", "VideoAnalyzer"),
+    "text": (".text", "TextAnalyzer"),
+}
 
 class AIOrchestrator:
-    def __init__(self):
-        self.vision_analyzer = VisionAnalyzer()
-        self.audio_analyzer = AudioAnalyzer()
-        self.video_analyzer = VideoAnalyzer()
-        self.text_analyzer = TextAnalyzer()
+    def __init__(self,
+                 preload: Optional[Iterable[str]] = None,
+                 on_load: Optional[Callable] = None,
+                 residency: Optional[ResidencyManager] = None):
+        """
+        Analyzers are created the first time their modality is used, or up
+        front for the names in `preload`. `on_load(name, analyzer)` runs
+        after each one is created. The residency manager (configured from
+        MODEL_MEMORY_BUDGET_MB, MODEL_PINNED and MODEL_IDLE_EVICT_SECONDS by
+        default) unloads idle analyzers to stay within the memory budget.
+        """
+        self.residency = residency or ResidencyManager(
+            {name: (lambda name=name: self._create(name)) for name in ANALYZERS},
+            on_load=on_load
+        )
+        if preload:
+            self.preload(preload)
+            
+    @staticmethod
+    def _create(name: str):
+        module, cls = ANALYZERS[name]
+        return getattr(importlib.import_module(module, __package__), cls)()
+        
+    def analyzer(self, name: str):
+        """The analyzer for a modality, importing and loading it on first use"""
+        return self.residency.get(name)
+        
+    def preload(self, names: Optional[Iterable[str]] = None):
+        """Load analyzers ahead of traffic; independent models load concurrently"""
+        loaded = self.loaded()
+        names = [name for name in (names or ANALYZERS) if name not in loaded]
+        # Import sequentially (imports share a lock anyway), then construct in parallel
+        for name in names:
+            importlib.import_module(ANALYZERS[name][0], __package__)
+        load_parallel({name: (lambda name=name: self.analyzer(name)) for name in names})
+        
+    def loaded(self) -> Dict:
+        """Analyzers currently loaded, by modality"""
+        return self.residency.resident()
+        
+    @property
+    def vision_analyzer(self):
+        return self.analyzer("vision")
+        
+    @property
+    def audio_analyzer(self):
+        return self.analyzer("audio")
+        
+    @property
+    def video_analyzer(self):
+        return self.analyzer("video")
+        
+    @property
+    def text_analyzer(self):
+        return self.analyzer("text")
         
     def analyze_input(self, 
                      text: str = None,
                      image_path: str = None,
                      audio_path: str = None,
-                     video_path: str = None) -> Dict:
+                     video_path: str = None,
+                     image: "ImageInput" = None,
+                     progress: Optional[Callable] = None,
+                     cancel: Optional[CancelToken] = None,
+                     vision_results: Optional[Dict] = None) -> Dict:
         """
         Analyze all provided inputs and generate a comprehensive medical assessment
+        
+        An already-decoded `image` can be passed instead of `image_path`, or
+        the image's `vision_results` when they were computed in a batch.
+        `progress(modality, done, total, result=None)` is called as each
+        modality starts, advances and finishes (with its result).
+        If the `cancel` token fires, analysis stops within one frame, window
+        or batch and the modalities finished so far are returned, with the
+        reason under "cancelled".
         """
+        report = progress or (lambda *args, **kwargs: None)
         try:
             results = {
                 "text_analysis": None,
@@ -32,35 +108,127 @@ class AIOrchestrator:
             
             # Analyze text if provided
             if text:
-                text_results = self.text_analyzer.analyze_symptoms(text)
+                check(cancel)
+                report("text", 0, 1)
+                with span("analyze.text"), self.residency.use("text") as text_analyzer:
+                    text_results = text_analyzer.analyze_symptoms(text, cancel=cancel)
                 results["text_analysis"] = text_results
+                report("text", 1, 1, text_results)
                 
-            # Analyze image if provided
-            if image_path:
-                vision_results = self.vision_analyzer.analyze_image(image_path)
+            # Analyze image if provided, decoding it once for every vision model
+            if vision_results is not None:
+                results["vision_analysis"] = vision_results
+                report("vision", 1, 1, vision_results)
+            elif image is None and image_path:
+                from .tiling import load_image
+                image = load_image(image_path)
+            if vision_results is None and image is not None:
+                check(cancel)
+                report("vision", 0, 1)
+                with span("analyze.vision"), self.residency.use("vision") as vision_analyzer:
+                    vision_results = vision_analyzer.analyze_image(image, cancel=cancel)
                 results["vision_analysis"] = vision_results
+                report("vision", 1, 1, vision_results)
                 
             # Analyze audio if provided
             if audio_path:
-                audio_results = self.audio_analyzer.analyze_audio(audio_path)
+                check(cancel)
+                report("audio", 0, 1)
+                with span("analyze.audio"), self.residency.use("audio") as audio_analyzer:
+                    audio_results = audio_analyzer.analyze_audio(audio_path, cancel=cancel)
                 results["audio_analysis"] = audio_results
+                report("audio", 1, 1, audio_results)
                 
             # Analyze video if provided
             if video_path:
-                video_results = self.video_analyzer.analyze_video(video_path)
+                check(cancel)
+                with span("analyze.video"), self.residency.use("video") as video_analyzer:
+                    video_results = video_analyzer.analyze_video(
+                        video_path,
+                        progress=lambda done, total: report("video", done, total),
+                        cancel=cancel
+                    )
                 results["video_analysis"] = video_results
+                frame_count = video_results.get("frame_count", 0)
+                report("video", frame_count, frame_count, video_results)
                 
-            # Generate differential diagnosis
-            results["differential_diagnosis"] = self._generate_differential_diagnosis(results)
+            with span("aggregate"):
+                # Generate differential diagnosis
+                results["differential_diagnosis"] = self._generate_differential_diagnosis(results)
             
-            # Calculate confidence scores
-            results["confidence_scores"] = self._calculate_confidence_scores(results)
+                # Calculate confidence scores
+                results["confidence_scores"] = self._calculate_confidence_scores(results)
             
-            # Generate recommendations
-            results["recommendations"] = self._generate_recommendations(results)
+                # Generate recommendations
+                results["recommendations"] = self._generate_recommendations(results)
             
             return results
             
+        except Cancelled as e:
+            # Return whatever finished before the token fired
+            results["cancelled"] = str(e)
+            return results
+        except Exception as e:
+            return {"error": str(e)}
+            
+    def analyze_batch(self, cases: List[Dict], batch_size: int = 16,
+                      cancel: Optional[CancelToken] = None) -> List[Dict]:
+        """
+        Analyze several cases, each a dict of analyze_input arguments
+        
+        The images of all cases are encoded together (see
+        VisionAnalyzer.analyze_images), then each case's other modalities
+        run as in analyze_input. Returns one result per case, in order.
+        """
+        images = {
+            i: case.get("image") if case.get("image") is not None else case.get("image_path")
+            for i, case in enumerate(cases)
+            if case.get("image") is not None or case.get("image_path")
+        }
+        vision_results = {}
+        if images:
+            try:
+                check(cancel)
+                with span("analyze.vision"), self.residency.use("vision") as vision_analyzer:
+                    vision_results = dict(zip(images, vision_analyzer.analyze_images(
+                        list(images.values()), batch_size=batch_size, cancel=cancel
+                    )))
+            except Cancelled as e:
+                return [{"cancelled": str(e)} for _ in cases]
+            except Exception as e:
+                vision_results = {i: {"error": str(e)} for i in images}
+                
+        return [
+            self.analyze_input(
+                cancel=cancel,
+                vision_results=vision_results.get(i),
+                **{key: value for key, value in case.items() if key not in ("image", "image_path")}
+            )
+            for i, case in enumerate(cases)
+        ]
+        
+    def embed(self,
+              image: "ImageInput" = None,
+              audio_path: str = None,
+              cancel: Optional[CancelToken] = None) -> Dict:
+        """
+        Features for similar-case search without the rest of the analysis,
+        under the same keys as analyze_input ("vision_analysis",
+        "audio_analysis")
+        """
+        try:
+            results = {}
+            if image is not None:
+                check(cancel)
+                with span("embed.vision"), self.residency.use("vision") as vision_analyzer:
+                    results["vision_analysis"] = vision_analyzer.embed_image(image)
+            if audio_path:
+                check(cancel)
+                with span("embed.audio"), self.residency.use("audio") as audio_analyzer:
+                    results["audio_analysis"] = audio_analyzer.analyze_audio(audio_path, cancel=cancel)
+            return results
+        except Cancelled as e:
+            return {"cancelled": str(e)}
         except Exception as e:
             return {"error": str(e)}
             
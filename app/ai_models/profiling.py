@@ -0,0 +1,251 @@
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+# What a request may ask for in X-Profile
+PROFILE_MODES = ("python", "torch", "all")
+
+# Set in the profiled call's context while a torch profiler session runs;
+# spans with a model there open record_function scopes named
+# SCOPE_PREFIX + "<stage>.<model>". Requests running alongside never see it.
+_torch_active: ContextVar[bool] = ContextVar("torch_profiled", default=False)
+SCOPE_PREFIX = "span:"
+_FORWARD_SCOPE = SCOPE_PREFIX + "model.forward."
+
+# One profiling session at a time: cProfile and the torch profiler are process-wide
+_session_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Another request is being profiled"""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into folded stacks"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        """One `root;...;leaf count` line per distinct stack (flamegraph.pl, speedscope)"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _top_functions(profile: cProfile.Profile, limit: int) -> List[Dict]:
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, name), (calls, total_calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": name,
+            "file": filename,
+            "line": line,
+            "calls": total_calls,
+            "self_ms": round(tottime * 1000, 3),
+            "cumulative_ms": round(cumtime * 1000, 3)
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:limit]
+
+
+def _model_scope(event) -> Optional[str]:
+    """The model whose forward scope an operator ran under, if any"""
+    parent = event.cpu_parent
+    while parent is not None:
+        if parent.name.startswith(_FORWARD_SCOPE):
+            return parent.name[len(_FORWARD_SCOPE):]
+        parent = parent.cpu_parent
+    return None
+
+
+def _top_operators(profiler, limit: int) -> Dict:
+    overall = [
+        {
+            "operator": avg.key,
+            "calls": avg.count,
+            "self_cpu_ms": round(avg.self_cpu_time_total / 1000, 3),
+            "cpu_total_ms": round(avg.cpu_time_total / 1000, 3)
+        }
+        for avg in profiler.key_averages()
+        if not avg.key.startswith(SCOPE_PREFIX)
+    ]
+    overall.sort(key=lambda row: row["self_cpu_ms"], reverse=True)
+
+    per_model: Dict[str, Dict[str, List]] = {}
+    for event in profiler.events():
+        model = _model_scope(event)
+        if model is None or event.name.startswith(SCOPE_PREFIX):
+            continue
+        entry = per_model.setdefault(model, {}).setdefault(event.name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += event.self_cpu_time_total / 1000
+    by_model = {
+        model: sorted(
+            ({"operator": name, "calls": calls, "self_cpu_ms": round(ms, 3)} for name, (calls, ms) in ops.items()),
+            key=lambda row: row["self_cpu_ms"], reverse=True
+        )[:limit]
+        for model, ops in per_model.items()
+    }
+    return {"overall": overall[:limit], "by_model": by_model}
+
+
+def torch_active() -> bool:
+    """Whether the current context is being torch-profiled"""
+    return _torch_active.get()
+
+
+def torch_scope(stage: str, model: str):
+    """record_function scope for a span, under the active torch profiler session"""
+    import torch
+    return torch.profiler.record_function(f"{SCOPE_PREFIX}{stage}.{model}")
+
+
+def profile_call(fn: Callable, mode: str = "python", sample_interval: float = 0.005, top: int = 30):
+    """
+    Run `fn()` under the sampling profiler and cProfile (`python`), the
+    torch profiler (`torch`) or all of them. Returns (result, artifact).
+    Raises ProfilerBusy when another call is being profiled.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another request is being profiled")
+    try:
+        python = mode in ("python", "all")
+        use_torch = mode in ("torch", "all")
+        sampler = StackSampler(threading.get_ident(), sample_interval) if python else None
+        profile = cProfile.Profile() if python else None
+        torch_profiler = None
+        if use_torch:
+            import torch
+            torch_profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+
+        started = time.perf_counter()
+        if torch_profiler is not None:
+            torch_profiler.__enter__()
+            active = _torch_active.set(True)
+        if sampler is not None:
+            sampler.start()
+            # On Python 3.12+ cProfile hooks every thread, so calls from
+            # requests running alongside may show up in the function table
+            profile.enable()
+        try:
+            result = fn()
+        finally:
+            if sampler is not None:
+                profile.disable()
+                sampler.stop()
+            if torch_profiler is not None:
+                _torch_active.reset(active)
+                torch_profiler.__exit__(None, None, None)
+        elapsed = time.perf_counter() - started
+
+        artifact = {"mode": mode, "wall_ms": round(elapsed * 1000, 3), "created": time.time()}
+        if python:
+            artifact["samples"] = sampler.samples
+            artifact["sample_interval_ms"] = sample_interval * 1000
+            artifact["top_functions"] = _top_functions(profile, top)
+            artifact["folded"] = sampler.folded()
+        if torch_profiler is not None:
+            artifact["torch_operators"] = _top_operators(torch_profiler, top)
+        return result, artifact
+    finally:
+        _session_lock.release()
+
+
+class ProfileStore:
+    """
+    Profile artifacts on disk, by request id: `<id>.json` with the summary
+    and `<id>.folded` with the sampled stacks. Only the newest `keep` are
+    kept.
+    """
+
+    def __init__(self, directory: Optional[str] = None, keep: Optional[int] = None):
+        self.directory = directory or os.getenv("PROFILES_DIR", "profiles")
+        self.keep = keep or int(os.getenv("PROFILES_KEEP", "100"))
+
+    def _path(self, request_id: str, ext: str) -> str:
+        if not re.fullmatch(r"[A-Za-z0-9_.-]{1,128}", request_id):
+            raise ValueError("Invalid request id")
+        return os.path.join(self.directory, f"{request_id}.{ext}")
+
+    def save(self, request_id: str, artifact: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        folded = artifact.pop("folded", None)
+        if folded is not None:
+            with open(self._path(request_id, "folded"), "w") as f:
+                f.write(folded)
+            artifact["folded_path"] = f"/profiles/{request_id}/folded"
+        with open(self._path(request_id, "json"), "w") as f:
+            json.dump(artifact, f)
+        self._prune()
+
+    def _prune(self):
+        summaries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in summaries[:max(0, len(summaries) - self.keep)]:
+            request_id = entry.name[:-len(".json")]
+            for ext in ("json", "folded"):
+                try:
+                    os.remove(os.path.join(self.directory, f"{request_id}.{ext}"))
+                except OSError:
+                    pass
+
+    def get(self, request_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(request_id, "json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def folded(self, request_id: str) -> Optional[str]:
+        try:
+            with open(self._path(request_id, "folded")) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def authorized(token: Optional[str]) -> bool:
+    """Profiling is off unless PROFILING_TOKEN is set, and then needs that token"""
+    expected = os.getenv("PROFILING_TOKEN")
+    return bool(expected) and token is not None and hmac.compare_digest(token, expected)
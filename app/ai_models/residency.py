@@ -0,0 +1,311 @@
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def process_rss() -> int:
+    """Current resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current, but the best portable fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def torch_modules(obj) -> List:
+    """torch modules held by an analyzer, directly or through a wrapper's `model` (runners, YOLO)"""
+    torch = sys.modules.get("torch")
+    if torch is None or not hasattr(obj, "__dict__"):
+        return []
+    modules = []
+    seen = set()
+    for value in vars(obj).values():
+        module = value if isinstance(value, torch.nn.Module) else getattr(value, "model", None)
+        if isinstance(module, torch.nn.Module) and id(module) not in seen:
+            seen.add(id(module))
+            modules.append(module)
+    return modules
+
+
+def tensor_bytes(obj) -> int:
+    """Bytes of the distinct parameter and buffer storages held by an analyzer"""
+    storages = {}
+    for module in torch_modules(obj):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            storages[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sum(storages.values())
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        # Hand freed heap pages back to the OS (glibc only)
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class _Resident:
+    def __init__(self, instance, footprint: int):
+        self.instance = instance
+        self.footprint = footprint
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        # Process that loaded it; in a forked child the pages are shared with that parent
+        self.pid = os.getpid()
+
+    @property
+    def inherited(self) -> bool:
+        return self.pid != os.getpid()
+
+
+class ResidencyManager:
+    """
+    Keeps loaded models within a memory budget.
+
+    Each name maps to a loader that builds the object holding a model (an
+    analyzer). Objects are loaded on first use; concurrent requests for the
+    same name wait for a single load. A loaded object's footprint is the
+    larger of its tensor bytes and the RSS growth while it loaded (which
+    covers non-torch state such as MediaPipe graphs and onnxruntime
+    sessions). When other loads overlapped with it (parallel preloading),
+    the RSS growth includes theirs, so only the tensor bytes are used.
+
+    When loading would exceed `budget_mb`, the least recently used objects
+    that are neither in use nor pinned are evicted first; they are loaded
+    again on their next use. With `idle_seconds`, objects unused for that
+    long are evicted by a background sweep. If nothing can be evicted the
+    load still proceeds and an `over_budget` event is recorded. Loads,
+    evictions and budget overruns are kept as recent events for `stats()`.
+    A budget of 0 disables eviction.
+
+    Objects loaded before a fork (app.server preloads in the parent) are
+    never evicted in the child: the parent still maps their pages, so
+    evicting frees nothing and reloading makes a private copy.
+    """
+
+    def __init__(self,
+                 loaders: Dict[str, Callable[[], Any]],
+                 budget_mb: Optional[float] = None,
+                 pinned: Optional[Iterable[str]] = None,
+                 idle_seconds: Optional[float] = None,
+                 on_load: Optional[Callable] = None,
+                 max_events: int = 256):
+        if budget_mb is None:
+            budget_mb = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+        if pinned is None:
+            pinned = [name.strip() for name in os.getenv("MODEL_PINNED", "").split(",") if name.strip()]
+        if idle_seconds is None:
+            idle_seconds = float(os.getenv("MODEL_IDLE_EVICT_SECONDS", "0"))
+        unknown = set(pinned) - set(loaders)
+        if unknown:
+            raise ValueError(f"Cannot pin unknown models: {', '.join(sorted(unknown))}")
+        self.loaders = loaders
+        self.budget_bytes = int(budget_mb * 2**20)
+        self.pinned = set(pinned)
+        self.idle_seconds = idle_seconds
+        self.on_load = on_load
+
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in loaders}
+        # Loads in progress, and whether another load overlapped with each
+        self._loading: Dict[str, bool] = {}
+        self._resident: Dict[str, _Resident] = {}
+        # Last measured footprint per name, used to make room before a reload
+        self._footprints: Dict[str, int] = {}
+        self._counts = {name: {"loads": 0, "evictions": 0, "hits": 0, "load_seconds": 0.0} for name in loaders}
+        self.events: Deque[Dict] = deque(maxlen=max_events)
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(entry.footprint for entry in self._resident.values())
+
+    def resident(self) -> Dict[str, Any]:
+        """Loaded objects by name"""
+        with self._lock:
+            return {name: entry.instance for name, entry in self._resident.items()}
+
+    def _event(self, kind: str, name: str, **details):
+        event = {"time": time.time(), "event": kind, "model": name, **details}
+        self.events.append(event)
+        logger.info(f"Model residency: {kind} {name} {details}")
+
+    def _acquire(self, name: str, lease: bool) -> Optional[_Resident]:
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._counts[name]["hits"] += 1
+                if lease:
+                    entry.in_use += 1
+            return entry
+
+    def _load(self, name: str, lease: bool) -> _Resident:
+        with self._load_locks[name]:
+            # Another request may have finished loading while we waited
+            entry = self._acquire(name, lease)
+            if entry is not None:
+                return entry
+            self._make_room(self._footprints.get(name, 0), exclude=name)
+
+            with self._lock:
+                for other in self._loading:
+                    self._loading[other] = True
+                self._loading[name] = bool(self._loading)
+            started = time.perf_counter()
+            rss_before = process_rss()
+            try:
+                instance = self.loaders[name]()
+            finally:
+                with self._lock:
+                    overlapped = self._loading.pop(name)
+            seconds = time.perf_counter() - started
+            footprint = tensor_bytes(instance)
+            if not overlapped:
+                footprint = max(footprint, process_rss() - rss_before)
+
+            entry = _Resident(instance, footprint)
+            if lease:
+                entry.in_use = 1
+            with self._lock:
+                self._resident[name] = entry
+                counts = self._counts[name]
+                kind = "reload" if counts["loads"] else "load"
+                counts["loads"] += 1
+                counts["load_seconds"] += seconds
+                self._footprints[name] = footprint
+            self._event(kind, name, footprint_mb=round(footprint / 2**20, 1), seconds=round(seconds, 3))
+        self._make_room(0, exclude=name)
+        if self.on_load is not None:
+            self.on_load(name, instance)
+        return entry
+
+    def _make_room(self, needed: int, exclude: Optional[str] = None, report: bool = True):
+        """Evict idle, unpinned objects, least recently used first, until `needed` more bytes fit"""
+        if not self.budget_bytes:
+            return
+        evicted = []
+        with self._lock:
+            candidates = sorted(
+                (entry.last_used, name) for name, entry in self._resident.items()
+                if name != exclude and name not in self.pinned and entry.in_use == 0 and not entry.inherited
+            )
+            while self.resident_bytes + needed > self.budget_bytes and candidates:
+                _, name = candidates.pop(0)
+                evicted.append((name, self._resident.pop(name).footprint))
+                self._counts[name]["evictions"] += 1
+            over = self.resident_bytes + needed > self.budget_bytes
+            resident_mb = round(self.resident_bytes / 2**20, 1)
+        for name, footprint in evicted:
+            self._event("evict", name, reason="budget", footprint_mb=round(footprint / 2**20, 1))
+        if over and report:
+            self._event("over_budget", exclude or "", resident_mb=resident_mb,
+                        needed_mb=round(needed / 2**20, 1), budget_mb=round(self.budget_bytes / 2**20, 1))
+        if evicted:
+            _release_memory()
+
+    def get(self, name: str):
+        """The object for `name`, loading it if needed (without holding it against eviction)"""
+        if name not in self.loaders:
+            raise KeyError(f"Unknown model '{name}'")
+        entry = self._acquire(name, lease=False) or self._load(name, lease=False)
+        return entry.instance
+
+    @contextmanager
+    def use(self, name: str) -> Iterator[Any]:
+        """Hold `name` loaded (and safe from eviction) for the block"""
+        if name not in self.loaders:
+            raise KeyError(f"Unknown model '{name}'")
+        entry = self._acquire(name, lease=True) or self._load(name, lease=True)
+        try:
+            yield entry.instance
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+                over = self.budget_bytes and self.resident_bytes > self.budget_bytes
+            if over:
+                # A load that overran the budget while this was in use; settle now
+                self._make_room(0, report=False)
+
+    def evict(self, name: str, reason: str = "manual") -> bool:
+        """Unload `name` unless it is pinned, in use or inherited; returns whether it was evicted"""
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is None or name in self.pinned or entry.in_use or entry.inherited:
+                return False
+            del self._resident[name]
+            self._counts[name]["evictions"] += 1
+        self._event("evict", name, reason=reason, footprint_mb=round(entry.footprint / 2**20, 1))
+        del entry
+        _release_memory()
+        return True
+
+    def evict_idle(self) -> List[str]:
+        """Evict objects unused for `idle_seconds`"""
+        if not self.idle_seconds:
+            return []
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [name for name, entry in self._resident.items() if entry.last_used < cutoff]
+        return [name for name in idle if self.evict(name, reason="idle")]
+
+    def start(self):
+        """Start the idle sweep (if `idle_seconds` is set); call after forking"""
+        if not self.idle_seconds or self._sweeper is not None:
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep, name="model-residency", daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+
+    def _sweep(self):
+        interval = max(1.0, min(60.0, self.idle_seconds / 4))
+        while not self._stop.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error evicting idle models: {str(e)}")
+
+    def stats(self) -> Dict:
+        """Budget, per-model residency and footprints, and recent events"""
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for name in self.loaders:
+                entry = self._resident.get(name)
+                models[name] = {
+                    "resident": entry is not None,
+                    "pinned": name in self.pinned,
+                    "inherited": entry.inherited if entry else False,
+                    "in_use": entry.in_use if entry else 0,
+                    "footprint_mb": round(self._footprints.get(name, 0) / 2**20, 1),
+                    "idle_seconds": round(now - entry.last_used, 1) if entry else None,
+                    **self._counts[name]
+                }
+            return {
+                "budget_mb": round(self.budget_bytes / 2**20, 1),
+                "resident_mb": round(self.resident_bytes / 2**20, 1),
+                "idle_evict_seconds": self.idle_seconds,
+                "process_rss_mb": round(process_rss() / 2**20, 1),
+                "models": models,
+                "events": list(self.events)
+            }
@@ -0,0 +1,273 @@
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import profiling
+
+# Latency buckets in seconds, from a tokenizer call up to a long video
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """A gauge read at scrape time from `collect()`, which returns {label values: value}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            values = self.collect() if self.collect is not None else {}
+        except Exception as e:
+            return [f"# {self.name} unavailable: {_escape(str(e))}"]
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (non-cumulative, last is +Inf), sum, count
+        self._values: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Re-registering (e.g. on module reload) replaces the old metric
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+              collect: Optional[Callable] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "medai_stage_duration_seconds",
+    "Time spent in each analysis stage (decode, preprocess, model forward, per-frame work, ...)",
+    ("stage", "model")
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "medai_http_request_duration_seconds",
+    "End-to-end HTTP request latency",
+    ("method", "route", "status")
+)
+FRAMES_PROCESSED = REGISTRY.counter(
+    "medai_frames_processed_total",
+    "Video frames processed",
+    ("analyzer",)
+)
+
+
+class Trace:
+    """
+    Per-request breakdown of stage timings.
+
+    Spans recorded while a trace is bound (in this context or a thread that
+    bound it) are summed per stage. Only stages timed in threads that bind
+    the trace are included; pool threads inside an analyzer are not.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List] = {}
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    @contextmanager
+    def bind(self) -> Iterator["Trace"]:
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Call `fn` with this trace bound; for work handed to another thread"""
+        with self.bind():
+            return fn(*args, **kwargs)
+
+    def summary(self) -> Dict[str, Dict]:
+        """{stage: {"count", "total_ms"}} in the order stages first ran"""
+        with self._lock:
+            return {
+                stage: {"count": count, "total_ms": round(seconds * 1000, 3)}
+                for stage, (count, seconds) in self._stages.items()
+            }
+
+    def server_timing(self) -> str:
+        """The breakdown as a Server-Timing header value"""
+        entries = [
+            f'{stage};desc="x{stats["count"]}";dur={stats["total_ms"]}' if stats["count"] > 1
+            else f'{stage};dur={stats["total_ms"]}'
+            for stage, stats in self.summary().items()
+        ]
+        entries.append(f"total;dur={round((time.perf_counter() - self.started) * 1000, 3)}")
+        return ", ".join(entries)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def in_current_trace(fn: Callable) -> Callable:
+    """`fn` bound to the current trace, for running in a threadpool"""
+    trace = _current_trace.get()
+    if trace is None:
+        return fn
+    return functools.partial(trace.run, fn)
+
+
+def record(stage: str, seconds: float, model: Optional[str] = None):
+    """Add an already measured duration to the stage histogram and the current trace"""
+    STAGE_SECONDS.observe(seconds, stage=stage, model=model or "")
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(f"{stage}.{model}" if model else stage, seconds)
+
+
+@contextmanager
+def span(stage: str, model: Optional[str] = None):
+    """
+    Time a block into the stage histogram and the current request's trace.
+    While a request is torch-profiled, spans with a model also scope the
+    operators they run.
+    """
+    start = time.perf_counter()
+    scope = profiling.torch_scope(stage, model) if model and profiling.torch_active() else None
+    try:
+        if scope is None:
+            yield
+        else:
+            with scope:
+                yield
+    finally:
+        record(stage, time.perf_counter() - start, model)
+
+
+def count_frames(analyzer: str, frames: int = 1):
+    FRAMES_PROCESSED.inc(frames, analyzer=analyzer)
@@ -1,42 +1,80 @@
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional
+from .backends import InferenceRunner, backend_for
+from .bundle import get_bundle
+from .cancellation import Cancelled, check
+from .lexicon import load_term_extractor
+from .telemetry import span
+
+POOLING_STRATEGIES = ("max", "mean", "attention")
 
 class TextAnalyzer:
-    def __init__(self):
-        self.tokenizer = AutoTokenizer.from_pretrained("emilyalsentzer/Bio_ClinicalBERT")
-        self.model = AutoModelForSequenceClassification.from_pretrained("emilyalsentzer/Bio_ClinicalBERT")
+    def __init__(self,
+                 max_length: int = 512,
+                 window_overlap: int = 128,
+                 pooling: str = "max",
+                 max_windows_per_batch: int = 16,
+                 backend: Optional[str] = None,
+                 lexicon_path: Optional[str] = None):
+        if pooling not in POOLING_STRATEGIES:
+            raise ValueError(f"Unknown pooling strategy '{pooling}', expected one of {POOLING_STRATEGIES}")
+        bundle = get_bundle()
+        self.tokenizer = bundle.load_processor("bio_clinical_bert", AutoTokenizer)
+        self.model = bundle.load_model("bio_clinical_bert", AutoModelForSequenceClassification)
+        self.classifier = InferenceRunner(
+            self.model,
+            backend=backend or backend_for("bio_clinical_bert"),
+            output_names=("logits",),
+            name="bio_clinical_bert"
+        )
+        self.term_extractor = load_term_extractor(lexicon_path)
+        self.max_length = max_length
+        self.window_overlap = window_overlap
+        self.pooling = pooling
+        self.max_windows_per_batch = max_windows_per_batch
         
-    def analyze_symptoms(self, text: str) -> Dict:
+    def analyze_symptoms(self, text: str, long_document: bool = True, pooling: Optional[str] = None,
+                         cancel=None) -> Dict:
         """
         Analyze symptoms from text description
         """
         try:
-            inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-            outputs = self.model(**inputs)
-            predictions = torch.softmax(outputs.logits, dim=1)
+            predictions, windows = self._classify(text, long_document, pooling, cancel)
+            with span("text.terms"):
+                terms = self.term_extractor.summarize(text)
             
-            return {
-                "symptoms": self._extract_symptoms(text),
-                "confidence": predictions.detach().numpy().tolist()
+            results = {
+                "symptoms": terms["symptoms"],
+                "negated_symptoms": terms["negated_symptoms"],
+                "confidence": predictions.tolist()
             }
+            if windows:
+                results["windows"] = windows
+            return results
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
             
-    def analyze_medical_history(self, text: str) -> Dict:
+    def analyze_medical_history(self, text: str, long_document: bool = True, pooling: Optional[str] = None,
+                                cancel=None) -> Dict:
         """
         Analyze medical history from text
         """
         try:
-            inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-            outputs = self.model(**inputs)
-            predictions = torch.softmax(outputs.logits, dim=1)
+            predictions, windows = self._classify(text, long_document, pooling, cancel)
             
-            return {
+            results = {
                 "history": self._extract_medical_history(text),
-                "confidence": predictions.detach().numpy().tolist()
+                "confidence": predictions.tolist()
             }
+            if windows:
+                results["windows"] = windows
+            return results
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
             
@@ -46,27 +84,117 @@ class TextAnalyzer:
         """
         try:
             # Add logic to generate follow-up questions
-            return ["Can you describe the symptoms in more detail?", 
+            return ["Can you describe the symptoms in more detail?",
                    "When did you first notice these symptoms?",
                    "Have you experienced similar symptoms before?"]
         except Exception as e:
             return [f"Error generating questions: {str(e)}"]
             
-    def _extract_symptoms(self, text: str) -> List[str]:
+    def _classify(self, text: str, long_document: bool, pooling: Optional[str], cancel=None):
+        """
+        Classify text, splitting it into overlapping windows when it does not
+        fit in a single model input. Returns (probabilities, window report);
+        the report is None when the text fit in one window.
         """
-        Extract symptoms from text
+        if not long_document:
+            with span("preprocess", model="bio_clinical_bert"):
+                inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=self.max_length)
+            logits = self.classifier(**inputs)["logits"]
+            return torch.softmax(logits, dim=1).numpy(), None
+            
+        # Tokenize the whole note once; the fast tokenizer emits one row per
+        # window, each sharing `window_overlap` tokens with its neighbour.
+        with span("preprocess", model="bio_clinical_bert"):
+            inputs = self.tokenizer(
+                text,
+                return_tensors="pt",
+                truncation=True,
+                max_length=self.max_length,
+                stride=self.window_overlap,
+                return_overflowing_tokens=True,
+                return_offsets_mapping=True,
+                padding=True
+            )
+        offsets = inputs.pop("offset_mapping")
+        inputs.pop("overflow_to_sample_mapping", None)
+        num_windows = inputs["input_ids"].shape[0]
+        
+        if num_windows == 1:
+            logits = self.classifier(**inputs)["logits"]
+            return torch.softmax(logits, dim=1).numpy(), None
+            
+        logits = self._forward_windows(inputs, cancel)
+        pooled, weights = self._pool_windows(logits, pooling or self.pooling)
+        return pooled[np.newaxis, :], self._describe_windows(offsets, inputs["attention_mask"], weights, pooling or self.pooling)
+        
+    def _forward_windows(self, inputs, cancel=None) -> torch.Tensor:
+        """
+        Run all windows through the model as padded batches, checking the
+        cancel token between batches
+        """
+        num_windows = inputs["input_ids"].shape[0]
+        logits = []
+        for start in range(0, num_windows, self.max_windows_per_batch):
+            check(cancel)
+            batch = {k: v[start:start + self.max_windows_per_batch] for k, v in inputs.items()}
+            logits.append(self.classifier(**batch)["logits"])
+        return torch.cat(logits, dim=0)
+        
+    def _pool_windows(self, logits: torch.Tensor, pooling: str):
         """
-        # Add symptom extraction logic
-        return []
+        Pool per-window logits into one distribution.
+        
+        Returns the pooled probabilities and each window's share of the result.
+        """
+        if pooling not in POOLING_STRATEGIES:
+            raise ValueError(f"Unknown pooling strategy '{pooling}', expected one of {POOLING_STRATEGIES}")
+            
+        probs = torch.softmax(logits, dim=1)
+        if pooling == "mean":
+            pooled = probs.mean(dim=0)
+            weights = torch.full((probs.shape[0],), 1.0 / probs.shape[0])
+        elif pooling == "max":
+            pooled, argmax = probs.max(dim=0)
+            pooled = pooled / pooled.sum()
+            # A window's weight is the share of pooled mass it supplied
+            weights = torch.zeros(probs.shape[0])
+            weights.index_add_(0, argmax, pooled)
+        else:
+            # Windows with more decisive logits get more attention
+            weights = torch.softmax(logits.max(dim=1).values, dim=0)
+            pooled = (weights.unsqueeze(1) * probs).sum(dim=0)
+        return pooled.numpy(), weights.numpy()
+        
+    def _describe_windows(self, offsets: torch.Tensor, attention_mask: torch.Tensor,
+                          weights: np.ndarray, pooling: str, top_k: int = 3) -> Dict:
+        """
+        Report which character spans of the note drove the pooled result
+        """
+        spans = []
+        for window_offsets, mask in zip(offsets.tolist(), attention_mask.tolist()):
+            # Special and padding tokens have (0, 0) offsets
+            real = [span for span, m in zip(window_offsets, mask) if m and span[1] > span[0]]
+            spans.append([real[0][0], real[-1][1]] if real else [0, 0])
+            
+        order = np.argsort(-weights)[:top_k]
+        return {
+            "count": len(spans),
+            "pooling": pooling,
+            "weights": weights.round(4).tolist(),
+            "top_windows": [
+                {"index": int(i), "char_span": spans[i], "weight": float(weights[i])}
+                for i in order
+            ]
+        }
         
     def _extract_medical_history(self, text: str) -> Dict:
         """
         Extract medical history from text
         """
-        # Add medical history extraction logic
+        terms = self.term_extractor.summarize(text)
         return {
-            "conditions": [],
-            "medications": [],
-            "allergies": [],
-            "family_history": []
-        } 
\ No newline at end of file
+            "conditions": terms["conditions"],
+            "medications": terms["medications"],
+            "allergies": terms["allergies"],
+            "family_history": terms["family_history"]
+        }
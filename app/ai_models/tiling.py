@@ -0,0 +1,326 @@
+import io
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+
+from .cancellation import check
+from .image_input import ImageInput
+
+# Above this many pixels per side, analyze_medical_imaging switches to tiles
+LARGE_IMAGE_SIDE = 2048
+
+UNCOMPRESSED_TRANSFER_SYNTAXES = {
+    "1.2.840.10008.1.2",    # Implicit VR Little Endian
+    "1.2.840.10008.1.2.1",  # Explicit VR Little Endian
+}
+
+
+class RegionReader:
+    """
+    Lazy, region-at-a-time access to a single-channel image.
+
+    Backed by a numpy array or memmap, so reading a tile only touches the
+    pages that tile covers. Rescale slope/intercept (DICOM) and inverted
+    photometry are applied per region.
+    """
+
+    def __init__(self, pixels: np.ndarray, slope: float = 1.0, intercept: float = 0.0,
+                 invert: bool = False, source: Optional[str] = None):
+        if pixels.ndim == 3:
+            if pixels.shape[2] not in (3, 4):
+                raise ValueError("Expected a single-channel, RGB or RGBA image")
+        elif pixels.ndim != 2:
+            raise ValueError("Expected a 2D image")
+        self.pixels = pixels
+        self.slope = slope
+        self.intercept = intercept
+        self.invert = invert
+        self.source = source
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.pixels.shape[0], self.pixels.shape[1]
+
+    def read(self, y: int, x: int, height: int, width: int) -> np.ndarray:
+        """Read a region as float32, converting color to grayscale"""
+        region = np.asarray(self.pixels[y:y + height, x:x + width])
+        if region.ndim == 3:
+            region = cv2.cvtColor(region[..., :3], cv2.COLOR_RGB2GRAY)
+        region = region.astype(np.float32)
+        if self.slope != 1.0 or self.intercept != 0.0:
+            region = region * self.slope + self.intercept
+        return -region if self.invert else region
+
+    def sample(self, max_side: int = 1024) -> np.ndarray:
+        """A strided subsample of the whole image, for estimating intensity windows"""
+        height, width = self.shape
+        step = max(1, int(np.ceil(max(height, width) / max_side)))
+        return self.read_strided(step)
+
+    def read_strided(self, step: int) -> np.ndarray:
+        region = np.asarray(self.pixels[::step, ::step])
+        reader = RegionReader(region, self.slope, self.intercept, self.invert)
+        return reader.read(0, 0, *region.shape[:2])
+
+    def close(self):
+        mmap = getattr(self.pixels, "_mmap", None)
+        if mmap is not None:
+            mmap.close()
+
+
+def _open_dicom(path: str) -> RegionReader:
+    try:
+        import pydicom
+    except ImportError as e:
+        raise ImportError("Reading DICOM files requires the pydicom package") from e
+
+    # Defer the pixel data so only the header is read into memory
+    ds = pydicom.dcmread(path, defer_size=1024)
+    slope = float(getattr(ds, "RescaleSlope", 1.0))
+    intercept = float(getattr(ds, "RescaleIntercept", 0.0))
+    invert = getattr(ds, "PhotometricInterpretation", "") == "MONOCHROME1"
+
+    transfer_syntax = str(ds.file_meta.TransferSyntaxUID)
+    frames = int(getattr(ds, "NumberOfFrames", 1) or 1)
+    if transfer_syntax in UNCOMPRESSED_TRANSFER_SYNTAXES and ds.SamplesPerPixel == 1 and frames == 1:
+        # The raw, still deferred element; get_item() would read the pixels to convert it
+        element = ds._dict[pydicom.tag.Tag(0x7FE00010)]
+        bits = int(ds.BitsAllocated)
+        signed = int(getattr(ds, "PixelRepresentation", 0)) == 1
+        dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+        pixels = np.memmap(path, dtype=dtype, mode="r", offset=element.value_tell,
+                           shape=(int(ds.Rows), int(ds.Columns)))
+    else:
+        # Compressed pixel data can't be memory mapped; decode it once
+        pixels = pydicom.dcmread(path).pixel_array
+        if pixels.ndim == 3 and frames > 1:
+            pixels = pixels[0]
+    return RegionReader(pixels, slope, intercept, invert, source=path)
+
+
+def _is_dicom(path: str) -> bool:
+    if path.lower().endswith((".dcm", ".dicom")):
+        return True
+    with open(path, "rb") as f:
+        f.seek(128)
+        return f.read(4) == b"DICM"
+
+
+def open_large_image(path: str) -> RegionReader:
+    """
+    Open an image for tiled reading without decoding it fully when possible.
+
+    DICOM (uncompressed), .npy and uncompressed TIFF (with tifffile) are
+    memory mapped. Other formats are decoded once at full bit depth.
+    """
+    lowered = path.lower()
+    if _is_dicom(path):
+        return _open_dicom(path)
+    if lowered.endswith(".npy"):
+        return RegionReader(np.load(path, mmap_mode="r"), source=path)
+    if lowered.endswith((".tif", ".tiff")):
+        try:
+            import tifffile
+            return RegionReader(tifffile.memmap(path, mode="r"), source=path)
+        except (ImportError, ValueError):
+            pass
+
+    pixels = cv2.imread(path, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+    if pixels is None:
+        raise ValueError(f"Could not read image {os.path.basename(path)}")
+    if pixels.ndim == 3:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    return RegionReader(pixels, source=path)
+
+
+def _is_large(image_file, max_side: int) -> bool:
+    try:
+        from PIL import Image
+        with Image.open(image_file) as image:
+            return max(image.size) > max_side
+    except Exception:
+        return False
+
+
+def is_large_image(path: str, max_side: int = LARGE_IMAGE_SIDE) -> bool:
+    """DICOM, or any image with a side above `max_side`, read from the header only"""
+    if _is_dicom(path):
+        return True
+    return _is_large(path, max_side)
+
+
+def load_upload(file: BinaryIO, source: Optional[str] = None,
+                max_side: int = LARGE_IMAGE_SIDE) -> Union[ImageInput, RegionReader]:
+    """
+    Open an uploaded image from its file object, sniffing the header first.
+
+    DICOM and images with a side above `max_side` are spooled to a temp
+    file and opened with open_large_image, so their tiles are memory mapped
+    where the format allows instead of the whole upload being decoded in
+    RAM. Anything else is decoded to an 8-bit ImageInput.
+    """
+    file.seek(0)
+    dicom = file.read(132)[128:132] == b"DICM" or (source or "").lower().endswith((".dcm", ".dicom"))
+    file.seek(0)
+    large = dicom or _is_large(file, max_side)
+    file.seek(0)
+    if not large:
+        return ImageInput.from_bytes(file.read(), source=source)
+
+    # Keep the extension; open_large_image picks the reader from it
+    fd, path = tempfile.mkstemp(prefix="upload.", suffix=os.path.splitext(source or "")[1].lower())
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(file, f, 1 << 20)
+        reader = open_large_image(path)
+    finally:
+        # A memory map keeps the data reachable once the name is gone
+        os.remove(path)
+    reader.source = source
+    return reader
+
+
+def load_image(image, source: Optional[str] = None) -> Union[ImageInput, RegionReader]:
+    """
+    Sniff an image path or encoded bytes before decoding: DICOM and large
+    images become a RegionReader for tiled analysis, the rest an 8-bit
+    ImageInput. Anything else goes through ImageInput.coerce.
+    """
+    if isinstance(image, (ImageInput, RegionReader)):
+        return image
+    if isinstance(image, (str, os.PathLike)):
+        path = str(image)
+        return open_large_image(path) if is_large_image(path) else ImageInput.from_path(path)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return load_upload(io.BytesIO(image), source)
+    return ImageInput.coerce(image)
+
+
+def preview_image(reader: RegionReader, max_side: int = 1024,
+                  window_percentiles: Tuple[float, float] = (0.5, 99.5)) -> ImageInput:
+    """
+    A downsampled 8-bit RGB view of a large image, windowed like the tiles,
+    for models that take the whole image at once (e.g. embeddings)
+    """
+    sample = reader.sample(max_side)
+    low, high = np.percentile(sample, window_percentiles)
+    gray = np.clip((sample - low) / max(float(high - low), 1e-6) * 255.0, 0, 255).astype(np.uint8)
+    return ImageInput(np.ascontiguousarray(np.repeat(gray[..., None], 3, axis=2)), source=reader.source)
+
+
+def tile_grid(height: int, width: int, tile_size: int, overlap: int) -> Tuple[List[int], List[int]]:
+    """Top-left tile offsets covering the image, the last tile flush with the edge"""
+    stride = tile_size - overlap
+
+    def offsets(length):
+        if length <= tile_size:
+            return [0]
+        starts = list(range(0, length - tile_size + 1, stride))
+        if starts[-1] != length - tile_size:
+            starts.append(length - tile_size)
+        return starts
+
+    return offsets(height), offsets(width)
+
+
+class TiledAnalyzer:
+    """
+    Score a large image tile by tile with bounded memory.
+
+    Overlapping tiles are read lazily, windowed to [0, 1] with a window
+    estimated from a subsample, and scored in batches. At most `batch_size`
+    tiles are in memory at once. Tile scores are merged into an image-level
+    score (max) and a heatmap with one cell per tile.
+    """
+
+    def __init__(self,
+                 tile_scorer: Callable[[np.ndarray], np.ndarray],
+                 tile_size: int = 512,
+                 overlap: int = 64,
+                 batch_size: int = 8,
+                 window_percentiles: Tuple[float, float] = (0.5, 99.5)):
+        if overlap >= tile_size:
+            raise ValueError("Tile overlap must be smaller than the tile size")
+        self.tile_scorer = tile_scorer
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.window_percentiles = window_percentiles
+
+    def _batches(self, reader: RegionReader, ys: List[int], xs: List[int],
+                 low: float, high: float) -> Iterator[Tuple[List[Tuple[int, int]], np.ndarray]]:
+        height, width = reader.shape
+        scale = 1.0 / max(high - low, 1e-6)
+        batch = np.zeros((self.batch_size, self.tile_size, self.tile_size), dtype=np.float32)
+        cells = []
+        for row, y in enumerate(ys):
+            for col, x in enumerate(xs):
+                tile = reader.read(y, x, min(self.tile_size, height - y), min(self.tile_size, width - x))
+                slot = batch[len(cells)]
+                slot.fill(0.0)
+                slot[:tile.shape[0], :tile.shape[1]] = np.clip((tile - low) * scale, 0.0, 1.0)
+                cells.append((row, col))
+                if len(cells) == self.batch_size:
+                    yield cells, batch
+                    cells = []
+        if cells:
+            yield cells, batch[:len(cells)]
+
+    def analyze(self, reader: RegionReader, top_k: int = 5, cancel=None) -> Dict:
+        height, width = reader.shape
+        ys, xs = tile_grid(height, width, self.tile_size, self.overlap)
+        low, high = np.percentile(reader.sample(), self.window_percentiles)
+
+        heatmap = np.zeros((len(ys), len(xs)), dtype=np.float32)
+        for cells, batch in self._batches(reader, ys, xs, float(low), float(high)):
+            check(cancel)
+            scores = np.asarray(self.tile_scorer(batch), dtype=np.float32).reshape(-1)
+            for (row, col), score in zip(cells, scores):
+                heatmap[row, col] = score
+
+        flat = heatmap.reshape(-1)
+        top = np.argsort(-flat)[:top_k]
+        return {
+            "image_score": float(flat.max()),
+            "mean_tile_score": float(flat.mean()),
+            "tiles": int(flat.size),
+            "tile_size": self.tile_size,
+            "overlap": self.overlap,
+            "image_shape": [height, width],
+            "top_tiles": [
+                {
+                    "score": float(flat[i]),
+                    "box": [xs[i % len(xs)], ys[i // len(xs)],
+                            min(xs[i % len(xs)] + self.tile_size, width),
+                            min(ys[i // len(xs)] + self.tile_size, height)]
+                }
+                for i in top
+            ],
+            "heatmap": heatmap.round(4).tolist()
+        }
+
+
+def clip_tile_scorer(runner, processor, label_bank, group: Optional[str]) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Tile scorer returning CLIP's zero-shot probability of an abnormal finding.
+
+    With a `group` (e.g. "chest_xray"), only that group's labels compete and
+    the score is the probability mass of its "abnormal" subgroup; otherwise it
+    is one minus the mass of every "normal" subgroup.
+    """
+    def score(batch: np.ndarray) -> np.ndarray:
+        pixel_values = []
+        for tile in batch:
+            gray = (tile * 255.0).astype(np.uint8)
+            rgb = np.repeat(gray[:, :, np.newaxis], 3, axis=2)
+            pixel_values.append(ImageInput(rgb).clip_pixel_values(processor))
+        embeds = runner(pixel_values=torch.cat(pixel_values, dim=0))["image_embeds"]
+        if group:
+            return label_bank.group_probability(embeds, [f"{group}/abnormal"], within=group)
+        return 1.0 - label_bank.group_probability(embeds, label_bank.subgroups("normal"))
+    return score
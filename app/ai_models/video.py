@@ -2,6 +2,27 @@ import cv2
 import numpy as np
 import mediapipe as mp
 from ultralytics import YOLO
+from .bundle import get_bundle
+from .cancellation import Cancelled, check
+from .encoding import encode_detections
+from .telemetry import count_frames, span
+
+POSE_FIELDS = ("x", "y", "z", "visibility")
+FACE_FIELDS = ("x", "y", "z")
+
+def landmarks_to_array(landmarks, fields):
+    """
+    Pack MediaPipe landmarks into a (landmarks x fields) float32 array
+    """
+    return np.array([[getattr(lm, f) for f in fields] for lm in landmarks], dtype=np.float32)
+
+def stack_landmarks(frames, fields):
+    """
+    Stack per-frame landmark arrays into (frames x landmarks x fields)
+    """
+    if not frames:
+        return np.zeros((0, 0, len(fields)), dtype=np.float32)
+    return np.stack(frames)
 
 class VideoAnalyzer:
     def __init__(self):
@@ -9,60 +30,90 @@ class VideoAnalyzer:
         self.mp_face = mp.solutions.face_mesh
         self.pose = self.mp_pose.Pose()
         self.face = self.mp_face.FaceMesh()
-        self.yolo_model = YOLO('yolov8n.pt')
+        self.yolo_model = YOLO(get_bundle().weights_path("yolov8n"))
         
-    def analyze_video(self, video_path):
+    def analyze_video(self, video_path, progress=None, progress_every: int = 10, cancel=None):
         """
         Analyze video for medical conditions
+        
+        `progress(frames_done, total_frames)` is called every `progress_every`
+        frames; `total_frames` is None when the container doesn't report it.
+        A `cancel` token is checked before every frame.
         """
         try:
             cap = cv2.VideoCapture(video_path)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
             frames = []
             pose_data = []
+            pose_frames = []
             face_data = []
+            face_frames = []
             
             while cap.isOpened():
+                if cancel is not None and cancel.cancelled:
+                    break
                 ret, frame = cap.read()
                 if not ret:
                     break
                     
-                # Convert to RGB for MediaPipe
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                with span("video.frame"):
+                    # Convert to RGB for MediaPipe
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 
-                # Analyze pose
-                pose_results = self.pose.process(rgb_frame)
-                if pose_results.pose_landmarks:
-                    pose_data.append(pose_results.pose_landmarks.landmark)
+                    # Analyze pose
+                    with span("model.forward", model="mediapipe_pose"):
+                        pose_results = self.pose.process(rgb_frame)
+                    if pose_results.pose_landmarks:
+                        pose_data.append(landmarks_to_array(pose_results.pose_landmarks.landmark, POSE_FIELDS))
+                        pose_frames.append(len(frames))
                 
-                # Analyze face
-                face_results = self.face.process(rgb_frame)
-                if face_results.multi_face_landmarks:
-                    face_data.append(face_results.multi_face_landmarks[0].landmark)
+                    # Analyze face
+                    with span("model.forward", model="mediapipe_face_mesh"):
+                        face_results = self.face.process(rgb_frame)
+                    if face_results.multi_face_landmarks:
+                        face_data.append(landmarks_to_array(face_results.multi_face_landmarks[0].landmark, FACE_FIELDS))
+                        face_frames.append(len(frames))
                 
+                count_frames("video")
                 frames.append(frame)
+                if progress is not None and len(frames) % progress_every == 0:
+                    progress(len(frames), total_frames)
             
             cap.release()
+            check(cancel)
             
             # Run YOLO on key frames
             key_frames = frames[::30]  # Sample every 30th frame
             detections = []
             for frame in key_frames:
-                results = self.yolo_model(frame)
-                detections.append(results[0].boxes.data.tolist())
+                check(cancel)
+                with span("model.forward", model="yolov8n"):
+                    result = self.yolo_model(frame, verbose=False)[0]
+                detections.append(encode_detections(
+                    result.boxes.xyxy.cpu().numpy(),
+                    result.boxes.conf.cpu().numpy(),
+                    result.boxes.cls.cpu().numpy(),
+                    result.names
+                ))
             
             analysis = {
-                "pose_data": pose_data,
-                "face_data": face_data,
+                "pose_data": stack_landmarks(pose_data, POSE_FIELDS),
+                "pose_frames": np.array(pose_frames, dtype=np.int32),
+                "face_data": stack_landmarks(face_data, FACE_FIELDS),
+                "face_frames": np.array(face_frames, dtype=np.int32),
+                "landmark_fields": {"pose": list(POSE_FIELDS), "face": list(FACE_FIELDS)},
                 "detections": detections,
                 "frame_count": len(frames)
             }
             
             return analysis
             
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
             
-    def analyze_gait(self, video_path):
+    def analyze_gait(self, video_path, cancel=None):
         """
         Analyze walking patterns
         """
@@ -71,6 +122,8 @@ class VideoAnalyzer:
             gait_data = []
             
             while cap.isOpened():
+                if cancel is not None and cancel.cancelled:
+                    break
                 ret, frame = cap.read()
                 if not ret:
                     break
@@ -79,18 +132,23 @@ class VideoAnalyzer:
                 rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 
                 # Analyze pose for gait
-                pose_results = self.pose.process(rgb_frame)
+                with span("model.forward", model="mediapipe_pose"):
+                    pose_results = self.pose.process(rgb_frame)
+                count_frames("video_gait")
                 if pose_results.pose_landmarks:
-                    gait_data.append(pose_results.pose_landmarks.landmark)
+                    gait_data.append(landmarks_to_array(pose_results.pose_landmarks.landmark, POSE_FIELDS))
             
             cap.release()
+            check(cancel)
             
-            return {"status": "success", "gait_patterns": gait_data}
+            return {"status": "success", "gait_patterns": stack_landmarks(gait_data, POSE_FIELDS)}
             
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
             
-    def analyze_facial_movements(self, video_path):
+    def analyze_facial_movements(self, video_path, cancel=None):
         """
         Analyze facial movements for neurological conditions
         """
@@ -99,6 +157,8 @@ class VideoAnalyzer:
             facial_data = []
             
             while cap.isOpened():
+                if cancel is not None and cancel.cancelled:
+                    break
                 ret, frame = cap.read()
                 if not ret:
                     break
@@ -107,13 +167,18 @@ class VideoAnalyzer:
                 rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 
                 # Analyze face
-                face_results = self.face.process(rgb_frame)
+                with span("model.forward", model="mediapipe_face_mesh"):
+                    face_results = self.face.process(rgb_frame)
+                count_frames("video_facial")
                 if face_results.multi_face_landmarks:
-                    facial_data.append(face_results.multi_face_landmarks[0].landmark)
+                    facial_data.append(landmarks_to_array(face_results.multi_face_landmarks[0].landmark, FACE_FIELDS))
             
             cap.release()
+            check(cancel)
             
-            return {"status": "success", "facial_patterns": facial_data}
+            return {"status": "success", "facial_patterns": stack_landmarks(facial_data, FACE_FIELDS)}
             
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)} 
\ No newline at end of file
@@ -1,61 +1,252 @@
+import os
 import torch
 import torchvision
-from PIL import Image
 import numpy as np
 from transformers import CLIPProcessor, CLIPModel
 from ultralytics import YOLO
+from .backends import CLIP_IMAGE_MODULES, InferenceRunner, backend_for
+from .bundle import get_bundle
+from .cancellation import Cancelled, check
+from .cascade import Cascade
+from .encoding import encode_detections, encode_masks
+from .image_input import ImageInput
+from .label_bank import LabelBank
+from .telemetry import span
+from .tiling import (RegionReader, TiledAnalyzer, clip_tile_scorer, is_large_image, load_image, open_large_image,
+                     preview_image)
+
+# Label bank group scored for each imaging modality in tiled mode
+IMAGING_GROUPS = {"xray": "chest_xray", "chest_xray": "chest_xray", "fundus": "fundus"}
 
 class VisionAnalyzer:
-    def __init__(self):
-        self.clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        self.yolo_model = YOLO('yolov8n.pt')
+    def __init__(self, backend=None, normal_threshold=None):
+        bundle = get_bundle()
+        self.clip_model = bundle.load_model("clip", CLIPModel)
+        self.clip_processor = bundle.load_processor("clip", CLIPProcessor)
+        self.clip_image_encoder = InferenceRunner(
+            self.clip_model,
+            backend=backend or backend_for("clip"),
+            method="get_image_features",
+            output_names=("image_embeds",),
+            name="clip",
+            quantize=CLIP_IMAGE_MODULES
+        )
+        self.yolo_model = YOLO(bundle.weights_path("yolov8n"))
+        self.label_bank = LabelBank.from_file().build(self.clip_model, self.clip_processor)
+        
+        # Clearly normal images are answered by CLIP alone; the rest go on to YOLO
+        if normal_threshold is None:
+            normal_threshold = float(os.getenv("VISION_CASCADE_NORMAL_THRESHOLD", "0.9"))
+        self.normal_threshold = normal_threshold
+        self.cascade = Cascade("vision", [
+            ("clip_triage", self._clip_triage),
+            ("yolo_segmentation", self._yolo_segmentation)
+        ])
         
-    def analyze_image(self, image_path):
+    def analyze_image(self, image, mask_format="rle", mask_downsample=1, include_raw=False, cancel=None):
         """
         Analyze medical images for abnormalities and conditions
+        
+        Segmentation masks are returned as RLE or polygons in original image
+        coordinates (optionally downsampled); the raw YOLO tensors are only
+        included with `include_raw`. DICOM, large and high bit depth images
+        (see tiling.load_image) get the tiled analyze_medical_imaging instead.
         """
         try:
-            # Load and preprocess image
-            image = Image.open(image_path)
-            
-            # Run CLIP analysis for general medical conditions
-            inputs = self.clip_processor(images=image, return_tensors="pt")
-            image_features = self.clip_model.get_image_features(**inputs)
+            image = load_image(image)
+            if isinstance(image, RegionReader):
+                return self.analyze_medical_imaging(image, tiled=True, cancel=cancel)
+            return self._run_cascade(self._state(image, mask_format, mask_downsample, include_raw, cancel))
+        except Cancelled:
+            raise
+        except Exception as e:
+            return {"error": str(e)}
             
-            # Run YOLO for object detection and segmentation
-            results = self.yolo_model(image)
+    def analyze_images(self, images, batch_size=16, mask_format="rle", mask_downsample=1, include_raw=False,
+                       cancel=None):
+        """
+        Analyze several images, encoding them with CLIP `batch_size` at a
+        time; each then continues through the cascade on its own. Returns
+        one analyze_image result per image, in order.
+        """
+        results = [None] * len(images)
+        states = {}
+        for i, image in enumerate(images):
+            try:
+                image = load_image(image)
+            except Exception as e:
+                results[i] = {"error": str(e)}
+                continue
+            if isinstance(image, RegionReader):
+                # Tiled images are batched tile by tile instead
+                results[i] = self.analyze_medical_imaging(image, tiled=True, cancel=cancel)
+            else:
+                states[i] = self._state(image, mask_format, mask_downsample, include_raw, cancel)
+                
+        pending = list(states)
+        for start in range(0, len(pending), batch_size):
+            check(cancel)
+            chunk = pending[start:start + batch_size]
+            try:
+                pixel_values = torch.cat([states[i]["image"].clip_pixel_values(self.clip_processor) for i in chunk])
+                image_embeds = self.clip_image_encoder(pixel_values=pixel_values)["image_embeds"]
+                for j, i in enumerate(chunk):
+                    states[i]["features"] = image_embeds[j:j + 1]
+            except Cancelled:
+                raise
+            except Exception:
+                # Leave the chunk to be encoded one image at a time by the cascade
+                pass
+                
+        for i in pending:
+            try:
+                results[i] = self._run_cascade(states[i])
+            except Cancelled:
+                raise
+            except Exception as e:
+                results[i] = {"error": str(e)}
+        return results
+        
+    def _state(self, image, mask_format, mask_downsample, include_raw, cancel):
+        # Decode once; accepts a path or an already-decoded ImageInput
+        return {
+            "image": ImageInput.coerce(image),
+            "mask_format": mask_format,
+            "mask_downsample": mask_downsample,
+            "include_raw": include_raw,
+            "cancel": cancel
+        }
+        
+    def _run_cascade(self, state):
+        stage = self.cascade.run(state)
+        
+        # Combine results
+        analysis = {
+            "features": state["features"].numpy(),
+            "triage": state["triage"],
+            "detections": state.get("detections") or encode_detections(np.empty((0, 4)), [], []),
+            "segmentation": state.get("segmentation"),
+            "cascade_stage": stage
+        }
+        if state["include_raw"]:
+            analysis["raw"] = state.get("raw")
+        
+        return analysis
             
-            # Combine results
-            analysis = {
-                "features": image_features.detach().numpy().tolist(),
-                "detections": results[0].boxes.data.tolist(),
-                "segmentation": results[0].masks.data.tolist() if results[0].masks else None
+    def _clip_triage(self, state):
+        """
+        Cascade stage 1: CLIP embedding plus zero-shot probability that the
+        image is normal. Exits when that probability clears the threshold.
+        """
+        if "features" not in state:
+            # Already set when the image was encoded in a batch (analyze_images)
+            pixel_values = state["image"].clip_pixel_values(self.clip_processor)
+            state["features"] = self.clip_image_encoder(pixel_values=pixel_values)["image_embeds"]
+        
+        normal = float(self.label_bank.group_probability(state["features"], self.label_bank.subgroups("normal"))[0])
+        state["triage"] = {"normal_probability": normal, "threshold": self.normal_threshold}
+        return normal >= self.normal_threshold
+        
+    def _yolo_segmentation(self, state):
+        """
+        Cascade stage 2: YOLO detection and segmentation on the prepared letterbox
+        """
+        letterbox = state["image"].yolo_letterbox()
+        with span("model.forward", model="yolov8n"):
+            result = self.yolo_model(letterbox.array, verbose=False)[0]
+        boxes = result.boxes
+        state["detections"] = encode_detections(
+            letterbox.boxes_to_original(boxes.xyxy.cpu().numpy()),
+            boxes.conf.cpu().numpy(),
+            boxes.cls.cpu().numpy(),
+            result.names
+        )
+        
+        masks = result.masks.data.cpu().numpy() if result.masks is not None else None
+        if masks is not None:
+            state["segmentation"] = encode_masks(
+                masks,
+                mask_format=state["mask_format"],
+                downsample=state["mask_downsample"],
+                letterbox=letterbox
+            )
+        if state["include_raw"]:
+            state["raw"] = {
+                "boxes": boxes.data.tolist(),
+                "masks": masks.tolist() if masks is not None else None
             }
+        return True
             
-            return analysis
-            
+    def embed_image(self, image):
+        """
+        CLIP image embedding alone, as stored for similar-case search
+        """
+        try:
+            image = load_image(image)
+            if isinstance(image, RegionReader):
+                image = preview_image(image)
+            pixel_values = image.clip_pixel_values(self.clip_processor)
+            return {"features": self.clip_image_encoder(pixel_values=pixel_values)["image_embeds"].numpy()}
         except Exception as e:
             return {"error": str(e)}
             
-    def detect_skin_conditions(self, image_path):
+    def detect_skin_conditions(self, image):
         """
         Specialized analysis for skin conditions
         """
         try:
-            image = Image.open(image_path)
+            image = ImageInput.coerce(image)
             # Add specialized skin condition detection logic
             return {"status": "success", "conditions": []}
         except Exception as e:
             return {"error": str(e)}
             
-    def analyze_medical_imaging(self, image_path, modality="xray"):
+    def analyze_medical_imaging(self, image, modality="xray", tiled=None, tile_size=512, overlap=64, batch_size=8,
+                                cancel=None):
         """
         Analyze medical imaging (X-ray, MRI, CT)
+        
+        Large images and DICOM files are analyzed in overlapping tiles read
+        lazily from disk instead of being downscaled to the model input size.
         """
         try:
-            image = Image.open(image_path)
+            if tiled is None:
+                tiled = isinstance(image, RegionReader) or (isinstance(image, str) and is_large_image(image))
+            if tiled:
+                return self._analyze_tiled(image, modality, tile_size, overlap, batch_size, cancel)
+                
+            image = ImageInput.coerce(image)
             # Add specialized medical imaging analysis logic
             return {"status": "success", "findings": []}
+        except Cancelled:
+            raise
         except Exception as e:
-            return {"error": str(e)} 
\ No newline at end of file
+            return {"error": str(e)} 
+            
+    def _analyze_tiled(self, image, modality, tile_size, overlap, batch_size, cancel=None):
+        """
+        Score every tile of a high-resolution image and merge the results
+        """
+        if isinstance(image, RegionReader):
+            reader = image
+        elif isinstance(image, str):
+            reader = open_large_image(image)
+        else:
+            reader = RegionReader(ImageInput.coerce(image).rgb)
+        try:
+            scorer = clip_tile_scorer(
+                self.clip_image_encoder,
+                self.clip_processor,
+                self.label_bank,
+                IMAGING_GROUPS.get(modality)
+            )
+            tiles = TiledAnalyzer(scorer, tile_size=tile_size, overlap=overlap, batch_size=batch_size).analyze(reader, cancel=cancel)
+        finally:
+            reader.close()
+            
+        findings = [
+            f"Possible abnormality (score {tile['score']:.2f}) in region {tile['box']}"
+            for tile in tiles["top_tiles"]
+            if tile["score"] >= 0.5
+        ]
+        return {"status": "success", "findings": findings, "tiled_analysis": tiles}
\ No newline at end of file
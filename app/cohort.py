@@ -0,0 +1,464 @@
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Set
+
+from .history import modalities_of
+from .threads import BLAS_ENV_VARS, ThreadBudget, available_cores
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Manifest columns passed to the orchestrator; paths are relative to the manifest
+MANIFEST_FIELDS = ("text", "image_path", "audio_path", "video_path")
+PATH_FIELDS = ("image_path", "audio_path", "video_path")
+
+# Manifest modality -> analyzer preloaded in each worker
+ANALYZER_FOR = {"text": "text", "image": "vision", "audio": "audio", "video": "video"}
+
+# Result sections stored as JSON columns, embeddings omitted
+SECTIONS = ("text_analysis", "vision_analysis", "audio_analysis", "video_analysis")
+
+# Result sections whose pooled features become embedding columns with --embeddings
+EMBEDDING_COLUMNS = {"vision_embedding": "vision_analysis", "audio_embedding": "audio_analysis"}
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+    name TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS done (
+    case_id TEXT PRIMARY KEY,
+    part TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ok'
+) WITHOUT ROWID;
+"""
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional format
+    pyarrow = None
+
+FORMATS = ("parquet", "jsonl")
+
+
+def read_manifest(path: str) -> List[Dict]:
+    """
+    Cases from a CSV (header row) or JSONL manifest. Each has a unique
+    `case_id` (the row number when the column is missing or empty) and the
+    non-empty MANIFEST_FIELDS.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    cases = []
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        case_id = str(row.get("case_id") or "").strip() or f"row-{number}"
+        if case_id in seen:
+            raise ValueError(f"Duplicate case_id '{case_id}' in manifest row {number}")
+        seen.add(case_id)
+        case = {"case_id": case_id}
+        for field in MANIFEST_FIELDS:
+            value = row.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+            if value:
+                case[field] = os.path.join(base, value) if field in PATH_FIELDS else value
+        cases.append(case)
+    return cases
+
+
+class ResultWriter:
+    """
+    Cohort results as numbered part files next to a checkpoint database.
+
+    Each part is written to a temporary file, synced and renamed into
+    place, and only then recorded in the checkpoint together with the ids
+    of the cases it holds, in one transaction. A part left over by a crash
+    between the rename and the commit is deleted on the next start, so
+    every case is either fully written and checkpointed or redone.
+
+    Only cases that succeeded count as done: failed and cancelled cases
+    are written too, but retried by the next run, whose row for the case
+    lands in a later part and supersedes the earlier one.
+    """
+
+    def __init__(self, directory: str, format: Optional[str] = None, embeddings: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._db = sqlite3.connect(os.path.join(directory, "checkpoint.db"))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(CHECKPOINT_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(done)")}
+        if "status" not in columns:
+            # Checkpoints written before failed cases were retried
+            self._db.execute("ALTER TABLE done ADD COLUMN status TEXT NOT NULL DEFAULT 'ok'")
+        settings = dict(self._db.execute("SELECT key, value FROM settings"))
+        if settings:
+            if format not in (None, settings["format"]):
+                raise ValueError(f"{directory} holds {settings['format']} results; resume with that format")
+            self.format = settings["format"]
+            self.embeddings = settings["embeddings"] == "1"
+        else:
+            self.format = format or ("parquet" if pyarrow is not None else "jsonl")
+            self.embeddings = embeddings
+            with self._db:
+                self._db.executemany("INSERT INTO settings (key, value) VALUES (?, ?)",
+                                     [("format", self.format), ("embeddings", "1" if embeddings else "0")])
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown format '{self.format}', expected one of {FORMATS}")
+        if self.format == "parquet" and pyarrow is None:
+            raise ValueError("The parquet format needs pyarrow installed")
+        self.parts = self._db.execute("SELECT COUNT(*) FROM parts").fetchone()[0]
+        self._recover()
+
+    def _recover(self):
+        known = {name for (name,) in self._db.execute("SELECT name FROM parts")}
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("part-") and entry.name not in known:
+                logger.info(f"Removing unrecorded part {entry.name}")
+                os.remove(entry.path)
+
+    def done(self) -> Set[str]:
+        """Ids of the cases already written successfully"""
+        return {case_id for (case_id,) in self._db.execute("SELECT case_id FROM done WHERE status = 'ok'")}
+
+    def _schema(self):
+        fields = [
+            ("case_id", pyarrow.string()),
+            ("modalities", pyarrow.string()),
+            ("status", pyarrow.string()),
+            ("error", pyarrow.string()),
+            ("confidence", pyarrow.float64()),
+            ("elapsed_ms", pyarrow.float64()),
+            ("worker", pyarrow.int64()),
+            ("confidence_scores", pyarrow.string()),
+            ("differential_diagnosis", pyarrow.string()),
+            ("recommendations", pyarrow.string()),
+        ] + [(section, pyarrow.string()) for section in SECTIONS]
+        if self.embeddings:
+            fields += [(column, pyarrow.list_(pyarrow.float32())) for column in EMBEDDING_COLUMNS]
+        return pyarrow.schema(fields)
+
+    def write(self, rows: List[Dict]):
+        if not rows:
+            return
+        name = f"part-{self.parts:06d}.{self.format}"
+        path = os.path.join(self.directory, name)
+        tmp = path + ".tmp"
+        if self.format == "parquet":
+            table = pyarrow.Table.from_pylist(rows, schema=self._schema())
+            pyarrow.parquet.write_table(table, tmp, compression="zstd")
+        else:
+            with open(tmp, "w") as f:
+                f.writelines(json.dumps(row) + "\n" for row in rows)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        with self._db:
+            self._db.execute("INSERT INTO parts (name, rows, created_at) VALUES (?, ?, ?)",
+                             (name, len(rows), time.time()))
+            self._db.executemany("INSERT OR REPLACE INTO done (case_id, part, status) VALUES (?, ?, ?)",
+                                 [(row["case_id"], name, row["status"]) for row in rows])
+        self.parts += 1
+
+    def close(self):
+        self._db.close()
+
+
+# Pool restarts in a row without a chunk finishing before the run is abandoned
+MAX_FRUITLESS_RESTARTS = 3
+
+
+class CohortAborted(RuntimeError):
+    """Workers cannot make progress (e.g. their models fail to load)"""
+
+
+class WorkerInitError(RuntimeError):
+    """A worker's models failed to load"""
+
+
+# Per-worker state, set by _init_worker
+_orchestrator = None
+_init_error: Optional[str] = None
+
+
+def _init_worker(counter, workers: int, preload: List[str], pin: bool):
+    """Size this worker's thread pools to its share of the cores and load its models once"""
+    global _orchestrator, _init_error
+    # The parent drains in-flight chunks on Ctrl-C; workers just finish them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    budget = ThreadBudget(workers=workers, concurrency=1, pin=pin)
+    # Replace the parent's single-worker defaults before numpy and torch size their pools
+    for name in BLAS_ENV_VARS + ("ORT_INTRA_OP_THREADS",):
+        os.environ[name] = str(budget.threads_per_analysis)
+    budget.apply(index)
+
+    try:
+        from .ai_models.orchestrator import AIOrchestrator
+        _orchestrator = AIOrchestrator(on_load=lambda name, analyzer: budget.apply(index))
+        _orchestrator.preload(preload)
+    except Exception as e:
+        # Reported by the worker's first task, so the parent stops instead of restarting the pool
+        _init_error = f"{type(e).__name__}: {e}"
+
+
+def _row(case: Dict, results: Dict, elapsed_ms: float, embeddings: bool) -> Dict:
+    from .serialization import dumps_json, prepare
+
+    def as_json(value):
+        return dumps_json(prepare(value)[0]).decode() if value is not None else None
+
+    scores = results.get("confidence_scores") or {}
+    if "error" in results:
+        status = "error"
+    elif results.get("cancelled"):
+        status = "cancelled"
+    else:
+        status = "ok"
+    row = {
+        "case_id": case["case_id"],
+        "modalities": ",".join(modalities_of(**case)),
+        "status": status,
+        "error": results.get("error") or results.get("cancelled"),
+        "confidence": float(max(scores.values())) if scores else 0.0,
+        "elapsed_ms": elapsed_ms,
+        "worker": os.getpid(),
+        "confidence_scores": as_json(scores),
+        "differential_diagnosis": as_json(results.get("differential_diagnosis")),
+        "recommendations": as_json(results.get("recommendations")),
+    }
+    for section in SECTIONS:
+        row[section] = as_json(results.get(section))
+    if embeddings:
+        from .embeddings import pooled
+        for column, section in EMBEDDING_COLUMNS.items():
+            features = (results.get(section) or {}).get("features")
+            row[column] = pooled(features).tolist() if features is not None else None
+    return row
+
+
+def _analyze_chunk(cases: List[Dict], batch_size: int, embeddings: bool) -> List[Dict]:
+    """Worker task: analyze a chunk of cases with the batched model paths"""
+    if _init_error is not None:
+        raise WorkerInitError(_init_error)
+    started = time.perf_counter()
+    inputs = [{key: value for key, value in case.items() if key != "case_id"} for case in cases]
+    results = _orchestrator.analyze_batch(inputs, batch_size=batch_size)
+    # Chunk time shared evenly; cases in a chunk run together
+    elapsed_ms = (time.perf_counter() - started) * 1000 / len(cases)
+    return [_row(case, result, elapsed_ms, embeddings) for case, result in zip(cases, results)]
+
+
+def _failed_rows(cases: List[Dict], error: str) -> List[Dict]:
+    return [
+        {"case_id": case["case_id"], "modalities": ",".join(modalities_of(**case)), "status": "error",
+         "error": error, "confidence": 0.0, "elapsed_ms": 0.0, "worker": None}
+        for case in cases
+    ]
+
+
+class CohortRun:
+    """
+    Analyze a manifest's pending cases on a pool of worker processes.
+
+    Cases are sent in chunks of `batch_size`, at most two per worker at a
+    time, and finished rows are written every `flush_rows`. When a worker
+    dies, the pool is restarted and the cases in flight are retried one at
+    a time with nothing else running, so a case that takes a worker down
+    again is identified and written as an error. The run is abandoned
+    (CohortAborted) when a worker's models fail to load, or when the pool
+    breaks MAX_FRUITLESS_RESTARTS times in a row without finishing a chunk.
+    SIGINT/SIGTERM stop new work, finish the chunks in flight and write
+    them, so a rerun resumes from there; a second signal exits at once,
+    losing only the unwritten rows.
+    """
+
+    def __init__(self, cases: List[Dict], writer: ResultWriter, workers: int, batch_size: int = 16,
+                 flush_rows: int = 1024, pin: bool = False, progress_seconds: float = 10.0):
+        self.writer = writer
+        done = writer.done()
+        self.cases = [case for case in cases if case["case_id"] not in done]
+        self.skipped = len(cases) - len(self.cases)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_rows = flush_rows
+        self.pin = pin
+        self.progress_seconds = progress_seconds
+        self.preload = sorted({ANALYZER_FOR[name] for case in self.cases for name in modalities_of(**case)})
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.fruitless_restarts = 0
+        self._stopping = False
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Spawned workers start clean, without the parent's threads or library state
+        context = multiprocessing.get_context("spawn")
+        counter = context.Value("i", 0)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(counter, self.workers, self.preload, self.pin))
+
+    def _on_signal(self, signum, frame):
+        if self._stopping:
+            raise KeyboardInterrupt
+        logger.info("Stopping: finishing the chunks in flight (signal again to exit now)")
+        self._stopping = True
+
+    def run(self) -> Dict:
+        logger.info(f"{len(self.cases)} cases to analyze ({self.skipped} already done) on {self.workers} workers, "
+                    f"models: {', '.join(self.preload) or 'none'}")
+        previous = {sig: signal.signal(sig, self._on_signal) for sig in (signal.SIGINT, signal.SIGTERM)}
+        # (cases, attempt) per chunk
+        pending = deque(
+            (self.cases[i:i + self.batch_size], 0) for i in range(0, len(self.cases), self.batch_size)
+        )
+        buffer: List[Dict] = []
+        started = last_report = time.monotonic()
+        pool = self._pool()
+        in_flight = {}
+        try:
+            while in_flight or (pending and not self._stopping):
+                broken = False
+                while pending and not self._stopping and len(in_flight) < 2 * self.workers:
+                    # Retries run alone, so a crash during one is attributable
+                    if in_flight and (pending[0][1] or any(attempt for _, attempt in in_flight.values())):
+                        break
+                    try:
+                        future = pool.submit(_analyze_chunk, pending[0][0], self.batch_size, self.writer.embeddings)
+                    except BrokenProcessPool:
+                        # A worker died, possibly with nothing in flight; restart below
+                        broken = True
+                        break
+                    in_flight[future] = pending.popleft()
+                finished = set()
+                if in_flight and not broken:
+                    finished, _ = wait(in_flight, timeout=self.progress_seconds, return_when=FIRST_COMPLETED)
+
+                rows = []
+                for future in finished:
+                    cases, attempt = in_flight.pop(future)
+                    try:
+                        rows.extend(future.result())
+                        self.fruitless_restarts = 0
+                    except BrokenProcessPool:
+                        broken = True
+                        in_flight[future] = (cases, attempt)
+                    except WorkerInitError as e:
+                        raise CohortAborted(f"Worker failed to load its models: {e}") from None
+                    except Exception as e:
+                        rows.extend(_failed_rows(cases, str(e)))
+                if broken:
+                    if self.fruitless_restarts >= MAX_FRUITLESS_RESTARTS:
+                        raise CohortAborted(f"The worker pool broke {self.fruitless_restarts + 1} times in a row "
+                                            "without finishing a chunk")
+                    self.fruitless_restarts += 1
+                    # Every future of a broken pool fails, so retry everything that was in flight
+                    for cases, attempt in in_flight.values():
+                        if attempt:
+                            rows.extend(_failed_rows(cases, "Worker process died analyzing this case"))
+                        else:
+                            pending.extendleft(([case], 1) for case in reversed(cases))
+                    in_flight.clear()
+                    self.restarts += 1
+                    logger.warning(f"A worker died; restarting the pool (restart {self.restarts})")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._pool()
+                buffer.extend(rows)
+                self.completed += len(rows)
+                self.failed += sum(row["status"] != "ok" for row in rows)
+
+                if len(buffer) >= self.flush_rows:
+                    self.writer.write(buffer)
+                    buffer = []
+                if time.monotonic() - last_report >= self.progress_seconds:
+                    last_report = time.monotonic()
+                    self._report(started)
+        finally:
+            self.writer.write(buffer)
+            pool.shutdown(wait=False, cancel_futures=True)
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+        summary = self._report(started)
+        summary["interrupted"] = self._stopping and bool(pending)
+        return summary
+
+    def _report(self, started: float) -> Dict:
+        elapsed = time.monotonic() - started
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        remaining = len(self.cases) - self.completed
+        eta = f", ~{remaining / rate:.0f}s left" if rate > 0 and remaining else ""
+        logger.info(f"{self.completed}/{len(self.cases)} cases, {self.failed} failed, {rate:.2f} cases/s{eta}")
+        return {
+            "cases": len(self.cases),
+            "skipped": self.skipped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "worker_restarts": self.restarts,
+            "seconds": round(elapsed, 3),
+            "cases_per_second": round(rate, 3)
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze a cohort manifest offline; rerun with the same output directory to resume"
+    )
+    parser.add_argument("manifest", help="CSV or JSONL with case_id, text, image_path, audio_path, video_path")
+    parser.add_argument("--output", required=True, help="Directory for the result parts and checkpoint")
+    parser.add_argument("--workers", type=int, default=len(available_cores()),
+                        help="Worker processes, each with its own models and share of the cores")
+    parser.add_argument("--batch-size", type=int, default=16, help="Cases per chunk, encoded together")
+    parser.add_argument("--flush-rows", type=int, default=1024, help="Rows per result part")
+    parser.add_argument("--format", choices=FORMATS, help="Result format (default parquet when pyarrow is installed)")
+    parser.add_argument("--embeddings", action="store_true", help="Store pooled vision/audio embeddings")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its own cores")
+    args = parser.parse_args(argv)
+
+    try:
+        cases = read_manifest(args.manifest)
+        writer = ResultWriter(args.output, format=args.format, embeddings=args.embeddings)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    try:
+        summary = CohortRun(cases, writer, max(1, args.workers), batch_size=max(1, args.batch_size),
+                            flush_rows=max(1, args.flush_rows), pin=args.pin).run()
+    except KeyboardInterrupt:
+        logger.info("Interrupted; rerun to resume")
+        return 130
+    except CohortAborted as e:
+        logger.error(f"Cohort run abandoned: {str(e)}; finished cases are saved, rerun to resume")
+        return 1
+    finally:
+        writer.close()
+    print(json.dumps(summary, indent=2))
+    return 130 if summary["interrupted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,440 @@
+import fcntl
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORE_FORMAT = 1
+
+# Result sections whose "features" feed each vector space
+SPACES = {"vision": "vision_analysis", "audio": "audio_analysis"}
+
+METADATA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    row INTEGER PRIMARY KEY,
+    case_id TEXT,
+    patient_id TEXT,
+    session_id TEXT,
+    endpoint TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vectors_case ON vectors (case_id);
+"""
+
+# Rows scored per block in exact search: bounds the float32 copy to about 32 MB
+SEARCH_BLOCK_BYTES = 32 * 2**20
+
+MAX_RESULTS = 100
+
+
+def pooled(features) -> np.ndarray:
+    """One vector per input: CLIP image_embeds as is, Wav2Vec2 hidden states averaged over time"""
+    array = np.asarray(features, dtype=np.float32)
+    while array.ndim > 2:
+        array = array.mean(axis=-2)
+    return array.reshape(-1, array.shape[-1]).mean(axis=0)
+
+
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """Exclusive lock across processes (API workers share a store); yields whether it was taken"""
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int):
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k)[:k]
+        scores, rows = scores[keep], rows[keep]
+    order = np.argsort(-scores)
+    return scores[order], rows[order]
+
+
+class VectorSpace:
+    """
+    Append-only store of unit-length float16 vectors of one model.
+
+    Vectors are rows of a raw `vectors.f16` file read through a memory map,
+    so searching millions of them does not load them onto the heap; row
+    metadata (case, patient, session, time) is kept in SQLite. Appends
+    from several processes are serialized with a file lock, vector first,
+    so a row is searchable once its metadata exists.
+
+    Search is exact (blocked matrix-vector products over the map) unless
+    an IVF index has been built: then only the `probes` clusters nearest to
+    the query are scored, plus every row appended since the index was
+    built.
+    """
+
+    def __init__(self, directory: str, dim: Optional[int] = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.f16")
+        self.index_path = os.path.join(directory, "ivf.npz")
+        self.lock_path = os.path.join(directory, "append.lock")
+        header_path = os.path.join(directory, "header.json")
+        if os.path.exists(header_path):
+            with open(header_path) as f:
+                header = json.load(f)
+            self.dim = header["dim"]
+        elif dim is not None:
+            self.dim = dim
+            with open(header_path, "w") as f:
+                json.dump({"format": STORE_FORMAT, "dim": dim, "dtype": "float16"}, f)
+        else:
+            raise ValueError(f"No vector store in {directory} and no dimension given")
+        self.row_bytes = self.dim * 2
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "meta.db"), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(METADATA_SCHEMA)
+        self._map: Optional[np.memmap] = None
+        self._index: Optional[Dict] = None
+        self._index_mtime = None
+        self._recover()
+
+    def _recover(self):
+        """Drop vectors whose metadata never got written (a crash between the two)"""
+        with _file_lock(self.lock_path):
+            row = self._conn.execute("SELECT MAX(row) AS row FROM vectors").fetchone()
+            rows = (row["row"] + 1) if row["row"] is not None else 0
+            if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > rows * self.row_bytes:
+                os.truncate(self.vectors_path, rows * self.row_bytes)
+
+    @property
+    def count(self) -> int:
+        """Rows searchable now: vectors on disk that have their metadata"""
+        try:
+            on_disk = os.path.getsize(self.vectors_path) // self.row_bytes
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(row) AS row FROM vectors").fetchone()
+        return min(on_disk, (row["row"] + 1) if row["row"] is not None else 0)
+
+    def _vectors(self, count: int) -> np.ndarray:
+        """The first `count` rows, remapping the file when it has grown"""
+        if count == 0:
+            return np.empty((0, self.dim), dtype=np.float16)
+        with self._lock:
+            if self._map is None or len(self._map) < count:
+                rows = os.path.getsize(self.vectors_path) // self.row_bytes
+                self._map = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(rows, self.dim))
+            return self._map[:count]
+
+    def append(self, vectors: np.ndarray, metadata: List[Dict]) -> List[int]:
+        """Normalize, convert to float16 and append; returns the new rows"""
+        vectors = np.atleast_2d(normalized(vectors)).astype(np.float16)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        with _file_lock(self.lock_path):
+            with open(self.vectors_path, "ab") as f:
+                first = f.tell() // self.row_bytes
+                try:
+                    f.write(vectors.tobytes())
+                    f.flush()
+                except Exception:
+                    f.truncate(first * self.row_bytes)
+                    raise
+            rows = list(range(first, first + len(vectors)))
+            with self._lock:
+                try:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    self._conn.executemany(
+                        "INSERT INTO vectors (row, case_id, patient_id, session_id, endpoint, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(row, meta.get("case_id"), meta.get("patient_id"), meta.get("session_id"),
+                          meta.get("endpoint"), meta.get("created_at", time.time()))
+                         for row, meta in zip(rows, metadata)]
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                    # Later appends would land after these rows, out of reach of _recover
+                    os.truncate(self.vectors_path, first * self.row_bytes)
+                    raise
+        return rows
+
+    def metadata(self, rows: List[int]) -> Dict[int, Dict]:
+        if not rows:
+            return {}
+        placeholders = ", ".join("?" for _ in rows)
+        with self._lock:
+            found = self._conn.execute(f"SELECT * FROM vectors WHERE row IN ({placeholders})",
+                                       [int(row) for row in rows]).fetchall()
+        return {r["row"]: dict(r) for r in found}
+
+    def case_rows(self, case_id: str) -> List[int]:
+        with self._lock:
+            return [r["row"] for r in self._conn.execute("SELECT row FROM vectors WHERE case_id = ?", (case_id,))]
+
+    def vector(self, row: int) -> np.ndarray:
+        return np.asarray(self._vectors(row + 1)[row], dtype=np.float32)
+
+    def _exact(self, vectors: np.ndarray, query: np.ndarray, k: int, start: int = 0):
+        """Top k of rows `start:` by a blocked scan"""
+        block = max(1, SEARCH_BLOCK_BYTES // (self.dim * 4))
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for offset in range(start, len(vectors), block):
+            scores = vectors[offset:offset + block].astype(np.float32) @ query
+            rows = np.arange(offset, offset + len(scores), dtype=np.int64)
+            best_scores, best_rows = _top_k(np.concatenate([best_scores, scores]),
+                                            np.concatenate([best_rows, rows]), k)
+        return best_scores, best_rows
+
+    def load_index(self) -> Optional[Dict]:
+        """The IVF index on disk, reloaded when another process rebuilt it"""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except FileNotFoundError:
+            return None
+        if mtime != self._index_mtime:
+            with np.load(self.index_path) as data:
+                self._index = {name: data[name] for name in data.files}
+            self._index_mtime = mtime
+        return self._index
+
+    def search(self, query: np.ndarray, k: int = 10, approximate: Optional[bool] = None, probes: int = 8,
+               exclude_rows=()) -> List[Dict]:
+        """
+        Rows most similar (cosine) to `query`, best first, with their
+        metadata. `approximate=None` uses the IVF index when one exists.
+        """
+        query = normalized(pooled(query))
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dimensional query, got {query.shape[0]}")
+        count = self.count
+        vectors = self._vectors(count)
+        wanted = k + len(exclude_rows)
+        index = self.load_index() if approximate is not False else None
+        if approximate and index is None:
+            raise ValueError("No approximate index has been built for this store")
+
+        if index is None:
+            scores, rows = self._exact(vectors, query, wanted)
+        else:
+            # Nearest clusters, then exact scores within them
+            nearest = np.argsort(-(index["centroids"] @ query))[:probes]
+            offsets = index["offsets"]
+            candidates = np.sort(np.concatenate(
+                [index["rows"][offsets[c]:offsets[c + 1]] for c in nearest]
+            ))
+            candidates = candidates[candidates < count]
+            scores, rows = _top_k(vectors[candidates].astype(np.float32) @ query, candidates, wanted)
+            # Rows appended since the index was built are scanned exactly
+            indexed = int(index["count"])
+            if indexed < count:
+                tail_scores, tail_rows = self._exact(vectors, query, wanted, start=indexed)
+                scores, rows = _top_k(np.concatenate([scores, tail_scores]), np.concatenate([rows, tail_rows]),
+                                      wanted)
+
+        excluded = set(int(row) for row in exclude_rows)
+        hits = [(float(score), int(row)) for score, row in zip(scores, rows) if int(row) not in excluded][:k]
+        metadata = self.metadata([row for _, row in hits])
+        return [{"score": score, "row": row, **metadata.get(row, {})} for score, row in hits]
+
+    def index_stale(self, min_rows: int, rebuild_fraction: float = 0.1) -> bool:
+        """Whether the collection is large enough for an index and has outgrown the current one"""
+        count = self.count
+        if count < min_rows:
+            return False
+        index = self.load_index()
+        return index is None or count - int(index["count"]) > rebuild_fraction * int(index["count"])
+
+    def build_index(self, lists: Optional[int] = None, iterations: int = 10, sample_per_list: int = 64,
+                    seed: int = 0) -> bool:
+        """
+        Build the IVF index: spherical k-means centroids trained on a sample,
+        then every row assigned to its nearest centroid. Returns False when
+        another process is already building it.
+        """
+        with _file_lock(os.path.join(self.directory, "index.lock"), blocking=False) as locked:
+            if not locked:
+                return False
+            count = self.count
+            vectors = self._vectors(count)
+            lists = min(count, lists or max(1, int(np.sqrt(count))))
+            rng = np.random.default_rng(seed)
+            sample = min(count, lists * sample_per_list)
+            training = vectors[np.sort(rng.choice(count, size=sample, replace=False))].astype(np.float32)
+            centroids = training[rng.choice(sample, size=lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(training @ centroids.T, axis=1)
+                # Per-cluster sums of the sorted sample; empty clusters restart at a random point
+                order = np.argsort(assignment, kind="stable")
+                sizes = np.bincount(assignment, minlength=lists)
+                starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+                sums = training[rng.choice(sample, size=lists)]
+                filled = sizes > 0
+                sums[filled] = np.add.reduceat(training[order], starts[filled], axis=0)
+                centroids = normalized(sums)
+
+            block = max(1, SEARCH_BLOCK_BYTES // (self.dim * 4))
+            assignment = np.concatenate([
+                np.argmax(vectors[offset:offset + block].astype(np.float32) @ centroids.T, axis=1)
+                for offset in range(0, count, block)
+            ]) if count else np.empty(0, dtype=np.int64)
+            order = np.argsort(assignment, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=lists))])
+
+            # Written beside the old index and swapped in, so readers never see half of one
+            temp_path = self.index_path + ".tmp.npz"
+            np.savez(temp_path, centroids=centroids.astype(np.float32), offsets=offsets.astype(np.int64),
+                     rows=order.astype(np.int64), count=np.int64(count))
+            os.replace(temp_path, self.index_path)
+        logger.info(f"Built an IVF index of {lists} lists over {count} vectors in {self.directory}")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._map = None
+
+
+class EmbeddingStore:
+    """
+    Similar-case search over the embeddings the analyzers already compute.
+
+    `record()` queues an analysis result; a background thread pools each
+    modality's features into one vector (see SPACES), appends it to that
+    modality's VectorSpace under EMBEDDINGS_DIR and, once a space holds
+    EMBEDDING_INDEX_MIN_ROWS vectors, keeps its approximate index within
+    10% of the collection. Recording never blocks a request: when the queue
+    is full the result is dropped and counted.
+    """
+
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 queue_size: Optional[int] = None,
+                 index_min_rows: Optional[int] = None,
+                 probes: Optional[int] = None):
+        self.directory = directory or os.getenv("EMBEDDINGS_DIR", "embeddings")
+        self.index_min_rows = index_min_rows if index_min_rows is not None else \
+            int(os.getenv("EMBEDDING_INDEX_MIN_ROWS", "50000"))
+        self.probes = probes or int(os.getenv("EMBEDDING_INDEX_PROBES", "8"))
+        self.spaces: Dict[str, VectorSpace] = {}
+        self._spaces_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size or int(os.getenv("EMBEDDING_QUEUE_SIZE", "10000")))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def space(self, name: str, dim: Optional[int] = None) -> Optional[VectorSpace]:
+        """A modality's vector space; created with `dim` on first write, None if it does not exist yet"""
+        if name not in SPACES:
+            raise ValueError(f"Unknown embedding space '{name}', expected one of {tuple(SPACES)}")
+        with self._spaces_lock:
+            if name not in self.spaces:
+                directory = os.path.join(self.directory, name)
+                if dim is None and not os.path.exists(os.path.join(directory, "header.json")):
+                    return None
+                self.spaces[name] = VectorSpace(directory, dim)
+            return self.spaces[name]
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._write, name="embedding-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def record(self, results: Dict, case_id: str, endpoint: Optional[str] = None,
+               patient_id: Optional[str] = None, session_id: Optional[str] = None):
+        """Queue a result's embeddings for storage; never blocks"""
+        features = {
+            space: section["features"]
+            for space, key in SPACES.items()
+            for section in [results.get(key)]
+            if isinstance(section, dict) and section.get("features") is not None
+        }
+        if not features:
+            return
+        meta = {"case_id": case_id, "endpoint": endpoint, "patient_id": patient_id, "session_id": session_id,
+                "created_at": time.time()}
+        try:
+            self._queue.put_nowait((features, meta))
+        except queue.Full:
+            self.dropped += 1
+
+    def add(self, space: str, features, meta: Dict) -> int:
+        vector = pooled(features)
+        return self.space(space, dim=vector.shape[0]).append(vector[None], [meta])[0]
+
+    def _write(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                features, meta = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            for space, value in features.items():
+                try:
+                    self.add(space, value, meta)
+                    self.recorded += 1
+                    if self.index_min_rows > 0 and self.spaces[space].index_stale(self.index_min_rows):
+                        self.spaces[space].build_index()
+                except Exception as e:
+                    logger.error(f"Error storing {space} embedding: {str(e)}")
+                    self.failed += 1
+
+    def similar(self, space: str, features=None, case_id: Optional[str] = None, k: int = 10,
+                approximate: Optional[bool] = None) -> List[Dict]:
+        """
+        Stored cases most similar to `features` or to a stored case (which
+        is left out of its own results), best first.
+        """
+        store = self.space(space)
+        if store is None:
+            return []
+        k = max(1, min(k, MAX_RESULTS))
+        exclude = []
+        if case_id is not None:
+            exclude = store.case_rows(case_id)
+            if not exclude:
+                raise KeyError(f"No {space} embedding stored for case {case_id}")
+            features = store.vector(exclude[-1])
+        return store.search(features, k, approximate, self.probes, exclude_rows=exclude)
+
+    def stats(self) -> Dict:
+        spaces = {}
+        for name in SPACES:
+            store = self.space(name)
+            if store is not None:
+                index = store.load_index()
+                spaces[name] = {"dim": store.dim, "vectors": store.count,
+                                "indexed": int(index["count"]) if index is not None else 0}
+        return {"queued": self._queue.qsize(), "recorded": self.recorded, "dropped": self.dropped,
+                "failed": self.failed, "spaces": spaces}
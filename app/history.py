@@ -0,0 +1,387 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODALITIES = ("text", "image", "audio", "video")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    case_id TEXT,
+    patient_id TEXT,
+    session_id TEXT,
+    endpoint TEXT,
+    modalities TEXT NOT NULL,
+    findings TEXT NOT NULL,
+    recommendations TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS history_patient ON history (patient_id, id);
+CREATE INDEX IF NOT EXISTS history_session ON history (session_id, id);
+CREATE INDEX IF NOT EXISTS history_created ON history (created_at);
+CREATE INDEX IF NOT EXISTS history_case ON history (case_id);
+CREATE TABLE IF NOT EXISTS history_modality (
+    modality TEXT NOT NULL,
+    entry_id INTEGER NOT NULL,
+    PRIMARY KEY (modality, entry_id)
+) WITHOUT ROWID;
+"""
+
+MAX_PAGE_SIZE = 500
+
+
+def modalities_of(text=None, image=None, image_path=None, audio_path=None, video_path=None, **_) -> List[str]:
+    """Modalities present in a set of orchestrator inputs"""
+    present = {
+        "text": text,
+        "image": image is not None or image_path,
+        "audio": audio_path,
+        "video": video_path,
+    }
+    return [name for name in MODALITIES if present[name]]
+
+
+class HistoryStore:
+    """
+    SQLite-backed analysis history.
+
+    Entries are keyed by an increasing id, which doubles as the pagination
+    cursor. Each entry's modalities are also listed in history_modality so
+    a modality filter walks an index instead of scanning. Writes and reads
+    use separate connections, so in WAL mode a batch insert never blocks a
+    history query.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = self._connect()
+        columns = {row["name"] for row in self._writer.execute("PRAGMA table_info(history)")}
+        if columns and "case_id" not in columns:
+            self._writer.execute("ALTER TABLE history ADD COLUMN case_id TEXT")
+        self._writer.executescript(SCHEMA)
+        self._reader = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new database, before the switch to WAL creates it
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, not corruption
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def add_many(self, entries: List[Dict]):
+        """Insert entries in one transaction"""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                for entry in entries:
+                    cursor = self._writer.execute(
+                        "INSERT INTO history (created_at, case_id, patient_id, session_id, endpoint, modalities, "
+                        "findings, recommendations, confidence, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (entry["created_at"], entry.get("case_id"), entry.get("patient_id"), entry.get("session_id"),
+                         entry.get("endpoint"), ",".join(entry["modalities"]), json.dumps(entry["findings"]),
+                         json.dumps(entry["recommendations"]), entry["confidence"], entry.get("error"))
+                    )
+                    self._writer.executemany(
+                        "INSERT INTO history_modality (modality, entry_id) VALUES (?, ?)",
+                        [(modality, cursor.lastrowid) for modality in entry["modalities"]]
+                    )
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def query(self,
+              limit: int = 50,
+              cursor: Optional[int] = None,
+              case_id: Optional[str] = None,
+              patient_id: Optional[str] = None,
+              session_id: Optional[str] = None,
+              modality: Optional[str] = None,
+              since: Optional[float] = None,
+              until: Optional[float] = None) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Newest entries first, `limit` at a time. Returns the page and the
+        cursor for the next one (None on the last page).
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if modality:
+            # Walk the (modality, entry_id) key backwards from the cursor
+            key = "m.entry_id"
+            query = "SELECT h.* FROM history_modality m JOIN history h ON h.id = m.entry_id"
+            conditions, params = ["m.modality = ?"], [modality]
+        else:
+            key = "h.id"
+            query = "SELECT h.* FROM history h"
+            conditions, params = [], []
+        for column, value in (("case_id", case_id), ("patient_id", patient_id), ("session_id", session_id)):
+            if value is not None:
+                conditions.append(f"h.{column} = ?")
+                params.append(value)
+        # Ids don't follow created_at across workers flushing their own
+        # batches, so a time window is filtered on created_at itself
+        if since is not None:
+            conditions.append("h.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("h.created_at < ?")
+            params.append(until)
+        if cursor is not None:
+            conditions.append(f"{key} < ?")
+            params.append(cursor)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {key} DESC LIMIT ?"
+        params.append(limit)
+
+        with self._read_lock:
+            rows = self._reader.execute(query, params).fetchall()
+        entries = [
+            {
+                "id": row["id"],
+                "created_at": row["created_at"],
+                "case_id": row["case_id"],
+                "patient_id": row["patient_id"],
+                "session_id": row["session_id"],
+                "endpoint": row["endpoint"],
+                "modalities": row["modalities"].split(",") if row["modalities"] else [],
+                "findings": json.loads(row["findings"]),
+                "recommendations": json.loads(row["recommendations"]),
+                "confidence": row["confidence"],
+                "error": row["error"]
+            }
+            for row in rows
+        ]
+        next_cursor = entries[-1]["id"] if len(entries) == limit else None
+        return entries, next_cursor
+
+    def _expired(self, older_than: Optional[float], max_rows: int, chunk: int) -> List[sqlite3.Row]:
+        """Up to `chunk` entries older than a timestamp, or beyond the newest `max_rows` by created_at"""
+        rows = {}
+        if older_than is not None:
+            for row in self._writer.execute(
+                "SELECT id, modalities FROM history WHERE created_at < ? ORDER BY created_at LIMIT ?",
+                (older_than, chunk)
+            ):
+                rows[row["id"]] = row
+        if max_rows > 0 and len(rows) < chunk:
+            for row in self._writer.execute(
+                "SELECT id, modalities FROM history ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                (chunk - len(rows), max_rows)
+            ):
+                rows[row["id"]] = row
+        return list(rows.values())
+
+    def purge(self, older_than: Optional[float] = None, max_rows: int = 0, chunk: int = 10000) -> int:
+        """
+        Delete the oldest entries, in chunks so inserts are never blocked for
+        long; returns how many were deleted. Age is read from created_at
+        rather than the id, since workers' batches interleave their ids.
+        """
+        if older_than is None and max_rows <= 0:
+            return 0
+        deleted = 0
+        while True:
+            with self._write_lock:
+                self._writer.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = self._expired(older_than, max_rows, chunk)
+                    self._writer.executemany("DELETE FROM history WHERE id = ?", [(row["id"],) for row in rows])
+                    self._writer.executemany(
+                        "DELETE FROM history_modality WHERE modality = ? AND entry_id = ?",
+                        [(modality, row["id"]) for row in rows for modality in row["modalities"].split(",") if modality]
+                    )
+                    self._writer.execute("COMMIT")
+                except Exception:
+                    self._writer.execute("ROLLBACK")
+                    raise
+            if not rows:
+                return deleted
+            deleted += len(rows)
+
+    def compact(self, pages: int = 0):
+        """Return freed pages to the filesystem (all, or up to `pages`) and truncate the WAL"""
+        with self._write_lock:
+            # executescript steps the vacuum to completion; execute() frees a single page
+            self._writer.executescript(f"PRAGMA incremental_vacuum({int(pages)});" if pages else
+                                       "PRAGMA incremental_vacuum;")
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    def count(self) -> int:
+        with self._read_lock:
+            return self._reader.execute("SELECT COUNT(*) AS n FROM history").fetchone()["n"]
+
+    def close(self):
+        with self._write_lock, self._read_lock:
+            self._writer.close()
+            self._reader.close()
+
+
+class HistoryRecorder:
+    """
+    Write-behind recorder for the analysis history.
+
+    `record()` reduces the results to the stored columns with
+    `summarize(results)` (findings, recommendations, confidence), so the
+    queue never holds feature or embedding arrays, and puts the entry on a
+    bounded in-memory queue; a background thread inserts entries in batches
+    of up to `batch_size`, at least every `flush_interval` seconds. When the
+    queue is full, entries are dropped and counted rather than slowing the
+    request down. The same thread applies the retention settings and
+    compacts the database every `compact_interval` seconds.
+    """
+
+    def __init__(self,
+                 summarize: Callable[[Dict], Dict],
+                 history_dir: Optional[str] = None,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 queue_size: Optional[int] = None,
+                 retention_days: Optional[float] = None,
+                 max_rows: Optional[int] = None,
+                 compact_interval: Optional[float] = None):
+        self.summarize = summarize
+        self.history_dir = history_dir or os.getenv("HISTORY_DIR", "history")
+        self.batch_size = batch_size or int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            float(os.getenv("HISTORY_FLUSH_SECONDS", "0.5"))
+        self.retention_days = retention_days if retention_days is not None else \
+            float(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+        self.max_rows = max_rows if max_rows is not None else int(os.getenv("HISTORY_MAX_ROWS", "0"))
+        self.compact_interval = compact_interval if compact_interval is not None else \
+            float(os.getenv("HISTORY_COMPACT_INTERVAL_SECONDS", "3600"))
+        self.store: Optional[HistoryStore] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size or int(os.getenv("HISTORY_QUEUE_SIZE", "10000")))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def open_store(self) -> HistoryStore:
+        return HistoryStore(os.path.join(self.history_dir, "history.db"))
+
+    def start(self):
+        """Open the database and start the writer"""
+        if self.store is None:
+            self.store = self.open_store()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._write, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush what is queued and stop the writer"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def record(self,
+               results: Dict,
+               modalities: List[str],
+               endpoint: Optional[str] = None,
+               case_id: Optional[str] = None,
+               patient_id: Optional[str] = None,
+               session_id: Optional[str] = None):
+        """Queue an analysis for the history; never blocks"""
+        created_at = time.time()
+        if self._queue.full():
+            self.dropped += 1
+            return
+        try:
+            summary = self.summarize(results)
+        except Exception as e:
+            logger.error(f"Error summarizing history entry: {str(e)}")
+            self.failed += 1
+            return
+        entry = {
+            "created_at": created_at,
+            "case_id": case_id,
+            "patient_id": patient_id,
+            "session_id": session_id,
+            "endpoint": endpoint,
+            "modalities": modalities,
+            "findings": summary["findings"],
+            "recommendations": summary["recommendations"],
+            "confidence": summary["confidence"],
+            "error": results.get("error")
+        }
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first_wait: float, limit: int) -> List:
+        """Up to `limit` queued items, waiting at most `first_wait` for the first"""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=max(0.0, first_wait)))
+            while len(batch) < limit:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def flush(self, entries: List[Dict]):
+        try:
+            self.store.add_many(entries)
+            self.recorded += len(entries)
+        except sqlite3.Error as e:
+            logger.error(f"Error writing {len(entries)} history entries: {str(e)}")
+            self.failed += len(entries)
+
+    def maintain(self):
+        """Apply retention and compact the database"""
+        older_than = time.time() - self.retention_days * 86400 if self.retention_days > 0 else None
+        try:
+            deleted = self.store.purge(older_than, self.max_rows)
+            if deleted:
+                logger.info(f"Purged {deleted} history entries")
+            self.store.compact()
+        except sqlite3.Error as e:
+            logger.error(f"Error compacting history: {str(e)}")
+
+    def _write(self):
+        last_maintenance = time.monotonic()
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            items = self._drain(self.flush_interval, self.batch_size)
+            # Gather more until the batch is full or the flush interval is up
+            while items and len(items) < self.batch_size and time.monotonic() < deadline:
+                more = self._drain(deadline - time.monotonic(), self.batch_size - len(items))
+                if not more:
+                    break
+                items.extend(more)
+            if items:
+                self.flush(items)
+            if self.compact_interval > 0 and time.monotonic() - last_maintenance >= self.compact_interval:
+                last_maintenance = time.monotonic()
+                self.maintain()
+        # Final flush on shutdown
+        while True:
+            items = self._drain(0, self.batch_size)
+            if not items:
+                break
+            self.flush(items)
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize(),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from .ai_models.cancellation import CancelToken, Cancelled
+from .serialization import dumps_json, prepare
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    partial_results TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+"""
+
+
+class JobStore:
+    """
+    SQLite-backed persistent job queue.
+
+    One connection is shared by the API and worker threads behind a lock;
+    WAL mode lets other processes read while a worker writes.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "worker_pid" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN worker_pid INTEGER")
+
+    def add(self, job_id: str, inputs: Dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, state, inputs, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(inputs), time.time())
+            )
+
+    def get(self, job_id: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def claim(self) -> Optional[sqlite3.Row]:
+        """Atomically move the oldest queued job to running (owned by this process) and return it"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE state = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = ?, started_at = ?, worker_pid = ? WHERE id = ?",
+                        (RUNNING, time.time(), os.getpid(), row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def update_progress(self, job_id: str, progress: Dict, partial_results: Dict) -> bool:
+        """Store progress; returns True if cancellation was requested meanwhile"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, partial_results = ? WHERE id = ?",
+                (json.dumps(progress), dumps_json(partial_results).decode(), job_id)
+            )
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def finish(self, job_id: str, state: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (state, dumps_json(result).decode() if result is not None else None, error, time.time(), job_id)
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel a queued job outright or flag a running one.
+
+        Returns the job's state afterwards, or None if it doesn't exist.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    state = None
+                elif row["state"] == QUEUED:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = ?, finished_at = ? WHERE id = ?", (CANCELLED, time.time(), job_id)
+                    )
+                    state = CANCELLED
+                else:
+                    if row["state"] == RUNNING:
+                        self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+                    state = row["state"]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return state
+
+    def requeue_running(self, worker_pid: Optional[int] = None) -> int:
+        """
+        Put jobs interrupted by a restart back on the queue: every running
+        job, or only those owned by the process `worker_pid`.
+        """
+        query = ("UPDATE jobs SET state = CASE WHEN cancel_requested THEN ? ELSE ? END, "
+                 "started_at = NULL, worker_pid = NULL, progress = '{}', partial_results = '{}' WHERE state = ?")
+        params = [CANCELLED, QUEUED, RUNNING]
+        if worker_pid is not None:
+            query += " AND worker_pid = ?"
+            params.append(worker_pid)
+        with self._lock:
+            return self._conn.execute(query, params).rowcount
+
+    def purge(self, older_than: float) -> List[str]:
+        """Delete finished jobs older than a timestamp; returns their ids"""
+        placeholders = ", ".join("?" for _ in TERMINAL_STATES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM jobs WHERE state IN ({placeholders}) AND finished_at < ?",
+                (*TERMINAL_STATES, older_than)
+            ).fetchall()
+            ids = [row["id"] for row in rows]
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+        return ids
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    """
+    Run orchestrator analyses in background worker threads.
+
+    Jobs are persisted in a JobStore and their uploads under `jobs_dir`, so
+    queued work survives an API restart (jobs that were running are
+    requeued). Workers report per-modality progress and partial results as
+    each modality finishes. Each running job has a CancelToken: DELETE
+    fires it directly in this process, and a cancel flagged by another
+    process is picked up at the job's next progress report. With `admit`
+    set, each run first waits in it; the API takes a batch-priority
+    scheduler slot there.
+    """
+
+    def __init__(self,
+                 orchestrator,
+                 jobs_dir: Optional[str] = None,
+                 workers: Optional[int] = None,
+                 retention_hours: Optional[float] = None,
+                 progress_interval: float = 0.5,
+                 poll_interval: float = 1.0,
+                 recover_on_start: bool = True):
+        self.orchestrator = orchestrator
+        self.jobs_dir = jobs_dir or os.getenv("JOBS_DIR", "jobs")
+        self.workers = workers if workers is not None else int(os.getenv("JOBS_WORKERS", "1"))
+        if retention_hours is None:
+            retention_hours = float(os.getenv("JOBS_RETENTION_HOURS", "72"))
+        self.retention_hours = retention_hours
+        self.progress_interval = progress_interval
+        self.poll_interval = poll_interval
+        # A supervisor running several API workers recovers jobs itself, per dead worker
+        self.recover_on_start = recover_on_start
+        self.store = None
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._running: Dict[str, CancelToken] = {}
+        # Wraps each run, e.g. in a scheduler slot: admit(inputs, cancel token) -> context manager
+        self.admit: Optional[Callable[[Dict, CancelToken], ContextManager]] = None
+
+    def upload_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, "uploads", job_id)
+
+    def open_store(self) -> JobStore:
+        return JobStore(os.path.join(self.jobs_dir, "jobs.db"))
+
+    def recover(self, store: JobStore, worker_pid: Optional[int] = None) -> int:
+        """Requeue interrupted jobs (all, or one dead worker's) and purge expired ones"""
+        requeued = store.requeue_running(worker_pid)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job(s)")
+        for job_id in store.purge(time.time() - self.retention_hours * 3600):
+            shutil.rmtree(self.upload_dir(job_id), ignore_errors=True)
+        return requeued
+
+    def start(self):
+        """Open the queue, recover interrupted jobs and start the workers"""
+        if self.store is None:
+            self.store = self.open_store()
+        if self.recover_on_start:
+            self.recover(self.store)
+
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, inputs: Dict) -> str:
+        """
+        Queue a job. `inputs` holds the orchestrator arguments (text and file
+        paths under upload_dir(job_id)) plus include_embeddings and
+        embedding_dtype for the stored result.
+        """
+        self.store.add(job_id, inputs)
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self.store.get(job_id)
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "state": row["state"],
+            "cancel_requested": bool(row["cancel_requested"]),
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "progress": json.loads(row["progress"]),
+            "partial_results": json.loads(row["partial_results"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"]
+        }
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        state = self.store.request_cancel(job_id)
+        token = self._running.get(job_id)
+        if token is not None:
+            token.cancel("job cancelled")
+        if state == CANCELLED:
+            shutil.rmtree(self.upload_dir(job_id), ignore_errors=True)
+        return state
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: sqlite3.Row):
+        job_id = job["id"]
+        inputs = json.loads(job["inputs"])
+        include_embeddings = inputs.pop("include_embeddings", False)
+        embedding_dtype = inputs.pop("embedding_dtype", "float16")
+        progress: Dict[str, Dict] = {}
+        partial_results: Dict[str, Dict] = {}
+        last_flush = [0.0]
+        token = self._running[job_id] = CancelToken()
+
+        def report(modality, done, total, result=None):
+            progress[modality] = {
+                "state": "done" if result is not None else "running",
+                "done": done,
+                "total": total
+            }
+            if result is not None:
+                partial_results[modality], _ = prepare(result, include_embeddings, embedding_dtype)
+            now = time.monotonic()
+            if result is not None or now - last_flush[0] >= self.progress_interval:
+                last_flush[0] = now
+                if self.store.update_progress(job_id, progress, partial_results):
+                    token.cancel("job cancelled")
+
+        try:
+            with self.admit(inputs, token) if self.admit is not None else nullcontext():
+                results = self.orchestrator.analyze_input(progress=report, cancel=token, **inputs)
+            if token.cancelled or self.store.get(job_id)["cancel_requested"]:
+                self.store.update_progress(job_id, progress, partial_results)
+                self.store.finish(job_id, CANCELLED)
+            elif "error" in results:
+                self.store.finish(job_id, FAILED, error=results["error"])
+            else:
+                result, _ = prepare(results, include_embeddings, embedding_dtype)
+                self.store.finish(job_id, SUCCEEDED, result=result)
+        except Cancelled:
+            # Cancelled while waiting for a scheduler slot
+            self.store.finish(job_id, CANCELLED)
+        except Exception as e:
+            logger.error(f"Error running job {job_id}: {str(e)}")
+            self.store.finish(job_id, FAILED, error=str(e))
+        finally:
+            self._running.pop(job_id, None)
+            shutil.rmtree(self.upload_dir(job_id), ignore_errors=True)
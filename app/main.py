@@ -1,10 +1,27 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
+import asyncio
+import time
+import uuid
 import uvicorn
 import os
+# Before anything imports numpy or torch, so their thread pools follow the budget
+from .threads import thread_budget
 from .ai_models.orchestrator import AIOrchestrator
+from .ai_models.cascade import cascade_stats
+from .ai_models.cancellation import CancelToken
+from .ai_models.residency import process_rss
+from .ai_models.telemetry import REGISTRY, HTTP_REQUEST_SECONDS, Trace, current_trace, in_current_trace, record, span
+from .ai_models.profiling import PROFILE_MODES, ProfilerBusy, ProfileStore, authorized, profile_call
+from .serialization import EMBEDDING_KEYS, render
+from .jobs import JobManager
+from .history import MODALITIES, HistoryRecorder, modalities_of
+from .embeddings import SPACES, EmbeddingStore
+from .scheduler import FairScheduler, QueueFull, QueueTimeout, queue_for
 
 app = FastAPI(title="Medical AI Assistant API")
 
@@ -15,10 +32,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Case-Id"],
 )
 
-# Initialize AI Orchestrator
-ai_orchestrator = AIOrchestrator()
+# Size torch/OpenCV/BLAS thread pools, then initialize AI Orchestrator.
+# Analyzers (and torch, transformers, ...) load on first use or at startup per
+# PRELOAD_MODELS: "all" (default), "none" or a comma list such as "text,vision".
+# The budget is re-applied after each load to size the pools just imported.
+thread_budget.apply()
+ai_orchestrator = AIOrchestrator(on_load=lambda name, analyzer: thread_budget.apply(thread_budget.worker_index))
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "all").strip().lower()
+
+# Per-modality admission control in front of the orchestrator
+scheduler = FairScheduler()
+
+# Background analysis jobs; workers start with the app, not at import
+job_manager = JobManager(ai_orchestrator)
+
+# Analysis history, written behind the request by a background thread
+history = HistoryRecorder(summarize=lambda results: _build_response(results).model_dump())
+
+# CLIP and Wav2Vec2 features of past analyses, for similar-case search
+embedding_store = EmbeddingStore()
+
+# Default per-request deadline in seconds (0 disables); clients may lower it with X-Request-Timeout
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "300"))
+DISCONNECT_POLL_SECONDS = 0.5
+
+# Clients send X-Timing: 1 to get the per-stage breakdown back in a Server-Timing header
+TIMING_REQUEST_HEADER = "x-timing"
+
+# Per-request profiling is off unless PROFILING_TOKEN is set. Clients then send
+# X-Profile: python|torch|all with X-Profile-Token; the artifact is stored under
+# the id returned in X-Profile-Id and served from /profiles/{id}.
+PROFILE_REQUEST_HEADER = "x-profile"
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+profile_store = ProfileStore()
+
+REGISTRY.gauge(
+    "medai_queue_depth", "Requests waiting per scheduler queue", ("queue",),
+    lambda: {(name,): q["depth"] for name, q in scheduler.stats()["queues"].items()}
+)
+REGISTRY.gauge(
+    "medai_queue_running", "Analyses running per scheduler queue", ("queue",),
+    lambda: {(name,): q["running"] for name, q in scheduler.stats()["queues"].items()}
+)
+REGISTRY.gauge(
+    "medai_history_entries", "History entries queued for writing, recorded, dropped or failed", ("state",),
+    lambda: {(state,): count for state, count in history.stats().items()}
+)
+REGISTRY.gauge(
+    "medai_embedding_vectors", "Stored embeddings per space", ("space",),
+    lambda: {(name,): space["vectors"] for name, space in embedding_store.stats()["spaces"].items()}
+)
+REGISTRY.gauge(
+    "medai_process_resident_memory_bytes", "Resident memory of this worker process", (),
+    lambda: {(): process_rss()}
+)
+REGISTRY.gauge(
+    "medai_model_resident_bytes", "Memory footprint of each loaded analyzer", ("model",),
+    lambda: {
+        (name,): m["footprint_mb"] * 2**20
+        for name, m in ai_orchestrator.residency.stats()["models"].items() if m["resident"]
+    }
+)
 
 DISCLAIMER = "This is not a substitute for professional medical advice. Always consult a healthcare professional."
 
@@ -34,6 +111,17 @@ class AnalysisResponse(BaseModel):
     disclaimer: str = DISCLAIMER
 
 
+class HistoryEntry(AnalysisResponse):
+    id: int
+    created_at: float
+    case_id: Optional[str] = None
+    endpoint: Optional[str] = None
+    modalities: List[str]
+    patient_id: Optional[str] = None
+    session_id: Optional[str] = None
+    error: Optional[str] = None
+
+
 def _save_upload(upload: UploadFile, content: bytes) -> str:
     """Save an uploaded file to temp/ and return the path."""
     os.makedirs("temp", exist_ok=True)
@@ -43,14 +131,169 @@ def _save_upload(upload: UploadFile, content: bytes) -> str:
     return path
 
 
+def _save_job_upload(job_id: str, upload: UploadFile, content: bytes) -> str:
+    """Save an uploaded file to the job's persistent upload directory."""
+    directory = job_manager.upload_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, os.path.basename(upload.filename or "upload"))
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
 def _cleanup(path: Optional[str]):
     """Remove a temp file if it exists."""
     if path and os.path.exists(path):
         os.remove(path)
 
 
+async def _read_upload(upload: UploadFile) -> bytes:
+    with span("upload.read"):
+        return await upload.read()
+
+
+async def _read_image(upload: UploadFile):
+    """
+    Open an image upload off the event loop. DICOM and large images are
+    spooled to a temp file for memory-mapped tiling rather than read into RAM.
+    """
+    from .ai_models.tiling import load_upload
+    with span("upload.read"):
+        return await run_in_threadpool(load_upload, upload.file, upload.filename)
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """Time every request; stages timed while it runs are collected in its trace."""
+    trace = Trace()
+    with trace.bind():
+        response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - trace.started,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code
+    )
+    if request.headers.get(TIMING_REQUEST_HEADER, "").lower() in ("1", "true", "yes"):
+        response.headers["Server-Timing"] = trace.server_timing()
+    profile_id = getattr(request.state, "profile_id", None)
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    case_id = getattr(request.state, "case_id", None)
+    if case_id:
+        response.headers["X-Case-Id"] = case_id
+    return response
+
+
+def _profile_mode(request: Request) -> Optional[str]:
+    """The profile mode requested in X-Profile, once the caller is authorized."""
+    mode = request.headers.get(PROFILE_REQUEST_HEADER)
+    if not mode:
+        return None
+    if not authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or the profile token is invalid")
+    mode = mode.strip().lower()
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"X-Profile must be one of {', '.join(PROFILE_MODES)}")
+    return mode
+
+
+def _profiled(analyze, mode: str, profile_id: str):
+    """`analyze` run under the profiler, storing the artifact under `profile_id`."""
+    trace = current_trace()
+
+    def run(**inputs):
+        result, artifact = profile_call(lambda: analyze(**inputs), mode, PROFILE_SAMPLE_INTERVAL)
+        artifact["request_id"] = profile_id
+        if trace is not None:
+            artifact["stages"] = trace.summary()
+        profile_store.save(profile_id, artifact)
+        return result
+
+    return run
+
+
+def _request_token(request: Request) -> CancelToken:
+    """Cancel token carrying the request deadline (the shorter of the header and the server default)."""
+    timeout = REQUEST_TIMEOUT_SECONDS
+    header = request.headers.get("x-request-timeout")
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = 0
+        if requested > 0:
+            timeout = min(timeout, requested) if timeout > 0 else requested
+    return CancelToken.with_timeout(timeout)
+
+
+async def _run_in_slot(request: Request, fn, **inputs) -> dict:
+    """
+    Run an orchestrator method in the threadpool with a cancel token.
+
+    The request first waits for a slot in its modality's scheduler queue
+    (X-Priority: urgent, normal or batch). The token expires at the request
+    deadline and is cancelled as soon as the client disconnects, so
+    abandoned requests stop within one frame, window or batch. With an
+    authorized X-Profile header the call runs under the profiler.
+    """
+    profile_mode = _profile_mode(request)
+    token = _request_token(request)
+    priority = request.headers.get("x-priority", "normal").lower()
+    queued = time.perf_counter()
+    try:
+        async with scheduler.slot(queue_for(**inputs), priority, timeout=token.remaining()):
+            record("queue.wait", time.perf_counter() - queued)
+            # The worker thread records its stages into this request's trace
+            analyze = in_current_trace(fn)
+            if profile_mode:
+                request.state.profile_id = uuid.uuid4().hex
+                analyze = _profiled(analyze, profile_mode, request.state.profile_id)
+            task = asyncio.ensure_future(run_in_threadpool(analyze, cancel=token, **inputs))
+            while not task.done():
+                await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+                if not task.done() and await request.is_disconnected():
+                    token.cancel("client disconnected")
+            return task.result()
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except QueueTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ProfilerBusy as e:
+        request.state.profile_id = None
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+
+
+async def _run_analysis(request: Request, **inputs) -> dict:
+    """
+    Analyze the inputs in a scheduler slot, then queue the result for the
+    history and its embeddings for similar-case search. Both are written
+    by background threads, keyed by the case id (X-Case-Id, or generated
+    and returned in that header) and tagged with X-Patient-Id and
+    X-Session-Id.
+    """
+    case_id = (request.headers.get("x-case-id") or uuid.uuid4().hex)[:128]
+    results = await _run_in_slot(request, ai_orchestrator.analyze_input, **inputs)
+    request.state.case_id = case_id
+    tags = {
+        "endpoint": request.url.path,
+        "case_id": case_id,
+        "patient_id": request.headers.get("x-patient-id"),
+        "session_id": request.headers.get("x-session-id")
+    }
+    history.record(results, modalities_of(**inputs), **tags)
+    embedding_store.record(results, **tags)
+    return results
+
+
 def _to_response(results: dict) -> AnalysisResponse:
     """Convert orchestrator results to the frontend AnalysisResponse shape."""
+    with span("response.build"):
+        return _build_response(results)
+
+
+def _build_response(results: dict) -> AnalysisResponse:
     if "error" in results:
         return AnalysisResponse(
             findings=[f"Error: {results['error']}"],
@@ -64,6 +307,9 @@ def _to_response(results: dict) -> AnalysisResponse:
         if analysis:
             if isinstance(analysis, dict):
                 for k, v in analysis.items():
+                    # Embeddings and other arrays are not human-readable findings
+                    if k in EMBEDDING_KEYS or hasattr(v, "shape"):
+                        continue
                     if v:
                         findings.append(f"{k}: {v}")
             elif isinstance(analysis, str):
@@ -75,6 +321,9 @@ def _to_response(results: dict) -> AnalysisResponse:
         elif diag:
             findings.append(str(diag))
 
+    if results.get("cancelled"):
+        findings.append(f"Analysis stopped early ({results['cancelled']}); results are partial.")
+
     if not findings:
         findings = ["No significant findings detected."]
 
@@ -95,91 +344,334 @@ def _to_response(results: dict) -> AnalysisResponse:
 # --- Individual endpoints (match frontend api.ts) ---
 
 @app.post("/analyze/image", response_model=AnalysisResponse)
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(request: Request, file: UploadFile = File(...)):
     """Analyze a single image file."""
-    content = await file.read()
-    path = _save_upload(file, content)
     try:
-        results = ai_orchestrator.analyze_input(image_path=path)
-        return _to_response(results)
-    finally:
-        _cleanup(path)
+        image = await _read_image(file)
+    except ValueError as e:
+        return _to_response({"error": str(e)})
+    results = await _run_analysis(request, image=image)
+    return _to_response(results)
 
 
 @app.post("/analyze/audio", response_model=AnalysisResponse)
-async def analyze_audio(file: UploadFile = File(...)):
+async def analyze_audio(request: Request, file: UploadFile = File(...)):
     """Analyze a single audio file."""
-    content = await file.read()
+    content = await _read_upload(file)
     path = _save_upload(file, content)
     try:
-        results = ai_orchestrator.analyze_input(audio_path=path)
+        results = await _run_analysis(request, audio_path=path)
         return _to_response(results)
     finally:
         _cleanup(path)
 
 
 @app.post("/analyze/video", response_model=AnalysisResponse)
-async def analyze_video(file: UploadFile = File(...)):
+async def analyze_video(request: Request, file: UploadFile = File(...)):
     """Analyze a single video file."""
-    content = await file.read()
+    content = await _read_upload(file)
     path = _save_upload(file, content)
     try:
-        results = ai_orchestrator.analyze_input(video_path=path)
+        results = await _run_analysis(request, video_path=path)
         return _to_response(results)
     finally:
         _cleanup(path)
 
 
 @app.post("/analyze/text", response_model=AnalysisResponse)
-async def analyze_text(request: TextRequest):
+async def analyze_text(body: TextRequest, request: Request):
     """Analyze text symptoms."""
-    results = ai_orchestrator.analyze_input(text=request.text)
+    results = await _run_analysis(request, text=body.text)
     return _to_response(results)
 
 
-@app.get("/history", response_model=List[AnalysisResponse])
-async def get_history():
-    """Return analysis history (placeholder — no persistence yet)."""
-    return []
+@app.get("/history", response_model=List[HistoryEntry])
+async def get_history(
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[int] = None,
+    case_id: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    modality: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None
+):
+    """
+    Past analyses, newest first. Filter by case, patient, session, modality
+    and a time range (Unix seconds). When there are more, X-Next-Cursor holds the
+    `cursor` for the next page.
+    """
+    if modality is not None and modality not in MODALITIES:
+        raise HTTPException(status_code=400, detail=f"modality must be one of {', '.join(MODALITIES)}")
+    entries, next_cursor = await run_in_threadpool(
+        history.store.query, limit, cursor, case_id, patient_id, session_id, modality, since, until
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return entries
 
 
 # --- Combined multimodal endpoint (backward-compatible) ---
 
 @app.post("/analyze")
 async def analyze_input(
+    request: Request,
     text: Optional[str] = Form(None),
     image: Optional[UploadFile] = File(None),
     audio: Optional[UploadFile] = File(None),
-    video: Optional[UploadFile] = File(None)
+    video: Optional[UploadFile] = File(None),
+    include_embeddings: bool = Form(False),
+    embedding_dtype: str = Form("float16")
 ):
-    """Analyze any combination of multimodal medical inputs."""
-    image_path = None
+    """
+    Analyze any combination of multimodal medical inputs.
+
+    The response format follows the Accept header (JSON, msgpack or npz);
+    embeddings are only included when `include_embeddings` is set.
+    """
+    accept = request.headers.get("accept")
+    image_input = None
     audio_path = None
     video_path = None
 
     try:
         if image:
-            image_path = _save_upload(image, await image.read())
+            image_input = await _read_image(image)
         if audio:
-            audio_path = _save_upload(audio, await audio.read())
+            audio_path = _save_upload(audio, await _read_upload(audio))
         if video:
-            video_path = _save_upload(video, await video.read())
+            video_path = _save_upload(video, await _read_upload(video))
 
-        results = ai_orchestrator.analyze_input(
+        results = await _run_analysis(
+            request,
             text=text,
-            image_path=image_path,
+            image=image_input,
             audio_path=audio_path,
             video_path=video_path
         )
-        return results
+        return render(results, accept, include_embeddings, embedding_dtype)
+    except HTTPException:
+        raise
     except Exception as e:
-        return {"error": str(e)}
+        return render({"error": str(e)}, accept)
     finally:
-        _cleanup(image_path)
         _cleanup(audio_path)
         _cleanup(video_path)
 
 
+@app.on_event("startup")
+async def preload_models():
+    if PRELOAD_MODELS in ("", "none"):
+        return
+    names = None if PRELOAD_MODELS == "all" else [n.strip() for n in PRELOAD_MODELS.split(",") if n.strip()]
+    await run_in_threadpool(ai_orchestrator.preload, names)
+
+
+@app.on_event("startup")
+def start_model_residency():
+    # Idle eviction sweep; started here so it runs in each forked worker
+    ai_orchestrator.residency.start()
+
+
+@app.on_event("shutdown")
+def stop_model_residency():
+    ai_orchestrator.residency.stop()
+
+
+@app.on_event("startup")
+def start_history():
+    history.start()
+
+
+@app.on_event("shutdown")
+def stop_history():
+    history.stop()
+
+
+@app.on_event("startup")
+def start_embedding_store():
+    embedding_store.start()
+
+
+@app.on_event("shutdown")
+def stop_embedding_store():
+    embedding_store.stop()
+
+
+# --- Similar cases ---
+
+@app.post("/similar")
+async def find_similar(
+    request: Request,
+    image: Optional[UploadFile] = File(None),
+    audio: Optional[UploadFile] = File(None),
+    k: int = Form(10),
+    approximate: Optional[bool] = Form(None)
+):
+    """
+    Prior cases most similar to an uploaded image (CLIP) and/or recording
+    (Wav2Vec2), best first, per modality. Only the embeddings are computed.
+    """
+    audio_path = None
+    try:
+        inputs = {}
+        if image:
+            inputs["image"] = await _read_image(image)
+        if audio:
+            audio_path = inputs["audio_path"] = _save_upload(audio, await _read_upload(audio))
+        if not inputs:
+            raise HTTPException(status_code=400, detail="Upload an image or an audio file")
+        features = await _run_in_slot(request, ai_orchestrator.embed, **inputs)
+        if "error" in features or "cancelled" in features:
+            return {"error": features.get("error") or features["cancelled"]}
+        similar = {}
+        for space, key in SPACES.items():
+            section = features.get(key)
+            if section is None:
+                continue
+            if "error" in section:
+                similar[space] = {"error": section["error"]}
+                continue
+            similar[space] = await run_in_threadpool(
+                embedding_store.similar, space, section["features"], None, k, approximate
+            )
+        return similar
+    except ValueError as e:
+        return {"error": str(e)}
+    finally:
+        _cleanup(audio_path)
+
+
+@app.get("/similar/{case_id}")
+async def find_similar_to_case(case_id: str, space: str = "vision", k: int = 10,
+                               approximate: Optional[bool] = None):
+    """Prior cases most similar to a stored case (by the X-Case-Id of its analysis), best first."""
+    if space not in SPACES:
+        raise HTTPException(status_code=400, detail=f"space must be one of {', '.join(SPACES)}")
+    try:
+        return await run_in_threadpool(embedding_store.similar, space, None, case_id, k, approximate)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# --- Asynchronous jobs ---
+
+@app.on_event("startup")
+async def start_job_workers():
+    # Jobs take batch-priority scheduler slots, so they share the per-modality
+    # limits and the thread budget with requests instead of adding to them
+    loop = asyncio.get_running_loop()
+    job_manager.admit = lambda inputs, cancel: scheduler.hold(loop, queue_for(**inputs), "batch", cancel)
+    job_manager.start()
+
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_manager.stop()
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    text: Optional[str] = Form(None),
+    image: Optional[UploadFile] = File(None),
+    audio: Optional[UploadFile] = File(None),
+    video: Optional[UploadFile] = File(None),
+    include_embeddings: bool = Form(False),
+    embedding_dtype: str = Form("float16")
+):
+    """Queue a multimodal analysis and return its job id immediately."""
+    job_id = job_manager.new_job_id()
+    inputs = {
+        "text": text,
+        "include_embeddings": include_embeddings,
+        "embedding_dtype": embedding_dtype
+    }
+    for key, upload in (("image_path", image), ("audio_path", audio), ("video_path", video)):
+        if upload:
+            inputs[key] = _save_job_upload(job_id, upload, await upload.read())
+    job_manager.submit(job_id, inputs)
+    return {"id": job_id, "state": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job state, per-modality progress, partial results and the final result."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or ask a running one to stop."""
+    state = job_manager.cancel(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"id": job_id, "state": state}
+
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Queue depths, running counts and wait times per modality."""
+    return scheduler.stats()
+
+
+@app.get("/diagnostics/threads")
+async def get_thread_diagnostics():
+    """Planned and effective thread counts for torch, OpenCV, BLAS and onnxruntime."""
+    return thread_budget.report()
+
+
+@app.get("/models/residency")
+async def get_model_residency():
+    """Memory budget, loaded models with their footprints, and recent load/evict events."""
+    return ai_orchestrator.residency.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: stage and request latency histograms, frames, queue depth and memory."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """Stored profile of one request: top Python functions, torch operators per model, stage timings."""
+    if not authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or the profile token is invalid")
+    try:
+        profile = profile_store.get(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+@app.get("/profiles/{profile_id}/folded", response_class=PlainTextResponse)
+async def get_profile_stacks(profile_id: str, request: Request):
+    """Sampled stacks of one request in the folded format read by flamegraph.pl and speedscope."""
+    if not authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or the profile token is invalid")
+    try:
+        stacks = profile_store.folded(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stacks is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(stacks)
+
+
+@app.get("/stats/cascade")
+async def get_cascade_stats():
+    """Per-stage exit rates and latency of the vision triage cascades."""
+    return cascade_stats()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
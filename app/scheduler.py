@@ -0,0 +1,258 @@
+import asyncio
+import concurrent.futures
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+from .ai_models.cancellation import CancelToken, check
+
+# Request priorities, most urgent first
+PRIORITIES = ("urgent", "normal", "batch")
+
+# Default per-modality queue settings: share of the slots under contention
+# (weight), concurrency cap (limit), how many may wait (max_depth) and slots
+# kept free for the queue alone (reserved). Text, the cheapest and most
+# latency-sensitive queue, keeps one slot heavy media can never take.
+DEFAULT_QUEUES = {
+    "text": {"weight": 8.0, "limit": 4, "max_depth": 256, "reserved": 1},
+    "image": {"weight": 4.0, "limit": 2, "max_depth": 64, "reserved": 0},
+    "audio": {"weight": 2.0, "limit": 1, "max_depth": 32, "reserved": 0},
+    "video": {"weight": 1.0, "limit": 1, "max_depth": 16, "reserved": 0},
+}
+
+# Heaviest modality first: a request is queued by the most expensive input it carries
+QUEUE_ORDER = ("video", "audio", "image", "text")
+
+
+class QueueFull(Exception):
+    """The request's queue is at max_depth"""
+
+
+class QueueTimeout(Exception):
+    """The request's deadline passed while it was queued"""
+
+
+def queue_for(text=None, image=None, image_path=None, audio_path=None, video_path=None, **_) -> str:
+    """Queue name for a set of orchestrator inputs"""
+    present = {
+        "video": video_path,
+        "audio": audio_path,
+        "image": image is not None or image_path,
+        "text": text,
+    }
+    for name in QUEUE_ORDER:
+        if present[name]:
+            return name
+    return "text"
+
+
+class _Queue:
+    def __init__(self, name: str, weight: float, limit: int, max_depth: int, reserved: int = 0):
+        self.name = name
+        self.weight = weight
+        self.limit = limit
+        self.max_depth = max_depth
+        self.reserved = reserved
+        self.waiting: Dict[str, Deque[asyncio.Future]] = {p: deque() for p in PRIORITIES}
+        self.running = 0
+        self.finish_tag = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waits_ms: Deque[float] = deque(maxlen=1024)
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+    def head(self):
+        """(priority rank, future) of the next waiter, or None"""
+        for rank, priority in enumerate(PRIORITIES):
+            if self.waiting[priority]:
+                return rank, self.waiting[priority][0]
+        return None
+
+
+class FairScheduler:
+    """
+    Admission control and weighted fair dequeueing per modality.
+
+    Each modality has its own queue with a concurrency limit, so a burst of
+    videos can only hold the video slots. Across queues, at most
+    `total_slots` analyses run at once; when a slot frees, the queue to
+    serve is chosen by start-time fair queueing on per-queue virtual time,
+    so under contention each queue gets slots in proportion to its weight.
+    Urgent requests are served before normal ones, and normal ones before
+    batch. A queue's `reserved` slots are held back from the other queues
+    while it isn't using them, so a burst that fills every other queue's
+    limit still leaves room for it. Runs on the event loop; no locking is
+    needed.
+    """
+
+    def __init__(self, queues: Optional[Dict[str, Dict]] = None, total_slots: Optional[int] = None):
+        queues = queues or self._queues_from_env()
+        if total_slots is None:
+            total_slots = int(os.getenv("SCHEDULER_TOTAL_SLOTS", str(max(2, os.cpu_count() or 2))))
+        self.total_slots = total_slots
+        self.queues = {name: _Queue(name, **config) for name, config in queues.items()}
+        for queue in self.queues.values():
+            # At least one slot always stays available to the other queues
+            queue.reserved = max(0, min(queue.reserved, total_slots - 1))
+        self.running = 0
+        self.virtual_time = 0.0
+
+    @staticmethod
+    def _queues_from_env() -> Dict[str, Dict]:
+        """DEFAULT_QUEUES, overridable with SCHEDULER_<QUEUE>_WEIGHT / _LIMIT / _MAX_DEPTH / _RESERVED"""
+        queues = {}
+        for name, config in DEFAULT_QUEUES.items():
+            prefix = f"SCHEDULER_{name.upper()}_"
+            queues[name] = {
+                "weight": float(os.getenv(prefix + "WEIGHT", config["weight"])),
+                "limit": int(os.getenv(prefix + "LIMIT", config["limit"])),
+                "max_depth": int(os.getenv(prefix + "MAX_DEPTH", config["max_depth"])),
+                "reserved": int(os.getenv(prefix + "RESERVED", config["reserved"])),
+            }
+        return queues
+
+    def _held_back(self, queue: _Queue) -> int:
+        """Free slots reserved for queues other than `queue`"""
+        return sum(max(0, other.reserved - other.running) for other in self.queues.values() if other is not queue)
+
+    def _dispatch(self):
+        """Hand free slots to the fairest eligible waiters"""
+        while self.running < self.total_slots:
+            best = None
+            for queue in self.queues.values():
+                if queue.running >= queue.limit:
+                    continue
+                if self.running + self._held_back(queue) >= self.total_slots:
+                    continue
+                head = queue.head()
+                if head is None:
+                    continue
+                start = max(self.virtual_time, queue.finish_tag)
+                key = (head[0], start)
+                if best is None or key < best[0]:
+                    best = (key, queue, head[1])
+            if best is None:
+                return
+            (_, start), queue, future = best
+            for waiters in queue.waiting.values():
+                if waiters and waiters[0] is future:
+                    waiters.popleft()
+                    break
+            self.virtual_time = start
+            queue.finish_tag = start + 1.0 / queue.weight
+            queue.running += 1
+            self.running += 1
+            future.set_result(None)
+
+    def _release(self, queue: _Queue):
+        queue.running -= 1
+        self.running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, queue_name: str, priority: str = "normal", timeout: Optional[float] = None):
+        """
+        Wait for a slot in `queue_name` and hold it for the block.
+
+        Raises QueueFull when the queue is at max_depth and QueueTimeout when
+        `timeout` seconds pass before a slot frees.
+        """
+        queue = self.queues[queue_name]
+        if priority not in PRIORITIES:
+            priority = "normal"
+        if queue.depth >= queue.max_depth:
+            queue.rejected += 1
+            raise QueueFull(f"The {queue_name} queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.waiting[priority].append(future)
+        enqueued = time.perf_counter()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # Got the slot just as we gave up; hand it back
+                self._release(queue)
+            else:
+                queue.waiting[priority].remove(future)
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                queue.timed_out += 1
+                raise QueueTimeout(f"Deadline passed while waiting in the {queue_name} queue") from e
+            raise
+
+        queue.admitted += 1
+        queue.waits_ms.append((time.perf_counter() - enqueued) * 1000)
+        try:
+            yield
+        finally:
+            self._release(queue)
+
+    async def _occupy(self, queue_name: str, priority: str, granted: concurrent.futures.Future):
+        done = asyncio.Event()
+        async with self.slot(queue_name, priority):
+            granted.set_result(done)
+            await done.wait()
+
+    @contextmanager
+    def hold(self, loop: asyncio.AbstractEventLoop, queue_name: str, priority: str = "batch",
+             cancel: Optional[CancelToken] = None, poll_interval: float = 0.5):
+        """
+        slot() for a thread outside the event loop (job workers): block
+        until `loop` grants the slot and hold it for the block. A full queue
+        is retried rather than raised; cancelling `cancel` abandons the wait
+        with Cancelled.
+        """
+        while True:
+            granted = concurrent.futures.Future()
+            task = asyncio.run_coroutine_threadsafe(self._occupy(queue_name, priority, granted), loop)
+            while not concurrent.futures.wait([granted, task], poll_interval, concurrent.futures.FIRST_COMPLETED)[0]:
+                if cancel is not None and cancel.cancelled:
+                    # Also hands the slot back if it was granted meanwhile
+                    task.cancel()
+                    check(cancel)
+            if granted.done():
+                break
+            try:
+                task.result()
+            except QueueFull:
+                time.sleep(poll_interval)
+                check(cancel)
+        done = granted.result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(done.set)
+
+    def stats(self) -> Dict:
+        """Queue depths, running counts and recent wait-time percentiles"""
+        queues = {}
+        for name, queue in self.queues.items():
+            waits: List[float] = list(queue.waits_ms)
+            queues[name] = {
+                "weight": queue.weight,
+                "limit": queue.limit,
+                "max_depth": queue.max_depth,
+                "reserved": queue.reserved,
+                "running": queue.running,
+                "depth": queue.depth,
+                "depth_by_priority": {p: len(w) for p, w in queue.waiting.items()},
+                "admitted": queue.admitted,
+                "rejected": queue.rejected,
+                "timed_out": queue.timed_out,
+                "wait_ms": {
+                    "p50": float(np.percentile(waits, 50)) if waits else 0.0,
+                    "p95": float(np.percentile(waits, 95)) if waits else 0.0,
+                    "max": max(waits) if waits else 0.0
+                }
+            }
+        return {"total_slots": self.total_slots, "running": self.running, "queues": queues}
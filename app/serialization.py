@@ -0,0 +1,156 @@
+import base64
+import io
+import json
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from fastapi.responses import Response
+
+from .ai_models.telemetry import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional format
+    msgpack = None
+
+# Result keys holding model embeddings; omitted from responses unless requested
+EMBEDDING_KEYS = {"features", "embeddings", "image_embeds", "last_hidden_state"}
+
+EMBEDDING_DTYPES = ("float16", "float32")
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+NPZ_MEDIA_TYPE = "application/x-npz"
+
+
+def _as_array(value) -> Optional[np.ndarray]:
+    """Return value as a numpy array if it is an array or tensor, else None"""
+    if isinstance(value, np.ndarray):
+        return value
+    if hasattr(value, "detach") and hasattr(value, "numpy"):
+        return value.detach().cpu().numpy()
+    return None
+
+
+def _walk(value, path: str, pack_array, include_embeddings: bool, embedding_dtype: str, is_embedding: bool = False):
+    """Rebuild a result tree, handing every array to `pack_array`"""
+    array = _as_array(value)
+    if array is not None:
+        if is_embedding:
+            if not include_embeddings:
+                return {"omitted": True, "shape": list(array.shape)}
+            array = array.astype(embedding_dtype, copy=False)
+        return pack_array(path, array)
+    if isinstance(value, dict):
+        return {
+            str(k): _walk(v, f"{path}/{k}", pack_array, include_embeddings, embedding_dtype,
+                          is_embedding or k in EMBEDDING_KEYS)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [
+            _walk(v, f"{path}/{i}", pack_array, include_embeddings, embedding_dtype, is_embedding)
+            for i, v in enumerate(value)
+        ]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def prepare(results: Dict,
+            include_embeddings: bool = False,
+            embedding_dtype: str = "float16",
+            encoding: str = "base64") -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """
+    Prepare analysis results for the wire.
+
+    Embeddings (keys in EMBEDDING_KEYS) are dropped unless requested, and
+    cast to `embedding_dtype` when kept. Every array becomes a small
+    descriptor: with `encoding="base64"` the data is inlined as base64, with
+    "bytes" it is inlined raw (for msgpack), and with "ref" it is left out
+    and returned separately keyed by path (for npz). Returns the tree and
+    the referenced arrays.
+    """
+    if embedding_dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown embedding dtype '{embedding_dtype}', expected one of {EMBEDDING_DTYPES}")
+    arrays: Dict[str, np.ndarray] = {}
+
+    def pack_array(path, array):
+        array = np.ascontiguousarray(array)
+        descriptor = {"dtype": array.dtype.str, "shape": list(array.shape)}
+        if encoding == "base64":
+            descriptor["encoding"] = "base64"
+            descriptor["data"] = base64.b64encode(array.tobytes()).decode("ascii")
+        elif encoding == "bytes":
+            descriptor["encoding"] = "bytes"
+            descriptor["data"] = array.tobytes()
+        else:
+            descriptor["encoding"] = "npz"
+            descriptor["ref"] = path
+            arrays[path] = array
+        return descriptor
+
+    tree = _walk(results, "", pack_array, include_embeddings, embedding_dtype)
+    return tree, arrays
+
+
+def decode_array(descriptor: Dict) -> np.ndarray:
+    """Client-side helper: rebuild an array from a base64 or bytes descriptor"""
+    data = descriptor["data"]
+    if descriptor["encoding"] == "base64":
+        data = base64.b64decode(data)
+    return np.frombuffer(data, dtype=np.dtype(descriptor["dtype"])).reshape(descriptor["shape"])
+
+
+def dumps_json(value: Any) -> bytes:
+    """Fast JSON encoding (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=str).encode()
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Pick the response media type from an Accept header"""
+    accept = (accept or "").lower()
+    if msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return MSGPACK_MEDIA_TYPES[0]
+    if NPZ_MEDIA_TYPE in accept:
+        return NPZ_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def render(results: Dict,
+           accept: Optional[str] = None,
+           include_embeddings: bool = False,
+           embedding_dtype: str = "float16",
+           status_code: int = 200) -> Response:
+    """
+    Serialize analysis results in the format the client asked for.
+
+    - application/json (default): arrays as base64 descriptors
+    - application/msgpack: arrays as raw bytes descriptors
+    - application/x-npz: arrays as npz members, the rest as `__json__`
+    """
+    with span("response.build"):
+        media_type = negotiate(accept)
+        if media_type == JSON_MEDIA_TYPE:
+            tree, _ = prepare(results, include_embeddings, embedding_dtype, encoding="base64")
+            body = dumps_json(tree)
+        elif media_type in MSGPACK_MEDIA_TYPES:
+            tree, _ = prepare(results, include_embeddings, embedding_dtype, encoding="bytes")
+            body = msgpack.packb(tree, use_bin_type=True)
+        else:
+            tree, arrays = prepare(results, include_embeddings, embedding_dtype, encoding="ref")
+            buffer = io.BytesIO()
+            members = {f"array_{i}": array for i, array in enumerate(arrays.values())}
+            # Map each descriptor ref to its npz member name
+            refs = dict(zip(arrays.keys(), members.keys()))
+            members["__json__"] = np.frombuffer(dumps_json({"results": tree, "members": refs}), dtype=np.uint8)
+            np.savez(buffer, **members)
+            body = buffer.getvalue()
+    return Response(content=body, media_type=media_type, status_code=status_code)
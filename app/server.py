@@ -0,0 +1,330 @@
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+from .ai_models.residency import torch_modules
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def share_model_weights(orchestrator) -> int:
+    """
+    Move the parameters and buffers of every loaded torch module into
+    shared memory. Returns the number of bytes shared.
+
+    Forked workers already share the weights through copy-on-write, and
+    this copies every non-mmapped tensor into /dev/shm, so peak RSS doubles
+    while it runs, and small /dev/shm mounts (64 MB in Docker by default)
+    fail. Only worth it when something writes to the weights after the fork.
+    """
+    import torch
+
+    seen = set()
+    shared = 0
+    for analyzer in orchestrator.loaded().values():
+        for module in torch_modules(analyzer):
+            if id(module) in seen:
+                continue
+            seen.add(id(module))
+            if getattr(module, "_mmap_weights", False):
+                # Bundle weights are file mappings, already shared through the page cache
+                continue
+            try:
+                module.share_memory()
+            except (RuntimeError, NotImplementedError) as e:
+                # e.g. packed int8 weights; these stay copy-on-write
+                logger.info(f"Could not share {type(module).__name__} weights: {str(e)}")
+                continue
+            shared += sum(t.numel() * t.element_size() for t in module.state_dict().values()
+                          if isinstance(t, torch.Tensor))
+    return shared
+
+
+class Supervisor:
+    """
+    Preload-then-fork API server.
+
+    The parent imports the app once, which loads every model, and freezes
+    the garbage collector so the preloaded objects are never written
+    again. It then forks `workers` uvicorn workers that serve a listening
+    socket bound by the parent and share the model pages copy-on-write
+    (`share_memory` additionally moves them to /dev/shm; see
+    share_model_weights).
+
+    OpenMP and MKL thread pools do not survive fork(), so the parent runs
+    no torch forward pass and keeps torch on one thread: it loads (and
+    quantizes) weights only, and label banks missing from the cache are
+    encoded in each worker. Anything added to preloading must keep to this.
+
+    Workers report a heartbeat from their event loop into a shared array;
+    a worker that dies or stops beating for `heartbeat_timeout` seconds is
+    replaced (and the background jobs it was running are requeued). SIGHUP
+    replaces the workers one at a time, waiting for each replacement to be
+    ready before stopping the old one; SIGTERM/SIGINT stop them gracefully.
+    """
+
+    def __init__(self,
+                 host: str = "0.0.0.0",
+                 port: int = 8000,
+                 workers: int = 2,
+                 heartbeat_timeout: float = 30.0,
+                 startup_timeout: float = 120.0,
+                 graceful_timeout: float = 30.0,
+                 share_memory: bool = False,
+                 log_level: str = "info"):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.graceful_timeout = graceful_timeout
+        self.share_memory = share_memory
+        self.log_level = log_level
+
+        self.main = None
+        self.sock: Optional[socket.socket] = None
+        # Two heartbeat slots per worker so replacements can start before the old one stops
+        self.heartbeats = multiprocessing.RawArray("d", workers * 2)
+        self.children: Dict[int, Dict] = {}
+        self.restarts = 0
+        self._stopping = False
+        self._reload_requested = False
+
+    def preload(self):
+        """Load the app and its models once, in the parent"""
+        # The thread budget reads API_WORKERS when app.threads is imported
+        os.environ["API_WORKERS"] = str(self.workers)
+        # Label prompts missing from the cache are encoded in the workers (_run_worker)
+        os.environ["LABEL_BANK_DEFER_ENCODING"] = "true"
+        started = time.perf_counter()
+        from . import main
+        self.main = main
+        # libgomp/MKL pools started here would be inherited broken by the
+        # workers, so the parent only loads weights, on a single thread
+        main.thread_budget.single_threaded = True
+        main.thread_budget.apply()
+        # Load every analyzer here, not lazily in each worker, so they share the pages
+        main.ai_orchestrator.preload()
+        if main.ai_orchestrator.residency.budget_bytes:
+            logger.warning("MODEL_MEMORY_BUDGET_MB is set, but workers never evict the preloaded models they "
+                           "share with this process; the budget only applies to models loaded after the fork")
+        # Workers must not requeue each other's running jobs on startup
+        main.job_manager.recover_on_start = False
+        store = main.job_manager.open_store()
+        main.job_manager.recover(store)
+        store.close()
+
+        if self.share_memory:
+            shared = share_model_weights(main.ai_orchestrator)
+            logger.info(f"Moved {shared / 2**20:.0f} MiB of model weights to shared memory")
+        gc.collect()
+        gc.freeze()
+        logger.info(f"Preloaded app in {time.perf_counter() - started:.1f}s")
+
+    def bind(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+    def _free_slot(self) -> int:
+        used = {child["slot"] for child in self.children.values()}
+        return next(i for i in range(len(self.heartbeats)) if i not in used)
+
+    def spawn(self, index: int) -> int:
+        """Fork a worker; `index` selects its core set when pinning is on"""
+        slot = self._free_slot()
+        self.heartbeats[slot] = 0.0
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker(index, slot)
+                code = 0
+            except Exception:
+                logger.exception("Worker crashed")
+            finally:
+                os._exit(code)
+        self.children[pid] = {"index": index, "slot": slot, "started": time.time()}
+        logger.info(f"Started worker {index} (pid {pid})")
+        return pid
+
+    def _run_worker(self, index: int, slot: int):
+        import asyncio
+        import uvicorn
+
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        self.main.thread_budget.single_threaded = False
+        self.main.thread_budget.apply(worker_index=index)
+        # The forward passes the parent deferred, now on this worker's own pools
+        from .ai_models.label_bank import encode_pending
+        encode_pending()
+        heartbeats = self.heartbeats
+
+        async def beat():
+            while True:
+                heartbeats[slot] = time.time()
+                await asyncio.sleep(1.0)
+
+        @self.main.app.on_event("startup")
+        async def start_heartbeat():
+            asyncio.get_running_loop().create_task(beat())
+
+        config = uvicorn.Config(self.main.app, log_level=self.log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def _reap(self):
+        """Collect exited workers; replace them unless shutting down"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            child = self.children.pop(pid, None)
+            if child is None:
+                continue
+            logger.info(f"Worker {child['index']} (pid {pid}) exited with status {status}")
+            self._requeue_jobs(pid)
+            if not self._stopping and not child.get("retiring"):
+                # Back off when workers die right after starting
+                if time.time() - child["started"] < 5:
+                    time.sleep(1.0)
+                self.restarts += 1
+                self.spawn(child["index"])
+
+    def _requeue_jobs(self, pid: int):
+        try:
+            store = self.main.job_manager.open_store()
+            try:
+                self.main.job_manager.recover(store, worker_pid=pid)
+            finally:
+                store.close()
+        except Exception as e:
+            logger.error(f"Error requeueing jobs of worker {pid}: {str(e)}")
+
+    def _check_heartbeats(self):
+        now = time.time()
+        for pid, child in list(self.children.items()):
+            if child.get("retiring"):
+                continue
+            beat = self.heartbeats[child["slot"]]
+            if beat == 0.0:
+                stale = now - child["started"] > self.startup_timeout
+            else:
+                stale = now - beat > self.heartbeat_timeout
+            if stale:
+                logger.error(f"Worker {child['index']} (pid {pid}) is unresponsive; killing it")
+                self._signal(pid, signal.SIGKILL)
+
+    def _signal(self, pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _wait_ready(self, pid: int) -> bool:
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            child = self.children.get(pid)
+            if child is None:
+                return False
+            if self.heartbeats[child["slot"]] > 0.0:
+                return True
+            time.sleep(0.2)
+        return False
+
+    def _wait_exit(self, pids, timeout: float):
+        deadline = time.time() + timeout
+        while time.time() < deadline and any(pid in self.children for pid in pids):
+            self._reap()
+            time.sleep(0.2)
+        for pid in pids:
+            if pid in self.children:
+                self._signal(pid, signal.SIGKILL)
+        self._reap()
+
+    def rolling_restart(self):
+        """Replace workers one at a time without dropping the listening socket"""
+        logger.info("Rolling restart")
+        for pid, child in list(self.children.items()):
+            if child.get("retiring"):
+                continue
+            replacement = self.spawn(child["index"])
+            if not self._wait_ready(replacement):
+                logger.error(f"Replacement for worker {child['index']} did not start; keeping the old one")
+                continue
+            child["retiring"] = True
+            self._signal(pid, signal.SIGTERM)
+            self._wait_exit([pid], self.graceful_timeout)
+
+    def stop(self):
+        self._stopping = True
+        logger.info("Stopping workers")
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+        self._wait_exit(list(self.children), self.graceful_timeout)
+
+    def run(self):
+        self.preload()
+        self.bind()
+        for index in range(self.workers):
+            self.spawn(index)
+
+        def request_stop(signum, frame):
+            self._stopping = True
+
+        def request_reload(signum, frame):
+            self._reload_requested = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} workers")
+        while not self._stopping:
+            self._reap()
+            self._check_heartbeats()
+            if self._reload_requested:
+                self._reload_requested = False
+                self.rolling_restart()
+            time.sleep(0.5)
+        self.stop()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preload models once and fork API workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "2")))
+    parser.add_argument("--heartbeat-timeout", type=float, default=30.0)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--share-memory", action="store_true",
+                        help="Also move weights to /dev/shm (copy-on-write already shares them; needs a large /dev/shm)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    Supervisor(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        heartbeat_timeout=args.heartbeat_timeout,
+        graceful_timeout=args.graceful_timeout,
+        share_memory=args.share_memory,
+        log_level=args.log_level
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
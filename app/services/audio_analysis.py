@@ -4,22 +4,37 @@ import torch
 from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC
 from typing import Dict, List, Optional
 import logging
+from ..ai_models.backends import InferenceRunner, backend_for
+from ..ai_models.bundle import get_bundle
+from ..ai_models.cancellation import Cancelled, check
+from ..ai_models.telemetry import span
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class AudioAnalysisService:
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None, window_seconds: float = 30.0):
         self.models = {}
         self.processors = {}
+        self.runners = {}
+        self.backend = backend
+        # Speech is transcribed in windows of this length
+        self.window_seconds = window_seconds
         self.initialize_models()
         
     def initialize_models(self):
         """Initialize audio analysis models"""
         try:
             # Initialize speech recognition model
-            self.models['speech'] = Wav2Vec2ForCTC.from_pretrained("facebook/wav2vec2-base-960h")
-            self.processors['speech'] = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h")
+            bundle = get_bundle()
+            self.models['speech'] = bundle.load_model("wav2vec2", Wav2Vec2ForCTC)
+            self.processors['speech'] = bundle.load_processor("wav2vec2", Wav2Vec2Processor)
+            self.runners['speech'] = InferenceRunner(
+                self.models['speech'],
+                backend=self.backend or backend_for("wav2vec2"),
+                output_names=("logits",),
+                name="wav2vec2_ctc"
+            )
             
             # TODO: Load specialized models for:
             # - Cough analysis
@@ -36,13 +51,15 @@ class AudioAnalysisService:
         """Preprocess audio file for analysis"""
         try:
             # Load audio file
-            audio, sr = librosa.load(audio_path, sr=16000)
+            with span("audio.decode"):
+                audio, sr = librosa.load(audio_path, sr=16000)
             
             # Extract features
-            mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=13)
-            spectral_centroid = librosa.feature.spectral_centroid(y=audio, sr=sr)
-            spectral_bandwidth = librosa.feature.spectral_bandwidth(y=audio, sr=sr)
-            zero_crossing_rate = librosa.feature.zero_crossing_rate(y=audio)
+            with span("audio.features"):
+                mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=13)
+                spectral_centroid = librosa.feature.spectral_centroid(y=audio, sr=sr)
+                spectral_bandwidth = librosa.feature.spectral_bandwidth(y=audio, sr=sr)
+                zero_crossing_rate = librosa.feature.zero_crossing_rate(y=audio)
             
             return {
                 "audio": audio,
@@ -56,22 +73,26 @@ class AudioAnalysisService:
             logger.error(f"Error preprocessing audio: {str(e)}")
             raise
 
-    def analyze_speech(self, audio: np.ndarray) -> Dict:
+    def analyze_speech(self, audio: np.ndarray, cancel=None) -> Dict:
         """Analyze speech patterns for neurological conditions"""
         try:
-            # Process audio for speech recognition
-            inputs = self.processors['speech'](
-                audio,
-                sampling_rate=16000,
-                return_tensors="pt",
-                padding=True
-            )
+            # Transcribe one window at a time so a cancel token is honoured between windows
+            window = max(1, int(self.window_seconds * 16000))
+            transcription = []
+            for start in range(0, max(len(audio), 1), window):
+                check(cancel)
+                with span("preprocess", model="wav2vec2"):
+                    inputs = self.processors['speech'](
+                        audio[start:start + window],
+                        sampling_rate=16000,
+                        return_tensors="pt",
+                        padding=True
+                    )
             
-            # Get speech recognition results
-            with torch.no_grad():
-                logits = self.models['speech'](inputs.input_values).logits
+                # Get speech recognition results
+                logits = self.runners['speech'](input_values=inputs.input_values)["logits"]
                 predicted_ids = torch.argmax(logits, dim=-1)
-                transcription = self.processors['speech'].batch_decode(predicted_ids)
+                transcription.append(self.processors['speech'].batch_decode(predicted_ids)[0])
             
             # TODO: Implement speech pattern analysis for:
             # - Slurred speech (stroke)
@@ -79,13 +100,15 @@ class AudioAnalysisService:
             # - Speech rate changes (ALS)
             
             return {
-                "transcription": transcription[0],
+                "transcription": " ".join(t for t in transcription if t),
                 "speech_patterns": {
                     "tremor_detected": False,
                     "slurred_speech": False,
                     "speech_rate": "normal"
                 }
             }
+        except Cancelled:
+            raise
         except Exception as e:
             logger.error(f"Error analyzing speech: {str(e)}")
             raise
@@ -130,7 +153,7 @@ class AudioAnalysisService:
             logger.error(f"Error analyzing breathing: {str(e)}")
             raise
 
-    def analyze_audio(self, audio_path: str) -> Dict:
+    def analyze_audio(self, audio_path: str, cancel=None) -> Dict:
         """
         Main method to analyze audio for health-related patterns
         """
@@ -139,7 +162,8 @@ class AudioAnalysisService:
             processed_audio = self.preprocess_audio(audio_path)
             
             # Perform various analyses
-            speech_analysis = self.analyze_speech(processed_audio["audio"])
+            speech_analysis = self.analyze_speech(processed_audio["audio"], cancel)
+            check(cancel)
             cough_analysis = self.analyze_cough(processed_audio["audio"], processed_audio["sample_rate"])
             breathing_analysis = self.analyze_breathing(processed_audio["audio"], processed_audio["sample_rate"])
             
@@ -157,6 +181,8 @@ class AudioAnalysisService:
             
             return results
             
+        except Cancelled:
+            raise
         except Exception as e:
             logger.error(f"Error in audio analysis: {str(e)}")
             raise
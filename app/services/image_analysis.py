@@ -1,28 +1,71 @@
-import tensorflow as tf
 import numpy as np
-from PIL import Image
-import cv2
 import os
 from transformers import CLIPProcessor, CLIPModel
-import torch
 from typing import Dict, List, Tuple, Optional
 import logging
+from ..ai_models.backends import CLIP_IMAGE_MODULES, InferenceRunner, backend_for
+from ..ai_models.bundle import get_bundle
+from ..ai_models.cancellation import Cancelled, check
+from ..ai_models.cascade import Cascade
+from ..ai_models.label_bank import LabelBank
+from ..ai_models.image_input import ImageInput
+from ..ai_models.tiling import RegionReader, TiledAnalyzer, clip_tile_scorer, is_large_image, open_large_image
+from .image_router import ImageTypeRouter
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class MedicalImageAnalysis:
-    def __init__(self):
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        label_bank_path: Optional[str] = None,
+        normal_threshold: Optional[float] = None
+    ):
         self.models = {}
         self.processors = {}
+        self.runners = {}
+        self.backend = backend
+        self.label_bank_path = label_bank_path
+        if normal_threshold is None:
+            normal_threshold = float(os.getenv("VISION_CASCADE_NORMAL_THRESHOLD", "0.9"))
+        self.normal_threshold = normal_threshold
         self.initialize_models()
         
+        # Clearly normal images stop after CLIP; the rest are routed to specialists
+        self.cascade = Cascade("medical_image", [
+            ("clip_general", self._general_stage),
+            ("specialists", self._specialist_stage)
+        ])
+        
     def initialize_models(self):
         """Initialize all required AI models"""
         try:
             # Initialize CLIP for general image understanding
-            self.models['clip'] = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-            self.processors['clip'] = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+            bundle = get_bundle()
+            self.models['clip'] = bundle.load_model("clip", CLIPModel)
+            self.processors['clip'] = bundle.load_processor("clip", CLIPProcessor)
+            self.runners['clip'] = InferenceRunner(
+                self.models['clip'],
+                backend=self.backend or backend_for("clip"),
+                method="get_image_features",
+                output_names=("image_embeds",),
+                name="clip",
+                quantize=CLIP_IMAGE_MODULES
+            )
+            
+            # Zero-shot labels are encoded once here, never per request
+            self.label_bank = LabelBank.from_file(self.label_bank_path).build(
+                self.models['clip'], self.processors['clip']
+            )
+            self.router = ImageTypeRouter.from_file().build(self.models['clip'], self.processors['clip'])
+            
+            # Specialists by routed modality: (result key, analysis method)
+            self.specialists = {
+                "dermatology": ("skin", self.analyze_skin_condition),
+                "fundus": ("retinal", self.analyze_retinal_image),
+                "chest_xray": ("chest_xray", self.analyze_chest_xray)
+            }
             
             # TODO: Load specialized medical models
             # self.models['skin_cancer'] = tf.keras.models.load_model('models/skin_cancer_detection.h5')
@@ -34,29 +77,16 @@ class MedicalImageAnalysis:
             logger.error(f"Error initializing models: {str(e)}")
             raise
 
-    def preprocess_image(self, image_path: str, target_size: Tuple[int, int] = (224, 224)) -> np.ndarray:
-        """Preprocess image for model input"""
+    def preprocess_image(self, image, target_size: Tuple[int, int] = (224, 224)) -> np.ndarray:
+        """Preprocess image for model input (RGB uint8, resized)"""
         try:
-            # Read image
-            img = cv2.imread(image_path)
-            if img is None:
-                raise ValueError("Could not read image")
-            
-            # Convert to RGB
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Resize
-            img = cv2.resize(img, target_size)
-            
-            # Normalize
-            img = img / 255.0
-            
-            return img
+            # Decode once (no-op for an ImageInput) and reuse the cached resize
+            return ImageInput.coerce(image).resized(target_size)
         except Exception as e:
             logger.error(f"Error preprocessing image: {str(e)}")
             raise
 
-    def analyze_skin_condition(self, image: np.ndarray) -> Dict:
+    def analyze_skin_condition(self, image: ImageInput) -> Dict:
         """Analyze skin conditions including cancer detection"""
         try:
             # TODO: Implement actual skin condition analysis
@@ -70,7 +100,7 @@ class MedicalImageAnalysis:
             logger.error(f"Error analyzing skin condition: {str(e)}")
             raise
 
-    def analyze_retinal_image(self, image: np.ndarray) -> Dict:
+    def analyze_retinal_image(self, image: ImageInput) -> Dict:
         """Analyze retinal images for diabetic retinopathy and other conditions"""
         try:
             # TODO: Implement retinal image analysis
@@ -83,7 +113,7 @@ class MedicalImageAnalysis:
             logger.error(f"Error analyzing retinal image: {str(e)}")
             raise
 
-    def analyze_chest_xray(self, image: np.ndarray) -> Dict:
+    def analyze_chest_xray(self, image: ImageInput) -> Dict:
         """Analyze chest X-rays for various conditions"""
         try:
             # TODO: Implement chest X-ray analysis
@@ -96,46 +126,31 @@ class MedicalImageAnalysis:
             logger.error(f"Error analyzing chest X-ray: {str(e)}")
             raise
 
-    def get_general_image_understanding(self, image: np.ndarray) -> Dict:
+    def register_specialist(self, modality: str, name: str, analyze) -> None:
+        """Register (or replace) the specialist run for a routed modality"""
+        self.specialists[modality] = (name, analyze)
+        
+    def encode_image(self, image: ImageInput):
+        """CLIP image embedding, computed once per image and shared by every stage"""
+        image = ImageInput.coerce(image)
+        runner = self.runners['clip']
+        return image.view(
+            ("clip_image_embeds", id(runner)),
+            lambda: runner(pixel_values=image.clip_pixel_values(self.processors['clip']))["image_embeds"][0]
+        )
+        
+    def get_general_image_understanding(self, image: ImageInput) -> Dict:
         """Get general understanding of the image using CLIP"""
         try:
-            # Convert numpy array to PIL Image
-            pil_image = Image.fromarray((image * 255).astype(np.uint8))
-            
-            # Prepare text prompts for medical conditions
-            medical_conditions = [
-                "normal healthy skin",
-                "skin rash or irritation",
-                "mole or skin lesion",
-                "wound or injury",
-                "swelling or inflammation",
-                "discoloration or bruising"
-            ]
-            
-            # Process image and text
-            inputs = self.processors['clip'](
-                images=pil_image,
-                text=medical_conditions,
-                return_tensors="pt",
-                padding=True
-            )
+            # Only the image is encoded; label embeddings are precomputed
+            image_embeds = self.encode_image(image)
             
-            # Get image-text similarity scores
-            outputs = self.models['clip'](**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)
-            
-            # Get top matches
-            top_probs, top_indices = torch.topk(probs[0], k=3)
+            # Score against the label bank and keep the top matches
+            scores = self.label_bank.score(image_embeds, top_k=3)
             
             results = {
-                "detected_conditions": [
-                    {
-                        "condition": medical_conditions[idx],
-                        "confidence": float(prob)
-                    }
-                    for prob, idx in zip(top_probs, top_indices)
-                ]
+                "detected_conditions": scores["labels"],
+                "group_scores": scores["groups"]
             }
             
             return results
@@ -143,51 +158,128 @@ class MedicalImageAnalysis:
             logger.error(f"Error in general image understanding: {str(e)}")
             raise
 
-    def analyze_image(self, image_path: str) -> Dict:
+    def analyze_image(self, image, cancel=None) -> Dict:
         """
         Main method to analyze medical images
         """
         try:
-            # Preprocess image
-            processed_image = self.preprocess_image(image_path)
-            
-            # Get general understanding
-            general_analysis = self.get_general_image_understanding(processed_image)
-            
-            # Perform specialized analyses based on image type
-            # TODO: Implement image type detection
-            skin_analysis = self.analyze_skin_condition(processed_image)
-            retinal_analysis = self.analyze_retinal_image(processed_image)
-            chest_analysis = self.analyze_chest_xray(processed_image)
+            # High-resolution radiographs and DICOM are analyzed in tiles, not downscaled
+            if isinstance(image, RegionReader) or (isinstance(image, str) and is_large_image(image)):
+                return self.analyze_large_image(image, cancel=cancel)
+                
+            # Decode once; every analysis below shares this image and its cached views
+            state = {"image": ImageInput.coerce(image), "cancel": cancel}
+            stage = self.cascade.run(state)
             
             # Combine results
+            general_analysis = state["general_analysis"]
+            specialized_analyses = state.get("specialized_analyses", {})
             results = {
                 "general_analysis": general_analysis,
-                "specialized_analyses": {
-                    "skin": skin_analysis,
-                    "retinal": retinal_analysis,
-                    "chest_xray": chest_analysis
-                },
+                "routing": state.get("routing"),
+                "specialized_analyses": specialized_analyses,
+                "cascade_stage": stage,
                 "recommendations": self.generate_recommendations(
                     general_analysis,
-                    skin_analysis,
-                    retinal_analysis,
-                    chest_analysis
+                    specialized_analyses
                 )
             }
             
             return results
             
+        except Cancelled:
+            raise
         except Exception as e:
             logger.error(f"Error in image analysis: {str(e)}")
             raise
+            
+    def _general_stage(self, state: Dict) -> bool:
+        """Cascade stage 1: CLIP zero-shot; exits when the image is clearly normal"""
+        general_analysis = self.get_general_image_understanding(state["image"])
+        normal = sum(
+            general_analysis["group_scores"].get(group, 0.0)
+            for group in self.label_bank.subgroups("normal")
+        )
+        general_analysis["normal_probability"] = normal
+        state["general_analysis"] = general_analysis
+        return normal >= self.normal_threshold
+        
+    def _specialist_stage(self, state: Dict) -> bool:
+        """Cascade stage 2: route on the same CLIP embedding and run only the matching specialists"""
+        image = state["image"]
+        routing = self.router.route(self.encode_image(image))
+        targets = routing["targets"] if routing["targets"] is not None else list(self.specialists)
+        specialized_analyses = {}
+        for modality in targets:
+            if modality not in self.specialists:
+                continue
+            check(state.get("cancel"))
+            name, analyze = self.specialists[modality]
+            specialized_analyses[name] = analyze(image)
+        state["routing"] = routing
+        state["specialized_analyses"] = specialized_analyses
+        return True
 
+    def analyze_large_image(
+        self,
+        image,
+        modality: str = "chest_xray",
+        tile_size: int = 512,
+        overlap: int = 64,
+        batch_size: int = 8,
+        cancel=None
+    ) -> Dict:
+        """
+        Tiled analysis of a high-resolution or DICOM image, given as a path
+        or an open RegionReader (see tiling.load_image for uploads).
+        
+        Tiles are read lazily (memory mapped where the format allows) and
+        scored in batches, so peak memory does not depend on image size.
+        """
+        try:
+            reader = image if isinstance(image, RegionReader) else open_large_image(image)
+            try:
+                scorer = clip_tile_scorer(
+                    self.runners['clip'],
+                    self.processors['clip'],
+                    self.label_bank,
+                    modality if modality in self.label_bank.group_names else None
+                )
+                tiled = TiledAnalyzer(
+                    scorer, tile_size=tile_size, overlap=overlap, batch_size=batch_size
+                ).analyze(reader, cancel=cancel)
+            finally:
+                reader.close()
+                
+            name = self.specialists[modality][0] if modality in self.specialists else modality
+            conditions = [
+                {"condition": f"{modality} abnormality", "confidence": tile["score"], "box": tile["box"]}
+                for tile in tiled["top_tiles"]
+                if tile["score"] >= 0.5
+            ]
+            return {
+                "general_analysis": {"detected_conditions": []},
+                "routing": {"modality": modality, "targets": [modality], "fallback": False, "tiled": True},
+                "specialized_analyses": {
+                    name: {
+                        "conditions": conditions,
+                        "confidence_scores": {"image_score": tiled["image_score"]},
+                        "recommendations": [],
+                        "tiled_analysis": tiled
+                    }
+                },
+                "recommendations": []
+            }
+        except Cancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error in tiled image analysis: {str(e)}")
+            raise
+            
     def generate_recommendations(
         self,
         general_analysis: Dict,
-        skin_analysis: Dict,
-        retinal_analysis: Dict,
-        chest_analysis: Dict
+        specialized_analyses: Dict[str, Dict]
     ) -> List[str]:
         """Generate recommendations based on analysis results"""
         recommendations = []
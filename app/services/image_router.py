@@ -0,0 +1,63 @@
+import os
+from typing import Dict, Optional
+
+from ..ai_models.label_bank import LabelBank
+
+DEFAULT_MODALITIES_PATH = os.path.join(os.path.dirname(__file__), "..", "ai_models", "data", "image_modalities.json")
+
+# Modality meaning "no specialist applies"
+OTHER = "other"
+
+
+class ImageTypeRouter:
+    """
+    Decide which specialist models an image should go to.
+
+    The image embedding CLIP already computed for the general analysis is
+    scored against a small modality label bank (dermatology photo, fundus,
+    chest X-ray, other), so routing costs one matrix multiply. Modalities
+    scoring at least `threshold` are dispatched; if none does, the router
+    falls back to running every specialist.
+    """
+
+    def __init__(self, label_bank: LabelBank, threshold: float = 0.6):
+        self.label_bank = label_bank
+        self.threshold = threshold
+        self.modalities = [group for group in label_bank.group_names if "/" not in group]
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None, threshold: Optional[float] = None) -> "ImageTypeRouter":
+        """Load the modality labels (text embeddings are computed by build())"""
+        path = path or os.getenv("IMAGE_MODALITIES_PATH", DEFAULT_MODALITIES_PATH)
+        if threshold is None:
+            threshold = float(os.getenv("IMAGE_ROUTER_THRESHOLD", "0.6"))
+        return cls(LabelBank.from_file(path), threshold=threshold)
+
+    def build(self, model, processor) -> "ImageTypeRouter":
+        self.label_bank.build(model, processor)
+        return self
+
+    def route(self, image_embeds) -> Dict:
+        """
+        Classify the image modality and list the specialists to run.
+
+        `targets` is None when routing was not confident enough, meaning the
+        caller should run every registered specialist.
+        """
+        scores = self.label_bank.score(image_embeds, top_k=1)["groups"]
+        modality_scores = {m: scores.get(m, 0.0) for m in self.modalities}
+        best = max(modality_scores, key=modality_scores.get)
+
+        confident = [m for m, p in modality_scores.items() if p >= self.threshold]
+        if not confident:
+            targets = None
+        else:
+            targets = [m for m in confident if m != OTHER]
+
+        return {
+            "modality": best,
+            "confidence": modality_scores[best],
+            "scores": modality_scores,
+            "targets": targets,
+            "fallback": targets is None
+        }
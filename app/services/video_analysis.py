@@ -7,6 +7,9 @@ from typing import Dict, List, Optional, Tuple
 import logging
 from pathlib import Path
 import tempfile
+from ..ai_models.bundle import get_bundle
+from ..ai_models.cancellation import Cancelled, check
+from ..ai_models.telemetry import count_frames, span
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,7 +23,7 @@ class VideoAnalysisService:
         """Initialize video analysis models"""
         try:
             # Initialize YOLOv8 for general object detection
-            self.models['yolo'] = YOLO('yolov8n.pt')
+            self.models['yolo'] = YOLO(get_bundle().weights_path("yolov8n"))
             
             # Initialize MediaPipe for pose and face detection
             self.mp_pose = mp.solutions.pose
@@ -49,7 +52,8 @@ class VideoAnalysisService:
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             
             # Get pose landmarks
-            results = self.pose.process(frame_rgb)
+            with span("model.forward", model="mediapipe_pose"):
+                results = self.pose.process(frame_rgb)
             
             if not results.pose_landmarks:
                 return {
@@ -109,7 +113,8 @@ class VideoAnalysisService:
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             
             # Get face landmarks
-            results = self.face.process(frame_rgb)
+            with span("model.forward", model="mediapipe_face_mesh"):
+                results = self.face.process(frame_rgb)
             
             if not results.multi_face_landmarks:
                 return {
@@ -151,9 +156,11 @@ class VideoAnalysisService:
             logger.error(f"Error analyzing facial movements: {str(e)}")
             raise
 
-    def analyze_video(self, video_path: str) -> Dict:
+    def analyze_video(self, video_path: str, cancel=None) -> Dict:
         """
         Main method to analyze video for health-related patterns
+        
+        A `cancel` token is checked before every frame.
         """
         try:
             # Open video file
@@ -167,23 +174,28 @@ class VideoAnalysisService:
             frame_count = 0
             
             while cap.isOpened():
+                if cancel is not None and cancel.cancelled:
+                    break
                 ret, frame = cap.read()
                 if not ret:
                     break
                 
                 # Analyze every 5th frame to reduce processing time
                 if frame_count % 5 == 0:
-                    # Analyze gait
-                    gait_analysis = self.analyze_gait(frame)
-                    gait_results.append(gait_analysis)
+                    with span("video.frame"):
+                        # Analyze gait
+                        gait_analysis = self.analyze_gait(frame)
+                        gait_results.append(gait_analysis)
                     
-                    # Analyze facial movements
-                    facial_analysis = self.analyze_facial_movements(frame)
-                    facial_results.append(facial_analysis)
+                        # Analyze facial movements
+                        facial_analysis = self.analyze_facial_movements(frame)
+                        facial_results.append(facial_analysis)
+                    count_frames("video_service")
                 
                 frame_count += 1
             
             cap.release()
+            check(cancel)
             
             # Aggregate results
             results = {
@@ -196,6 +208,8 @@ class VideoAnalysisService:
             
             return results
             
+        except Cancelled:
+            raise
         except Exception as e:
             logger.error(f"Error in video analysis: {str(e)}")
             raise
@@ -0,0 +1,149 @@
+import os
+import sys
+from typing import Dict, List, Optional
+
+# Read by OpenMP, MKL, OpenBLAS, BLIS and numexpr when their pools start
+BLAS_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                 "BLIS_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ThreadBudget:
+    """
+    Thread counts for every pool, derived from the configured concurrency.
+
+    PyTorch, OpenCV, BLAS and onnxruntime each size their pools to every
+    core by default, so a few concurrent analyses oversubscribe the node.
+    Instead, `workers` processes share the machine's cores; each runs up to
+    `concurrency` analyses at once (the scheduler's total slots). Every
+    analysis gets `cores // workers // concurrency` intra-op threads (at
+    least one), and inter-op parallelism is kept at one thread since
+    requests already run in parallel.
+    """
+
+    def __init__(self,
+                 cores: Optional[int] = None,
+                 workers: Optional[int] = None,
+                 concurrency: Optional[int] = None,
+                 threads_per_analysis: Optional[int] = None,
+                 pin: Optional[bool] = None):
+        self.cores = cores or int(os.getenv("THREAD_BUDGET_CORES", "0")) or len(available_cores())
+        self.workers = workers or int(os.getenv("API_WORKERS", "1"))
+        self.concurrency = concurrency or int(os.getenv("SCHEDULER_TOTAL_SLOTS", "0")) or max(2, os.cpu_count() or 2)
+        self.cores_per_worker = max(1, self.cores // self.workers)
+        threads_per_analysis = threads_per_analysis or int(os.getenv("THREADS_PER_ANALYSIS", "0"))
+        self.threads_per_analysis = threads_per_analysis or max(1, self.cores_per_worker // self.concurrency)
+        if pin is None:
+            pin = os.getenv("THREAD_PIN_CORES", "false").lower() in ("1", "true", "yes")
+        self.pin = pin
+        self.worker_index: Optional[int] = None
+        # Set in a preload-then-fork parent: OpenMP pools started before
+        # fork() are not fork-safe, so the parent runs torch on one thread
+        self.single_threaded = False
+        self.applied = False
+
+    def allocation(self) -> Dict[str, int]:
+        """Planned thread count per pool"""
+        return {
+            "torch_intra_op": self.threads_per_analysis,
+            "torch_inter_op": 1,
+            "onnxruntime_intra_op": self.threads_per_analysis,
+            "cv2": self.threads_per_analysis,
+            "blas": self.threads_per_analysis
+        }
+
+    def export_env(self):
+        """Set the OpenMP/BLAS/onnxruntime variables that aren't set already"""
+        threads = str(self.threads_per_analysis)
+        for name in BLAS_ENV_VARS:
+            os.environ.setdefault(name, threads)
+        os.environ.setdefault("ORT_INTRA_OP_THREADS", threads)
+
+    def core_set(self, worker_index: int) -> List[int]:
+        """The slice of cores reserved for one worker process"""
+        cores = available_cores()
+        start = (worker_index % self.workers) * self.cores_per_worker
+        return cores[start:start + self.cores_per_worker] or cores
+
+    def apply(self, worker_index: Optional[int] = None):
+        """
+        Size the torch, OpenCV and BLAS pools in this process, and pin it to
+        its core set when pinning is on and a worker index is given.
+
+        Only libraries already imported are configured (nothing is imported
+        here), so call it again after loading a modality.
+        """
+        self.export_env()
+        if self.pin and worker_index is not None and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.core_set(worker_index))
+            self.worker_index = worker_index
+
+        threads = 1 if self.single_threaded else self.threads_per_analysis
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            torch.set_num_threads(threads)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                # Only settable once, before the first inter-op parallel work
+                pass
+        cv2 = sys.modules.get("cv2")
+        if cv2 is not None:
+            cv2.setNumThreads(threads)
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(limits=threads)
+        except ImportError:
+            pass
+        self.applied = True
+
+    def report(self) -> Dict:
+        """Planned allocation next to what each library actually uses"""
+        effective = {}
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            effective["torch_intra_op"] = torch.get_num_threads()
+            effective["torch_inter_op"] = torch.get_num_interop_threads()
+        cv2 = sys.modules.get("cv2")
+        if cv2 is not None:
+            effective["cv2"] = cv2.getNumThreads()
+        try:
+            from threadpoolctl import threadpool_info
+            effective["blas"] = [
+                {"library": pool["internal_api"], "num_threads": pool["num_threads"]}
+                for pool in threadpool_info()
+            ]
+        except ImportError:
+            effective["blas"] = {name: os.environ.get(name) for name in BLAS_ENV_VARS}
+        effective["onnxruntime_intra_op"] = int(os.environ.get("ORT_INTRA_OP_THREADS", "0"))
+
+        try:
+            process_threads = len(os.listdir("/proc/self/task"))
+        except OSError:
+            process_threads = None
+        return {
+            "cores": self.cores,
+            "workers": self.workers,
+            "cores_per_worker": self.cores_per_worker,
+            "concurrency": self.concurrency,
+            "threads_per_analysis": self.threads_per_analysis,
+            "pinned": self.pin and self.worker_index is not None,
+            "worker_index": self.worker_index,
+            "affinity": available_cores(),
+            "applied": self.applied,
+            "planned": self.allocation(),
+            "effective": effective,
+            "process_threads": process_threads
+        }
+
+
+# OpenMP/BLAS pools are sized when numpy and torch are first imported, so the
+# variables are exported on import; import this module before either
+thread_budget = ThreadBudget()
+thread_budget.export_env()
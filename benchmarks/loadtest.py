@@ -0,0 +1,406 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Before numpy and torch are imported, so their pools follow the thread budget
+from app.threads import thread_budget
+from app.ai_models.cancellation import check
+from app.ai_models.residency import process_rss
+
+import numpy as np
+
+from benchmarks.suite import environment
+from benchmarks.synthetic import Fixtures
+from benchmarks.tiny_models import use_tiny_bundle
+
+RESULTS_FORMAT = 1
+ENDPOINTS = ("text", "image", "audio", "video", "combined")
+DEFAULT_MIX = "text=4,image=3,audio=1,video=1,combined=1"
+
+
+class StubAnalyzer:
+    """
+    Stands in for every analyzer with a fixed service time, to load the
+    API, scheduler and threadpool without models. With `cpu` the time is
+    spent in a Python loop holding the GIL (like pre/post-processing);
+    otherwise it sleeps (like native kernels that release it).
+    """
+
+    def __init__(self, latency_ms: float = 50.0, cpu: bool = False):
+        self.latency = latency_ms / 1000
+        self.cpu = cpu
+
+    def _work(self, cancel=None):
+        deadline = time.perf_counter() + self.latency
+        while time.perf_counter() < deadline:
+            check(cancel)
+            if not self.cpu:
+                time.sleep(min(0.01, max(0.0, deadline - time.perf_counter())))
+
+    def analyze_symptoms(self, text: str, cancel=None) -> Dict:
+        self._work(cancel)
+        return {"symptoms": ["cough"], "conditions": [], "medications": []}
+
+    def analyze_image(self, image, cancel=None) -> Dict:
+        self._work(cancel)
+        return {"image_type": "stub", "detections": []}
+
+    def analyze_audio(self, audio_path: str, cancel=None) -> Dict:
+        self._work(cancel)
+        return {"transcription": "stub", "duration": 0.0}
+
+    def analyze_video(self, video_path: str, progress=None, cancel=None) -> Dict:
+        self._work(cancel)
+        if progress:
+            progress(1, 1)
+        return {"frame_count": 1}
+
+
+def _percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.array(values)
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max())
+    }
+
+
+def _parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' in mix, expected one of {ENDPOINTS}")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("The mix needs at least one endpoint with a positive weight")
+    return weights
+
+
+def _failed(status: int, body) -> Optional[str]:
+    """Why a response counts as an error, if it does"""
+    if status >= 400:
+        return f"HTTP {status}"
+    if isinstance(body, dict):
+        # /analyze returns {"error": ...}; the single-modality endpoints an "Error: ..." finding
+        if "error" in body:
+            return str(body["error"])
+        findings = body.get("findings") or []
+        if findings and str(findings[0]).startswith("Error:"):
+            return findings[0]
+    return None
+
+
+def _metric(text: str, name: str) -> Optional[float]:
+    """Sum of a metric's samples across label sets in a Prometheus text page"""
+    total = None
+    for line in text.splitlines():
+        if line.startswith(name) and line[len(name):len(name) + 1] in ("{", " "):
+            total = (total or 0.0) + float(line.rsplit(" ", 1)[1])
+    return total
+
+
+class Payloads:
+    """Request arguments per endpoint, built once from the synthetic fixtures"""
+
+    def __init__(self, fixtures: Fixtures):
+        with open(fixtures.audio_path, "rb") as f:
+            self.audio = f.read()
+        with open(fixtures.video_path, "rb") as f:
+            self.video = f.read()
+        self.image = fixtures.image_bytes
+        self.notes = (fixtures.short_note, fixtures.long_note)
+
+    def request(self, endpoint: str, rng: random.Random) -> Tuple[str, Dict]:
+        image = ("image.jpg", self.image, "image/jpeg")
+        audio = ("audio.wav", self.audio, "audio/wav")
+        video = ("video.mp4", self.video, "video/mp4")
+        if endpoint == "text":
+            return "/analyze/text", {"json": {"text": rng.choice(self.notes)}}
+        if endpoint == "image":
+            return "/analyze/image", {"files": {"file": image}}
+        if endpoint == "audio":
+            return "/analyze/audio", {"files": {"file": audio}}
+        if endpoint == "video":
+            return "/analyze/video", {"files": {"file": video}}
+        return "/analyze", {"data": {"text": self.notes[0]}, "files": {"image": image, "audio": audio}}
+
+
+class LoadTest:
+    """
+    Open-loop load against the API: requests arrive at `rate` per second
+    (Poisson, or evenly spaced with `constant`) for `duration` seconds,
+    each to an endpoint drawn from `mix`, whether or not earlier ones have
+    finished. Latency is measured from the scheduled arrival, so a stalled
+    client or server shows up in the percentiles instead of lowering the
+    offered load. Arrivals beyond `max_in_flight` are counted as dropped.
+
+    Every `sample_interval` seconds the server's RSS and queue depth are
+    scraped from /metrics, alongside the window's throughput and p95. With
+    an in-process app the event loop's scheduling lag is also sampled,
+    which shows handlers blocking the loop.
+    """
+
+    def __init__(self, client, payloads: Payloads, rate: float, duration: float, mix: Dict[str, float],
+                 max_in_flight: int = 256, sample_interval: float = 1.0, constant: bool = False,
+                 in_process: bool = False, seed: int = 0):
+        self.client = client
+        self.payloads = payloads
+        self.rate = rate
+        self.duration = duration
+        self.mix = mix
+        self.max_in_flight = max_in_flight
+        self.sample_interval = sample_interval
+        self.constant = constant
+        self.in_process = in_process
+        self.rng = random.Random(seed)
+        # (endpoint, finished at, latency ms, status, error)
+        self.completed: List[Tuple[str, float, float, int, Optional[str]]] = []
+        self.dropped = 0
+        self.in_flight = 0
+        self.timeline: List[Dict] = []
+        self.loop_lag_ms: List[float] = []
+
+    async def _send(self, endpoint: str, scheduled: float):
+        loop = asyncio.get_running_loop()
+        path, kwargs = self.payloads.request(endpoint, self.rng)
+        self.in_flight += 1
+        try:
+            response = await self.client.post(path, **kwargs)
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            status, error = response.status_code, _failed(response.status_code, body)
+        except Exception as e:
+            status, error = 0, f"{type(e).__name__}: {str(e)}"
+        finally:
+            self.in_flight -= 1
+        finished = loop.time()
+        self.completed.append((endpoint, finished - self.started, (finished - scheduled) * 1000, status, error))
+
+    async def _arrivals(self):
+        loop = asyncio.get_running_loop()
+        names, weights = list(self.mix), list(self.mix.values())
+        tasks = set()
+        scheduled = self.started
+        while True:
+            scheduled += 1 / self.rate if self.constant else self.rng.expovariate(self.rate)
+            if scheduled - self.started > self.duration:
+                break
+            await asyncio.sleep(max(0.0, scheduled - loop.time()))
+            if self.in_flight >= self.max_in_flight:
+                self.dropped += 1
+                continue
+            task = asyncio.ensure_future(self._send(self.rng.choices(names, weights)[0], scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _scrape(self) -> Dict:
+        try:
+            text = (await self.client.get("/metrics")).text
+        except Exception:
+            text = ""
+        rss = _metric(text, "medai_process_resident_memory_bytes")
+        if rss is None and self.in_process:
+            rss = process_rss()
+        return {
+            "rss_mb": rss / 2**20 if rss is not None else None,
+            "queue_depth": _metric(text, "medai_queue_depth"),
+            "queue_running": _metric(text, "medai_queue_running")
+        }
+
+    async def _sample(self, done: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        seen = 0
+        while not done.is_set():
+            try:
+                await asyncio.wait_for(done.wait(), self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+            window = self.completed[seen:]
+            seen += len(window)
+            self.timeline.append({
+                "t": round(loop.time() - self.started, 3),
+                "in_flight": self.in_flight,
+                "completed": len(window),
+                "errors": sum(1 for entry in window if entry[4]),
+                "throughput_per_s": len(window) / self.sample_interval,
+                "p95_ms": _percentiles([entry[2] for entry in window])["p95_ms"],
+                **await self._scrape()
+            })
+
+    async def _watch_loop(self, done: asyncio.Event, tick: float = 0.01):
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + tick
+            await asyncio.sleep(tick)
+            self.loop_lag_ms.append(max(0.0, loop.time() - expected) * 1000)
+
+    async def run(self) -> Dict:
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        self.started = loop.time()
+        watchers = [asyncio.ensure_future(self._sample(done))]
+        if self.in_process:
+            watchers.append(asyncio.ensure_future(self._watch_loop(done)))
+        await self._arrivals()
+        elapsed = loop.time() - self.started
+        done.set()
+        await asyncio.gather(*watchers)
+        return self.report(elapsed)
+
+    def _summary(self, entries: List, elapsed: float) -> Dict:
+        errors = [entry for entry in entries if entry[4]]
+        statuses: Dict[str, int] = {}
+        for entry in entries:
+            statuses[str(entry[3])] = statuses.get(str(entry[3]), 0) + 1
+        return {
+            "requests": len(entries),
+            "errors": len(errors),
+            "error_rate": len(errors) / len(entries) if entries else 0.0,
+            "throughput_per_s": (len(entries) - len(errors)) / elapsed if elapsed else 0.0,
+            **_percentiles([entry[2] for entry in entries]),
+            "statuses": statuses,
+            "first_error": errors[0][4] if errors else None
+        }
+
+    def report(self, elapsed: float) -> Dict:
+        rss = [sample["rss_mb"] for sample in self.timeline if sample["rss_mb"] is not None]
+        results = {
+            "offered_rate_per_s": self.rate,
+            "elapsed_s": elapsed,
+            "dropped": self.dropped,
+            "overall": self._summary(self.completed, elapsed),
+            "endpoints": {
+                name: self._summary([entry for entry in self.completed if entry[0] == name], elapsed)
+                for name in self.mix
+            },
+            "rss_mb": {"start": rss[0], "peak": max(rss), "end": rss[-1]} if rss else None,
+            "timeline": self.timeline
+        }
+        if self.loop_lag_ms:
+            results["event_loop_lag"] = _percentiles(self.loop_lag_ms)
+        return results
+
+
+def _load_app(models: str, stub_latency_ms: float, stub_cpu: bool, workdir: str):
+    """The real app, with tiny local models or every analyzer stubbed"""
+    if models == "tiny":
+        use_tiny_bundle(os.path.join(workdir, "bundle"))
+    else:
+        # Nothing to preload, and no framework imports
+        os.environ["PRELOAD_MODELS"] = "none"
+    from app import main
+    from app.ai_models.orchestrator import ANALYZERS
+    from app.ai_models.residency import ResidencyManager
+
+    if models == "stub":
+        main.ai_orchestrator.residency = ResidencyManager(
+            {name: (lambda: StubAnalyzer(stub_latency_ms, stub_cpu)) for name in ANALYZERS},
+            budget_mb=0, pinned=(), idle_seconds=0
+        )
+    return main.app
+
+
+async def _run(args, payloads: Payloads) -> Dict:
+    import httpx
+
+    mix = _parse_mix(args.mix)
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout,
+                                   limits=httpx.Limits(max_connections=args.max_in_flight))
+        app = None
+    else:
+        app = _load_app(args.models, args.stub_latency_ms, args.stub_cpu, args.workdir)
+        # httpx does not run lifespan events; start the workers, preload and sweeper ourselves
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest",
+                                   timeout=timeout)
+    try:
+        test = LoadTest(client, payloads, args.rate, args.duration, mix, args.max_in_flight,
+                        args.sample_interval, args.constant, in_process=app is not None, seed=args.seed)
+        return await test.run()
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-modality open-loop load test of the API")
+    parser.add_argument("--url", help="Target a running server (e.g. http://localhost:8000) instead of "
+                                      "driving the app in-process")
+    parser.add_argument("--models", choices=("tiny", "stub"), default="stub",
+                        help="In-process only: tiny local models or stub analyzers with a fixed service time")
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--stub-cpu", action="store_true",
+                        help="Stubs spin holding the GIL instead of sleeping")
+    parser.add_argument("--rate", type=float, default=5.0, help="Target arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of arrivals")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. text=4,image=3,combined=1")
+    parser.add_argument("--constant", action="store_true", help="Evenly spaced instead of Poisson arrivals")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Client timeout per request in seconds")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--audio-seconds", type=float, default=10.0)
+    parser.add_argument("--video-seconds", type=float, default=3.0)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "medical-ai-bench"),
+                        help="Where the tiny model bundle and synthetic inputs are cached")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--max-error-rate", type=float, help="Fail when the overall error rate is higher")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail when the overall p99 latency is higher")
+    args = parser.parse_args()
+
+    fixtures = Fixtures(os.path.join(args.workdir, "loadtest-inputs"), args.audio_seconds, args.video_seconds,
+                        large_image_side=256)
+    thread_budget.apply()
+
+    started = time.time()
+    report = asyncio.run(_run(args, Payloads(fixtures)))
+    results = {
+        "format": RESULTS_FORMAT,
+        "started": started,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        "environment": environment(),
+        **report
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+    overall = results["overall"]
+    failed = False
+    for name, summary in results["endpoints"].items():
+        print(f"{name:>9}: {summary['requests']} requests, {summary['error_rate']:.1%} errors, "
+              f"p50 {summary['p50_ms'] or 0:.0f} / p95 {summary['p95_ms'] or 0:.0f} / "
+              f"p99 {summary['p99_ms'] or 0:.0f} ms", file=sys.stderr)
+    if args.max_error_rate is not None and overall["error_rate"] > args.max_error_rate:
+        print(f"FAIL: error rate {overall['error_rate']:.1%} > {args.max_error_rate:.1%}", file=sys.stderr)
+        failed = True
+    if args.max_p99_ms is not None and (overall["p99_ms"] or 0) > args.max_p99_ms:
+        print(f"FAIL: p99 {overall['p99_ms']:.0f} ms > {args.max_p99_ms:.0f} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
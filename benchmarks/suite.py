@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Before numpy and torch are imported, so their pools follow the thread budget
+from app.threads import thread_budget
+from app.ai_models.residency import process_rss
+
+import numpy as np
+
+from benchmarks.synthetic import Fixtures
+from benchmarks.tiny_models import use_tiny_bundle
+
+RESULTS_FORMAT = 1
+GROUPS = ("vision", "audio", "video", "text", "services", "orchestrator")
+
+# Tiny bundle models each group loads
+GROUP_MODELS = {
+    "vision": ("clip", "yolov8n"),
+    "audio": ("wav2vec2",),
+    "video": ("yolov8n",),
+    "text": ("bio_clinical_bert",),
+    "services": ("clip", "wav2vec2", "yolov8n"),
+    "orchestrator": ("clip", "wav2vec2", "bio_clinical_bert", "yolov8n"),
+}
+
+
+class PeakRss:
+    """Samples the process RSS in the background and keeps the peak"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakRss":
+        self.start_rss = process_rss()
+        self.peak = self.start_rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, process_rss())
+
+
+def _failed(result) -> bool:
+    # Analyzers report failures in the result instead of raising
+    return isinstance(result, dict) and "error" in result
+
+
+def measure(fn: Callable, repeat: int = 10, warmup: int = 2, items: int = 1) -> Dict:
+    """
+    Latency percentiles (ms), throughput and peak RSS of `fn` over `repeat`
+    calls after `warmup` untimed ones. `items` is how many units (frames,
+    windows, ...) one call processes, for the throughput figure.
+    """
+    errors = []
+    for _ in range(warmup):
+        result = fn()
+        if _failed(result):
+            errors.append(result["error"])
+
+    timings = []
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            timings.append((time.perf_counter() - start) * 1000)
+            if _failed(result):
+                errors.append(result["error"])
+        total = time.perf_counter() - started
+
+    timings = np.array(timings)
+    return {
+        "calls": repeat,
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "max_ms": float(timings.max()),
+        "throughput_per_s": repeat * items / total if total else 0.0,
+        "peak_rss_mb": rss.peak / 2**20,
+        "rss_growth_mb": (rss.peak - rss.start_rss) / 2**20,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None
+    }
+
+
+def measure_load(build: Callable) -> Tuple[object, Dict]:
+    """Build an analyzer once; its load time and the memory it added"""
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        instance = build()
+        seconds = time.perf_counter() - started
+    thread_budget.apply()
+    return instance, {
+        "seconds": seconds,
+        "peak_rss_mb": rss.peak / 2**20,
+        "rss_growth_mb": (process_rss() - rss.start_rss) / 2**20
+    }
+
+
+class Suite:
+    """
+    Stages of every analyzer, service and the orchestrator, run against tiny
+    local models and synthetic inputs.
+
+    Each stage is timed in-process, one after another; models are loaded
+    once per group and that load is recorded as its own `<group>.load`
+    entry. Stage names are stable so result files compare run to run.
+    """
+
+    def __init__(self, fixtures: Fixtures, repeat: int = 10, warmup: int = 2):
+        self.fixtures = fixtures
+        self.repeat = repeat
+        self.warmup = warmup
+        self.analyzers: Dict = {}
+        self.results: Dict[str, Dict] = {}
+
+    def analyzer(self, name: str):
+        """Orchestrator analyzer, loaded (and its load recorded) on first use"""
+        if name not in self.analyzers:
+            from app.ai_models.orchestrator import AIOrchestrator
+            self.analyzers[name], self.results[f"{name}.load"] = measure_load(lambda: AIOrchestrator._create(name))
+        return self.analyzers[name]
+
+    def stage(self, name: str, fn: Callable, items: int = 1, repeat: Optional[int] = None):
+        print(f"  {name}", flush=True)
+        try:
+            self.results[name] = measure(fn, repeat or self.repeat, self.warmup, items)
+        except Exception as e:
+            self.results[name] = {"errors": 1, "first_error": f"{type(e).__name__}: {str(e)}"}
+
+    def vision(self):
+        from app.ai_models.image_input import ImageInput
+
+        f = self.fixtures
+        vision = self.analyzer("vision")
+        self.stage("image.decode", lambda: ImageInput.from_bytes(f.image_bytes))
+        # Fresh inputs per call; ImageInput caches its derived views
+        self.stage("vision.clip_preprocess", lambda: ImageInput(f.image).clip_pixel_values(vision.clip_processor))
+        pixel_values = ImageInput(f.image).clip_pixel_values(vision.clip_processor)
+        self.stage("vision.clip_forward", lambda: vision.clip_image_encoder(pixel_values=pixel_values))
+        self.stage("vision.yolo_letterbox", lambda: ImageInput(f.image).yolo_letterbox())
+        letterbox = ImageInput(f.image).yolo_letterbox()
+        self.stage("vision.yolo_forward", lambda: vision.yolo_model(letterbox.array, verbose=False))
+        self.stage("vision.analyze_image", lambda: vision.analyze_image(ImageInput(f.image)))
+        self.stage("vision.analyze_medical_imaging.tiled",
+                   lambda: vision.analyze_medical_imaging(f.large_image_path, tiled=True),
+                   repeat=max(1, self.repeat // 5))
+
+    def audio(self):
+        f = self.fixtures
+        audio = self.analyzer("audio")
+        self.stage("audio.analyze_audio", lambda: audio.analyze_audio(f.audio_path))
+
+    def video(self):
+        import cv2
+
+        f = self.fixtures
+        video = self.analyzer("video")
+        frames = int(cv2.VideoCapture(f.video_path).get(cv2.CAP_PROP_FRAME_COUNT))
+        repeat = max(1, self.repeat // 5)
+        self.stage("video.analyze_video", lambda: video.analyze_video(f.video_path), items=frames, repeat=repeat)
+        self.stage("video.analyze_gait", lambda: video.analyze_gait(f.video_path), items=frames, repeat=repeat)
+
+    def text(self):
+        f = self.fixtures
+        text = self.analyzer("text")
+        self.stage("text.tokenize", lambda: text.tokenizer(f.long_note, truncation=True, max_length=text.max_length,
+                                                           stride=text.window_overlap,
+                                                           return_overflowing_tokens=True, padding=True))
+        self.stage("text.analyze_symptoms.short", lambda: text.analyze_symptoms(f.short_note))
+        self.stage("text.analyze_symptoms.long", lambda: text.analyze_symptoms(f.long_note))
+        self.stage("text.analyze_medical_history", lambda: text.analyze_medical_history(f.short_note))
+
+    def services(self):
+        from app.ai_models.image_input import ImageInput
+        from app.services.audio_analysis import AudioAnalysisService
+        from app.services.image_analysis import MedicalImageAnalysis
+        from app.services.video_analysis import VideoAnalysisService
+
+        f = self.fixtures
+        image, self.results["services.image.load"] = measure_load(MedicalImageAnalysis)
+        self.stage("services.image.analyze_image", lambda: image.analyze_image(ImageInput(f.image)))
+        self.stage("services.image.analyze_large_image", lambda: image.analyze_large_image(f.large_image_path),
+                   repeat=max(1, self.repeat // 5))
+
+        audio, self.results["services.audio.load"] = measure_load(AudioAnalysisService)
+        self.stage("services.audio.preprocess_audio", lambda: audio.preprocess_audio(f.audio_path))
+        self.stage("services.audio.analyze_audio", lambda: audio.analyze_audio(f.audio_path))
+
+        video, self.results["services.video.load"] = measure_load(VideoAnalysisService)
+        self.stage("services.video.analyze_video", lambda: video.analyze_video(f.video_path),
+                   repeat=max(1, self.repeat // 5))
+
+    def orchestrator(self):
+        from app.ai_models.orchestrator import ANALYZERS, AIOrchestrator
+        from app.ai_models.residency import ResidencyManager
+
+        f = self.fixtures
+        # Reuse the analyzers loaded above rather than loading a second set
+        residency = ResidencyManager({name: (lambda name=name: self.analyzer(name)) for name in ANALYZERS},
+                                     budget_mb=0, pinned=(), idle_seconds=0)
+        orchestrator = AIOrchestrator(residency=residency)
+        self.stage("orchestrator.analyze_input.text", lambda: orchestrator.analyze_input(text=f.short_note))
+        self.stage("orchestrator.analyze_input.image", lambda: orchestrator.analyze_input(image_path=f.image_path))
+        self.stage("orchestrator.analyze_input.all", lambda: orchestrator.analyze_input(
+            text=f.short_note, image_path=f.image_path, audio_path=f.audio_path, video_path=f.video_path
+        ), repeat=max(1, self.repeat // 5))
+
+    def run(self, groups=GROUPS) -> Dict[str, Dict]:
+        for group in groups:
+            print(f"{group}:", flush=True)
+            getattr(self, group)()
+        return self.results
+
+
+def environment() -> Dict:
+    """What the numbers depend on, recorded next to them"""
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": thread_budget.allocation(),
+        "inference_backend": os.getenv("INFERENCE_BACKEND", "eager"),
+    }
+    for module in ("torch", "transformers", "ultralytics", "mediapipe", "numpy"):
+        info[module] = getattr(sys.modules.get(module), "__version__", None)
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        info["commit"] = None
+    return info
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, metric: str = "p50_ms") -> List[Dict]:
+    """Stages whose `metric` grew by more than `threshold` (a fraction) over the baseline"""
+    regressions = []
+    for name, result in current["stages"].items():
+        before = baseline["stages"].get(name, {}).get(metric)
+        after = result.get(metric)
+        if before and after and after > before * (1 + threshold):
+            regressions.append({"stage": name, "metric": metric, "baseline": before, "current": after,
+                                "change": after / before - 1})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every analyzer offline with tiny local models")
+    parser.add_argument("--groups", nargs="+", default=list(GROUPS), choices=GROUPS)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "medical-ai-bench"),
+                        help="Where the tiny model bundle and synthetic inputs are cached")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--baseline", help="Compare against an earlier results file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Fail when a stage's p50 or p95 is this much slower than the baseline")
+    args = parser.parse_args()
+
+    use_tiny_bundle(os.path.join(args.workdir, "bundle"),
+                    sorted({key for group in args.groups for key in GROUP_MODELS[group]}))
+    fixtures = Fixtures(os.path.join(args.workdir, "inputs"))
+    thread_budget.apply()
+
+    started = time.time()
+    stages = Suite(fixtures, args.repeat, args.warmup).run(args.groups)
+    results = {
+        "format": RESULTS_FORMAT,
+        "started": started,
+        "config": {"groups": args.groups, "repeat": args.repeat, "warmup": args.warmup},
+        "environment": environment(),
+        "process_peak_rss_mb": max(r.get("peak_rss_mb", 0) for r in stages.values()) if stages else 0,
+        "stages": stages
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+    failed = [name for name, result in stages.items() if result.get("errors")]
+    for name in failed:
+        print(f"ERROR: {name}: {stages[name]['first_error']}", file=sys.stderr)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for metric in ("p50_ms", "p95_ms"):
+            regressions += compare(baseline, results, args.threshold, metric)
+        for r in regressions:
+            print(f"REGRESSION: {r['stage']} {r['metric']} {r['baseline']:.1f} -> {r['current']:.1f} ms "
+                  f"(+{r['change']:.0%})", file=sys.stderr)
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import wave
+
+import numpy as np
+
+from .tiny_models import CLINICAL_WORDS
+
+
+def synthetic_image(height: int = 480, width: int = 640, seed: int = 0) -> np.ndarray:
+    """RGB uint8 image: smooth gradient background with a few bright blobs and noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 160
+    for _ in range(4):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        radius = rng.uniform(0.05, 0.15) * min(height, width)
+        blob = np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * radius ** 2))
+        image += blob[..., None] * rng.uniform(40, 90, size=3)
+    image += rng.normal(0, 6, size=image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def encode_image(rgb: np.ndarray, ext: str = ".jpg") -> bytes:
+    import cv2
+
+    ok, data = cv2.imencode(ext, rgb[..., ::-1])
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return data.tobytes()
+
+
+def write_image(path: str, rgb: np.ndarray) -> str:
+    with open(path, "wb") as f:
+        f.write(encode_image(rgb, os.path.splitext(path)[1] or ".png"))
+    return path
+
+
+def synthetic_audio(seconds: float = 10.0, sample_rate: int = 16000, seed: int = 0) -> np.ndarray:
+    """Mono float32 signal: a voiced tone with vibrato, bursts of noise (coughs) and silence"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    pitch = 140 + 8 * np.sin(2 * np.pi * 5 * t)
+    voiced = 0.3 * np.sin(2 * np.pi * np.cumsum(pitch) / sample_rate)
+    envelope = (np.sin(2 * np.pi * 0.5 * t) > -0.3).astype(np.float32)
+    signal = voiced * envelope
+    for start in rng.uniform(0, max(seconds - 0.3, 0.0), size=max(1, int(seconds / 3))):
+        i = int(start * sample_rate)
+        burst = rng.normal(0, 0.4, size=int(0.25 * sample_rate)).astype(np.float32)
+        signal[i:i + len(burst)] += burst[:len(signal) - i] * np.hanning(len(burst))[:len(signal) - i]
+    return np.clip(signal + rng.normal(0, 0.01, size=signal.shape), -1, 1).astype(np.float32)
+
+
+def write_wav(path: str, seconds: float = 10.0, sample_rate: int = 16000, seed: int = 0) -> str:
+    """16-bit PCM WAV readable by torchaudio and librosa"""
+    pcm = (synthetic_audio(seconds, sample_rate, seed) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return path
+
+
+def write_video(path: str, seconds: float = 3.0, fps: int = 15, height: int = 240, width: int = 320,
+                seed: int = 0) -> str:
+    """MP4 of a figure-like shape walking across a textured background"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    background = synthetic_image(height, width, seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise ValueError(f"Could not open a video writer for {path}")
+    frames = int(seconds * fps)
+    try:
+        for i in range(frames):
+            frame = background[..., ::-1].copy()
+            x = int((i / max(frames - 1, 1)) * (width - 60)) + 30
+            swing = int(12 * np.sin(i / 2.0))
+            cv2.circle(frame, (x, height // 4), height // 14, (200, 180, 160), -1)
+            cv2.line(frame, (x, height // 4), (x, height // 2 + 20), (180, 160, 140), 6)
+            cv2.line(frame, (x, height // 2 + 20), (x - 15 + swing, height - 30), (180, 160, 140), 6)
+            cv2.line(frame, (x, height // 2 + 20), (x + 15 - swing, height - 30), (180, 160, 140), 6)
+            noise = rng.integers(0, 8, size=frame.shape, dtype=np.uint8)
+            writer.write(cv2.add(frame, noise))
+    finally:
+        writer.release()
+    return path
+
+
+def synthetic_note(words: int = 60, seed: int = 0) -> str:
+    """Clinical-sounding free text of about `words` words"""
+    rng = np.random.default_rng(seed)
+    sentences = []
+    remaining = words
+    while remaining > 0:
+        length = int(min(remaining, rng.integers(6, 14)))
+        sentence = " ".join(rng.choice(CLINICAL_WORDS, size=length))
+        sentences.append(sentence.capitalize() + ".")
+        remaining -= length
+    return " ".join(sentences)
+
+
+class Fixtures:
+    """Synthetic inputs written once under `directory`"""
+
+    def __init__(self, directory: str, audio_seconds: float = 10.0, video_seconds: float = 3.0,
+                 large_image_side: int = 3072):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.image = synthetic_image()
+        self.image_bytes = encode_image(self.image)
+        self.image_path = write_image(os.path.join(directory, "image.jpg"), self.image)
+        self.large_image_path = write_image(
+            os.path.join(directory, "large_image.png"),
+            synthetic_image(large_image_side, large_image_side, seed=1)
+        )
+        self.audio_path = write_wav(os.path.join(directory, "audio.wav"), audio_seconds)
+        self.video_path = write_video(os.path.join(directory, "video.mp4"), video_seconds)
+        self.short_note = synthetic_note(40)
+        # Long enough to be split into several 512-token windows
+        self.long_note = synthetic_note(1500, seed=1)
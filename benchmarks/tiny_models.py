@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+import string
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from app.ai_models.bundle import MANIFEST_FORMAT, MANIFEST_NAME, MODEL_SPECS, get_bundle, sha256_file
+
+# Recorded with "tiny/<key>" hub ids, so caches keyed on the real models (label bank) are never reused
+TINY_REVISION = "tiny-random"
+
+CLINICAL_WORDS = [
+    "patient", "reports", "cough", "fever", "fatigue", "pain", "chest", "headache", "nausea", "no",
+    "denies", "history", "of", "diabetes", "hypertension", "asthma", "medication", "metformin",
+    "allergy", "penicillin", "shortness", "breath", "since", "three", "weeks", "days", "left", "arm",
+    "numbness", "dizziness", "blurred", "vision", "and", "with", "the", "a", "for", "in",
+]
+
+
+@lru_cache(maxsize=None)
+def _bytes_to_unicode():
+    """GPT-2/CLIP byte-to-character table"""
+    byte_values = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + \
+        list(range(ord("®"), ord("ÿ") + 1))
+    chars = byte_values[:]
+    n = 0
+    for b in range(256):
+        if b not in byte_values:
+            byte_values.append(b)
+            chars.append(256 + n)
+            n += 1
+    return dict(zip(byte_values, map(chr, chars)))
+
+
+def _clip(directory: str):
+    import torch
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor, CLIPTokenizer
+
+    os.makedirs(directory, exist_ok=True)
+    # Byte-level vocabulary without merges: every character is its own token
+    vocab = {}
+    for char in _bytes_to_unicode().values():
+        vocab.setdefault(char, len(vocab))
+        vocab.setdefault(char + "</w>", len(vocab))
+    for token in ("<|startoftext|>", "<|endoftext|>"):
+        vocab[token] = len(vocab)
+    with open(os.path.join(directory, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(directory, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(os.path.join(directory, "vocab.json"), os.path.join(directory, "merges.txt"))
+    image_processor = CLIPImageProcessor(size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32})
+
+    config = CLIPConfig(
+        text_config={
+            "vocab_size": len(vocab), "hidden_size": 32, "intermediate_size": 64, "num_hidden_layers": 2,
+            "num_attention_heads": 2, "max_position_embeddings": 77,
+            "bos_token_id": vocab["<|startoftext|>"], "eos_token_id": vocab["<|endoftext|>"],
+            "pad_token_id": vocab["<|endoftext|>"],
+        },
+        vision_config={
+            "hidden_size": 32, "intermediate_size": 64, "num_hidden_layers": 2, "num_attention_heads": 2,
+            "image_size": 32, "patch_size": 8,
+        },
+        projection_dim=32,
+    )
+    torch.manual_seed(0)
+    CLIPModel(config).save_pretrained(directory, safe_serialization=True)
+    CLIPProcessor(image_processor=image_processor, tokenizer=tokenizer).save_pretrained(directory)
+
+
+def _wav2vec2(directory: str):
+    import torch
+    from transformers import (Wav2Vec2Config, Wav2Vec2CTCTokenizer, Wav2Vec2FeatureExtractor, Wav2Vec2ForCTC,
+                              Wav2Vec2Processor)
+
+    os.makedirs(directory, exist_ok=True)
+    vocab = {"<pad>": 0, "<s>": 1, "</s>": 2, "<unk>": 3, "|": 4}
+    for letter in string.ascii_uppercase + "'":
+        vocab[letter] = len(vocab)
+    with open(os.path.join(directory, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    tokenizer = Wav2Vec2CTCTokenizer(os.path.join(directory, "vocab.json"), word_delimiter_token="|")
+    feature_extractor = Wav2Vec2FeatureExtractor(feature_size=1, sampling_rate=16000, padding_value=0.0,
+                                                 do_normalize=True, return_attention_mask=False)
+
+    # Same conv feature encoder strides as the base model (320x downsampling), far narrower
+    config = Wav2Vec2Config(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64,
+        conv_dim=(32,) * 7, num_conv_pos_embeddings=16, num_conv_pos_embedding_groups=2,
+        pad_token_id=vocab["<pad>"],
+    )
+    torch.manual_seed(0)
+    Wav2Vec2ForCTC(config).save_pretrained(directory, safe_serialization=True)
+    Wav2Vec2Processor(feature_extractor=feature_extractor, tokenizer=tokenizer).save_pretrained(directory)
+
+
+def _bert(directory: str):
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    os.makedirs(directory, exist_ok=True)
+    tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + CLINICAL_WORDS + list(string.ascii_lowercase) + \
+        list(string.digits) + list(".,;:-()/")
+    with open(os.path.join(directory, "vocab.txt"), "w") as f:
+        f.write("\n".join(tokens) + "\n")
+    tokenizer = BertTokenizerFast(os.path.join(directory, "vocab.txt"), do_lower_case=True)
+
+    # Full 512 positions so long notes are windowed exactly as with the real model
+    config = BertConfig(
+        vocab_size=len(tokens), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64,
+        max_position_embeddings=512, num_labels=2,
+    )
+    torch.manual_seed(0)
+    BertForSequenceClassification(config).save_pretrained(directory, safe_serialization=True)
+    tokenizer.save_pretrained(directory)
+
+
+def _yolo(directory: str):
+    import ultralytics
+
+    # An architecture yaml makes ultralytics build a randomly initialized model, offline
+    os.makedirs(directory, exist_ok=True)
+    source = os.path.join(os.path.dirname(ultralytics.__file__), "cfg", "models", "v8", "yolov8.yaml")
+    shutil.copyfile(source, os.path.join(directory, "yolov8n.yaml"))
+
+
+BUILDERS = {
+    "clip": (_clip, None),
+    "wav2vec2": (_wav2vec2, None),
+    "bio_clinical_bert": (_bert, None),
+    # The "n" in the file name selects the nano scale of the architecture yaml
+    "yolov8n": (_yolo, "yolov8n.yaml"),
+}
+
+
+def build_tiny_bundle(output_dir: str, models: Optional[Iterable[str]] = None) -> str:
+    """
+    Build a model bundle of tiny, randomly initialized models with the same
+    architecture classes as the real ones (CLIP, Wav2Vec2, BERT, YOLOv8),
+    without network access. Returns the bundle directory.
+
+    Only `models` (bundle keys, default all) are built, so a run that needs
+    no detector does not need ultralytics installed. A bundle built earlier
+    is extended with whichever of them it lacks.
+    """
+    models = list(BUILDERS) if models is None else list(models)
+    unknown = set(models) - set(BUILDERS)
+    if unknown:
+        raise ValueError(f"No tiny builder for: {', '.join(sorted(unknown))}")
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {"format": MANIFEST_FORMAT, "models": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    missing = [key for key in models if key not in manifest["models"]]
+    if not missing:
+        return output_dir
+
+    for key in missing:
+        build, weights = BUILDERS[key]
+        spec = MODEL_SPECS[key]
+        directory = os.path.join(output_dir, spec["path"])
+        build(directory)
+        files = {
+            name: sha256_file(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, name))
+        }
+        entry = {"id": f"tiny/{key}", "revision": TINY_REVISION, "path": spec["path"], "files": files}
+        if weights:
+            entry["weights"] = weights
+        manifest["models"][key] = entry
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return output_dir
+
+
+def use_tiny_bundle(output_dir: str, models: Optional[Iterable[str]] = None) -> str:
+    """Build the tiny bundle (or the `models` of it) if needed and make every analyzer load from it"""
+    build_tiny_bundle(output_dir, models)
+    os.environ["MODEL_BUNDLE_DIR"] = output_dir
+    os.environ["LABEL_BANK_CACHE_DIR"] = os.path.join(output_dir, "label_bank")
+    get_bundle.cache_clear()
+    return output_dir
@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Frameworks a modality pulls in on first use; importing the app must not load them
+HEAVY_MODULES = ("torch", "torchvision", "torchaudio", "transformers", "ultralytics", "mediapipe",
+                 "librosa", "tensorflow", "cv2", "scipy", "onnxruntime")
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = """
+import json, resource, sys, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"seconds": seconds, "rss_mb": (after - before) / 1024, "heavy_modules": heavy}}))
+"""
+
+
+def measure(module: str, runs: int = 3) -> dict:
+    """Best-of-`runs` import time and peak RSS growth of `module` in a fresh process"""
+    # Models would load at startup, not import; keep the probe to the import itself
+    env = dict(os.environ, PRELOAD_MODELS="none")
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(results, key=lambda r: r["seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when importing the app exceeds its time or memory budget")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--max-seconds", type=float, default=float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5")))
+    parser.add_argument("--max-rss-mb", type=float, default=float(os.getenv("IMPORT_BUDGET_RSS_MB", "150")))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    result = measure(args.module, args.runs)
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if result["seconds"] > args.max_seconds:
+        failures.append(f"import took {result['seconds']:.2f}s (budget {args.max_seconds:.2f}s)")
+    if result["rss_mb"] > args.max_rss_mb:
+        failures.append(f"import grew RSS by {result['rss_mb']:.0f} MB (budget {args.max_rss_mb:.0f} MB)")
+    if result["heavy_modules"]:
+        failures.append(f"import loaded {', '.join(result['heavy_modules'])}")
+    for failure in failures:
+        print(f"FAIL: {args.module} {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
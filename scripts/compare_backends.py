@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import torch
+from transformers import CLIPProcessor, CLIPModel, Wav2Vec2Processor, Wav2Vec2Model, AutoTokenizer, AutoModelForSequenceClassification
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.ai_models.backends import BACKENDS, CLIP_IMAGE_MODULES, InferenceRunner, benchmark, check_parity
+
+FIXTURE_TEXTS = [
+    "Patient reports persistent cough and fatigue for three weeks.",
+    "No fever. Denies chest pain. History of type 2 diabetes managed with metformin.",
+    "Intermittent headaches, blurred vision and numbness in the left arm since yesterday.",
+]
+
+
+def text_fixtures():
+    tokenizer = AutoTokenizer.from_pretrained("emilyalsentzer/Bio_ClinicalBERT")
+    return [dict(tokenizer(text, return_tensors="pt", truncation=True, max_length=512)) for text in FIXTURE_TEXTS]
+
+
+def image_fixtures():
+    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, size=(224, 224, 3), dtype=np.uint8) for _ in range(3)]
+    return [{"pixel_values": processor(images=image, return_tensors="pt")["pixel_values"]} for image in images]
+
+
+def audio_fixtures():
+    processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h")
+    t = np.linspace(0, 2.0, 32000, dtype=np.float32)
+    signals = [np.sin(2 * np.pi * freq * t) * 0.3 for freq in (220.0, 440.0, 880.0)]
+    return [{"input_values": processor(s, sampling_rate=16000, return_tensors="pt")["input_values"]} for s in signals]
+
+
+MODELS = {
+    "bio_clinical_bert": (
+        lambda: AutoModelForSequenceClassification.from_pretrained("emilyalsentzer/Bio_ClinicalBERT"),
+        {"output_names": ("logits",)},
+        text_fixtures
+    ),
+    "clip": (
+        lambda: CLIPModel.from_pretrained("openai/clip-vit-base-patch32"),
+        {"method": "get_image_features", "output_names": ("image_embeds",), "quantize": CLIP_IMAGE_MODULES},
+        image_fixtures
+    ),
+    "wav2vec2": (
+        lambda: Wav2Vec2Model.from_pretrained("facebook/wav2vec2-base-960h"),
+        {"output_names": ("last_hidden_state",)},
+        audio_fixtures
+    ),
+}
+
+
+def compare_backends(model_keys, backends, repeats, min_cosine):
+    """
+    Check each backend against eager fp32 on fixture inputs and time it
+    """
+    report = {}
+    for key in model_keys:
+        load, runner_kwargs, fixtures = MODELS[key]
+        print(f"Comparing backends for {key}...")
+        inputs = fixtures()
+        reference = InferenceRunner(load(), backend="eager", name=key, **runner_kwargs)
+
+        results = {"eager": {"benchmark": benchmark(reference, inputs, repeats=repeats)}}
+        for backend in backends:
+            if backend == "eager":
+                continue
+            candidate = InferenceRunner(load(), backend=backend, name=key, **runner_kwargs)
+            results[backend] = {
+                "parity": check_parity(reference, candidate, inputs, min_cosine=min_cosine),
+                "benchmark": benchmark(candidate, inputs, repeats=repeats)
+            }
+            results[backend]["speedup"] = results["eager"]["benchmark"]["mean_ms"] / results[backend]["benchmark"]["mean_ms"]
+        report[key] = results
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare inference backends against eager fp32")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    report = compare_backends(args.models, args.backends, args.repeats, args.min_cosine)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
@@ -1,37 +1,91 @@
+import argparse
+import json
 import os
-import torch
-from transformers import CLIPProcessor, CLIPModel, Wav2Vec2Processor, Wav2Vec2Model, AutoTokenizer, AutoModelForSequenceClassification
-from ultralytics import YOLO
+import shutil
+import sys
 
-def download_models():
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.ai_models.bundle import MANIFEST_FORMAT, MANIFEST_NAME, MODEL_SPECS, sha256_file
+
+
+def resolve_revision(model_id: str, revision: str) -> str:
+    """Pin a branch or tag to the commit it currently points at"""
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().model_info(model_id, revision=revision).sha
+    except Exception:
+        return revision
+
+
+def save_transformers_model(key: str, model_cls, processor_cls, directory: str, revision: str) -> str:
+    spec = MODEL_SPECS[key]
+    revision = resolve_revision(spec["id"], revision)
+    print(f"Downloading {spec['id']}@{revision}...")
+    model = model_cls.from_pretrained(spec["id"], revision=revision)
+    # Safetensors so the loader can memory map the weights
+    model.save_pretrained(directory, safe_serialization=True, max_shard_size="100GB")
+    processor_cls.from_pretrained(spec["id"], revision=revision).save_pretrained(directory)
+    return revision
+
+
+def save_yolo(directory: str) -> str:
+    from ultralytics import YOLO
+
+    weights = MODEL_SPECS["yolov8n"]["weights"]
+    print(f"Downloading {weights}...")
+    model = YOLO(weights)
+    os.makedirs(directory, exist_ok=True)
+    shutil.copyfile(model.ckpt_path, os.path.join(directory, weights))
+    return "ultralytics"
+
+
+def download_models(output_dir: str = "models", revision: str = "main"):
     """
-    Download all required model weights
+    Download all required model weights into a local bundle
+
+    Each model is written to its own directory with safetensors weights,
+    and `manifest.json` records its hub id, pinned revision and the sha256
+    of every file, so the app can load it offline.
     """
-    print("Downloading model weights...")
-    
-    # Create models directory
-    os.makedirs("models", exist_ok=True)
-    
-    # Download CLIP model
-    print("Downloading CLIP model...")
-    CLIPModel.from_pretrained("openai/clip-vit-base-patch32", cache_dir="models")
-    CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32", cache_dir="models")
-    
-    # Download Wav2Vec2 model
-    print("Downloading Wav2Vec2 model...")
-    Wav2Vec2Model.from_pretrained("facebook/wav2vec2-base-960h", cache_dir="models")
-    Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h", cache_dir="models")
-    
-    # Download BioClinicalBERT model
-    print("Downloading BioClinicalBERT model...")
-    AutoModelForSequenceClassification.from_pretrained("emilyalsentzer/Bio_ClinicalBERT", cache_dir="models")
-    AutoTokenizer.from_pretrained("emilyalsentzer/Bio_ClinicalBERT", cache_dir="models")
-    
-    # Download YOLOv8 model
-    print("Downloading YOLOv8 model...")
-    YOLO('yolov8n.pt')
-    
-    print("All models downloaded successfully!")
+    from transformers import (AutoModelForSequenceClassification, AutoTokenizer, CLIPModel, CLIPProcessor,
+                              Wav2Vec2ForCTC, Wav2Vec2Processor)
+
+    os.makedirs(output_dir, exist_ok=True)
+    builders = {
+        # The CTC checkpoint also serves the base Wav2Vec2Model (its prefix is stripped at load)
+        "clip": lambda d: save_transformers_model("clip", CLIPModel, CLIPProcessor, d, revision),
+        "wav2vec2": lambda d: save_transformers_model("wav2vec2", Wav2Vec2ForCTC, Wav2Vec2Processor, d, revision),
+        # Saved with its classification head so every process loads the same head weights
+        "bio_clinical_bert": lambda d: save_transformers_model(
+            "bio_clinical_bert", AutoModelForSequenceClassification, AutoTokenizer, d, revision
+        ),
+        "yolov8n": save_yolo,
+    }
+
+    manifest = {"format": MANIFEST_FORMAT, "models": {}}
+    for key, build in builders.items():
+        spec = MODEL_SPECS[key]
+        directory = os.path.join(output_dir, spec["path"])
+        model_revision = build(directory)
+        files = {
+            name: sha256_file(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, name))
+        }
+        entry = {"id": spec["id"], "revision": model_revision, "path": spec["path"], "files": files}
+        if "weights" in spec:
+            entry["weights"] = spec["weights"]
+        manifest["models"][key] = entry
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"All models downloaded; manifest written to {os.path.join(output_dir, MANIFEST_NAME)}")
+
 
 if __name__ == "__main__":
-    download_models() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the local model bundle")
+    parser.add_argument("--output", default=os.getenv("MODEL_BUNDLE_DIR", "models"))
+    parser.add_argument("--revision", default="main", help="Hub revision to pin (resolved to a commit)")
+    args = parser.parse_args()
+    download_models(args.output, args.revision)
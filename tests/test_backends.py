@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from app.ai_models.backends import CLIP_IMAGE_MODULES, InferenceRunner, check_parity  # noqa: E402
+from benchmarks.tiny_models import BUILDERS  # noqa: E402
+
+# int8 runs the tiny random models with coarser weights; onnx should match fp32
+MIN_COSINE = {"int8": 0.98, "onnx": 0.999}
+
+
+def _clip_fixtures(directory):
+    processor = transformers.CLIPProcessor.from_pretrained(directory)
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8) for _ in range(3)]
+    return [{"pixel_values": processor(images=image, return_tensors="pt")["pixel_values"]} for image in images]
+
+
+def _bert_fixtures(directory):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(directory)
+    notes = ["patient reports cough and fever", "denies chest pain", "history of diabetes and hypertension"]
+    return [dict(tokenizer(note, return_tensors="pt")) for note in notes]
+
+
+def _wav2vec2_fixtures(directory):
+    t = np.linspace(0, 1.0, 16000, dtype=np.float32)
+    return [{"input_values": torch.from_numpy(np.sin(2 * np.pi * freq * t) * 0.3)[None]} for freq in (220.0, 440.0)]
+
+
+MODELS = {
+    "clip": (
+        lambda: transformers.CLIPModel,
+        {"method": "get_image_features", "output_names": ("image_embeds",), "quantize": CLIP_IMAGE_MODULES},
+        _clip_fixtures
+    ),
+    "bio_clinical_bert": (
+        lambda: transformers.AutoModelForSequenceClassification,
+        {"output_names": ("logits",)},
+        _bert_fixtures
+    ),
+    "wav2vec2": (
+        lambda: transformers.Wav2Vec2Model,
+        {"output_names": ("last_hidden_state",)},
+        _wav2vec2_fixtures
+    ),
+}
+
+
+@pytest.fixture(scope="module")
+def tiny_models(tmp_path_factory):
+    root = tmp_path_factory.mktemp("tiny")
+    for key in MODELS:
+        BUILDERS[key][0](str(root / key))
+    return root
+
+
+@pytest.mark.parametrize("backend", ["int8", "onnx"])
+@pytest.mark.parametrize("key", list(MODELS))
+def test_backend_matches_eager(tiny_models, tmp_path, key, backend):
+    if backend == "onnx":
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+    model_class, runner_kwargs, fixtures = MODELS[key]
+    directory = str(tiny_models / key)
+    load = lambda: model_class().from_pretrained(directory)  # noqa: E731
+
+    reference = InferenceRunner(load(), backend="eager", name=key, **runner_kwargs)
+    candidate = InferenceRunner(load(), backend=backend, name=key, export_dir=str(tmp_path), **runner_kwargs)
+    report = check_parity(reference, candidate, fixtures(directory), min_cosine=MIN_COSINE[backend])
+    assert report["passed"], report
+
+
+def test_int8_leaves_the_clip_text_tower_in_fp32(tiny_models):
+    model = transformers.CLIPModel.from_pretrained(str(tiny_models / "clip"))
+    InferenceRunner(model, backend="int8", method="get_image_features", output_names=("image_embeds",),
+                    quantize=CLIP_IMAGE_MODULES)
+    assert isinstance(model.text_projection, torch.nn.Linear)
+    assert not isinstance(model.visual_projection, torch.nn.Linear)
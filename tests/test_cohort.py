@@ -0,0 +1,63 @@
+import json
+import os
+
+import pytest
+
+from app.cohort import ResultWriter, read_manifest
+
+
+def _row(case_id, status="ok"):
+    return {"case_id": case_id, "modalities": "text", "status": status, "error": None if status == "ok" else "failed",
+            "confidence": 0.5, "elapsed_ms": 1.0, "worker": 1}
+
+
+def test_read_manifest_csv_resolves_paths_and_numbers_missing_ids(tmp_path):
+    manifest = tmp_path / "cohort.csv"
+    manifest.write_text("case_id,text,image_path\na, cough ,img/a.png\n,,\n")
+    cases = read_manifest(str(manifest))
+    assert cases == [
+        {"case_id": "a", "text": "cough", "image_path": os.path.join(str(tmp_path), "img/a.png")},
+        {"case_id": "row-2"}
+    ]
+
+
+def test_read_manifest_rejects_duplicate_ids(tmp_path):
+    manifest = tmp_path / "cohort.jsonl"
+    manifest.write_text(json.dumps({"case_id": "a"}) + "\n" + json.dumps({"case_id": "a"}) + "\n")
+    with pytest.raises(ValueError, match="Duplicate"):
+        read_manifest(str(manifest))
+
+
+def test_writer_checkpoints_only_successful_cases(tmp_path):
+    writer = ResultWriter(str(tmp_path), format="jsonl")
+    writer.write([_row("a"), _row("b", status="error"), _row("c", status="cancelled")])
+    writer.close()
+
+    writer = ResultWriter(str(tmp_path))
+    assert writer.done() == {"a"}
+    writer.write([_row("b")])
+    assert writer.done() == {"a", "b"}
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("part-")) == \
+        ["part-000000.jsonl", "part-000001.jsonl"]
+    writer.close()
+
+
+def test_writer_removes_parts_missing_from_the_checkpoint(tmp_path):
+    writer = ResultWriter(str(tmp_path), format="jsonl")
+    writer.write([_row("a")])
+    writer.close()
+    (tmp_path / "part-000001.jsonl").write_text(json.dumps(_row("b")) + "\n")
+
+    writer = ResultWriter(str(tmp_path))
+    assert not (tmp_path / "part-000001.jsonl").exists()
+    assert writer.done() == {"a"}
+    writer.write([_row("b")])
+    rows = [json.loads(line) for line in (tmp_path / "part-000001.jsonl").read_text().splitlines()]
+    assert [row["case_id"] for row in rows] == ["b"]
+    writer.close()
+
+
+def test_writer_keeps_the_format_it_started_with(tmp_path):
+    ResultWriter(str(tmp_path), format="jsonl").close()
+    with pytest.raises(ValueError, match="resume with that format"):
+        ResultWriter(str(tmp_path), format="parquet")
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.embeddings import VectorSpace  # noqa: E402
+
+
+@pytest.fixture
+def space(tmp_path):
+    space = VectorSpace(str(tmp_path), dim=8)
+    yield space
+    space.close()
+
+
+def test_search_finds_the_nearest_vectors(space):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(20, 8))
+    rows = space.append(vectors, [{"case_id": f"case-{i}"} for i in range(20)])
+    assert rows == list(range(20))
+    assert space.count == 20
+
+    results = space.search(vectors[7], k=3, approximate=False)
+    assert results[0]["row"] == 7
+    assert space.metadata([7])[7]["case_id"] == "case-7"
+
+
+def test_failed_metadata_insert_leaves_no_orphan_vector(space, monkeypatch):
+    space.append(np.ones((3, 8)), [{"case_id": "a"}] * 3)
+
+    real = space._conn
+
+    class Busy:
+        def __getattr__(self, name):
+            return getattr(real, name)
+
+        def executemany(self, *args):
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(space, "_conn", Busy())
+    with pytest.raises(sqlite3.OperationalError):
+        space.append(np.ones((2, 8)), [{"case_id": "b"}] * 2)
+    monkeypatch.setattr(space, "_conn", real)
+
+    assert os.path.getsize(space.vectors_path) == 3 * space.row_bytes
+    assert space.append(np.ones((1, 8)), [{"case_id": "c"}]) == [3]
+    assert space.count == 4
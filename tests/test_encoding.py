@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.ai_models.encoding import encode_detections, encode_masks, mask_to_polygons, rle_decode, rle_encode  # noqa: E402
+
+
+def _masks():
+    rng = np.random.default_rng(0)
+    random = rng.random((37, 53)) > 0.6
+    corner = np.zeros((4, 5), dtype=bool)
+    corner[0, 0] = True
+    return [random, corner, np.zeros((6, 7), dtype=bool), np.ones((6, 7), dtype=bool)]
+
+
+@pytest.mark.parametrize("mask", _masks())
+def test_rle_round_trip(mask):
+    rle = rle_encode(mask)
+    assert rle["size"] == list(mask.shape)
+    assert sum(rle["counts"]) == mask.size
+    assert np.array_equal(rle_decode(rle), mask)
+
+
+def test_rle_starts_with_a_zero_run():
+    # COCO RLE counts 0s first, in column-major order
+    mask = np.array([[1, 0], [1, 1]], dtype=bool)
+    assert rle_encode(mask)["counts"] == [0, 2, 1, 1]
+
+
+def test_polygon_round_trip_covers_the_shape():
+    import cv2
+
+    mask = np.zeros((40, 60), dtype=np.uint8)
+    mask[5:20, 10:30] = 1
+    cv2.circle(mask, (45, 28), 8, 1, -1)
+    polygons = mask_to_polygons(mask, tolerance=0)
+    assert len(polygons) == 2
+
+    filled = np.zeros_like(mask)
+    for polygon in polygons:
+        cv2.fillPoly(filled, [np.array(polygon, dtype=np.int32).reshape(-1, 2)], 1)
+    assert np.array_equal(filled, mask)
+
+
+def test_encode_masks_downsamples_then_encodes():
+    soft = np.zeros((2, 40, 60), dtype=np.float32)
+    soft[0, :20, :30] = 0.9
+    soft[1, 20:, 30:] = 0.7
+    encoded = encode_masks(soft, mask_format="rle", downsample=2)
+    assert encoded["size"] == [20, 30]
+    first = rle_decode(encoded["masks"][0])
+    assert first[:10, :15].all() and not first[10:, :].any()
+
+    polygons = encode_masks(soft, mask_format="polygon")
+    assert polygons["format"] == "polygon" and polygons["size"] == [40, 60]
+    assert all(len(mask) == 1 for mask in polygons["masks"])
+
+    with pytest.raises(ValueError):
+        encode_masks(soft, mask_format="png")
+
+
+def test_encode_masks_maps_out_of_the_letterbox():
+    pytest.importorskip("torch")
+    from app.ai_models.image_input import ImageInput
+
+    image = ImageInput(np.zeros((50, 100, 3), dtype=np.uint8))
+    letterbox = image.yolo_letterbox(size=64)
+    soft = np.zeros((1, 64, 64), dtype=np.float32)
+    # Content spans rows 16..48 of the letterbox; mark its left half
+    soft[0, 16:48, :32] = 1.0
+    encoded = encode_masks(soft, letterbox=letterbox)
+    assert encoded["size"] == [50, 100]
+    mask = rle_decode(encoded["masks"][0])
+    assert mask[:, :50].all() and not mask[:, 50:].any()
+
+
+def test_detections_are_columns():
+    detections = encode_detections(
+        np.array([[1.04, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0]]), np.array([0.91234, 0.5]), np.array([1, 7]),
+        names={1: "person"}
+    )
+    assert detections["boxes"][0] == [1.0, 2.0, 3.0, 4.0]
+    assert detections["scores"] == [pytest.approx(0.912), 0.5]
+    assert detections["class_names"] == ["person", "7"]
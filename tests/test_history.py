@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+
+from app.history import HistoryRecorder, HistoryStore
+
+START = 1_700_000_000.0
+
+
+def _entry(i, **overrides):
+    entry = {
+        "created_at": START + i,
+        "case_id": f"case-{i}",
+        "patient_id": f"patient-{i % 3}",
+        "session_id": None,
+        "endpoint": "/analyze",
+        "modalities": ["text", "image"] if i % 2 else ["text"],
+        "findings": [f"finding {i}"],
+        "recommendations": [],
+        "confidence": 0.5,
+        "error": None
+    }
+    entry.update(overrides)
+    return entry
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add_many([_entry(i) for i in range(100)])
+    yield store
+    store.close()
+
+
+def _all_pages(store, limit, **filters):
+    entries, cursor, pages = [], None, 0
+    while True:
+        page, cursor = store.query(limit=limit, cursor=cursor, **filters)
+        entries.extend(page)
+        pages += 1
+        if cursor is None:
+            return entries, pages
+
+
+def test_cursor_pages_cover_every_entry_newest_first(store):
+    entries, pages = _all_pages(store, limit=30)
+    ids = [entry["id"] for entry in entries]
+    assert len(ids) == 100
+    assert ids == sorted(ids, reverse=True)
+    assert pages == 4
+
+
+def test_last_full_page_ends_with_an_empty_page(store):
+    page, cursor = store.query(limit=50)
+    page, cursor = store.query(limit=50, cursor=cursor)
+    assert len(page) == 50 and cursor is not None
+    assert store.query(limit=50, cursor=cursor) == ([], None)
+
+
+def test_filters_page_through_their_matches_only(store):
+    entries, _ = _all_pages(store, limit=7, patient_id="patient-1")
+    assert len(entries) == 33
+    assert {entry["patient_id"] for entry in entries} == {"patient-1"}
+
+    entries, _ = _all_pages(store, limit=7, modality="image")
+    assert len(entries) == 50
+    assert all("image" in entry["modalities"] for entry in entries)
+
+    page, _ = store.query(case_id="case-42")
+    assert [entry["findings"] for entry in page] == [["finding 42"]]
+
+
+def test_time_window_is_half_open(store):
+    entries, _ = _all_pages(store, limit=4, since=START + 10, until=START + 20)
+    assert [entry["created_at"] - START for entry in entries] == list(range(19, 9, -1))
+
+    entries, _ = _all_pages(store, limit=4, since=START + 10, until=START + 20, modality="image")
+    assert [entry["created_at"] - START for entry in entries] == [19, 17, 15, 13, 11]
+
+    assert store.query(since=START + 1000) == ([], None)
+    assert store.query(until=START) == ([], None)
+
+
+def test_purge_by_age_keeps_newer_entries(store):
+    assert store.purge(older_than=START + 40, chunk=7) == 40
+    entries, _ = _all_pages(store, limit=500)
+    assert min(entry["created_at"] for entry in entries) == START + 40
+    assert store.count() == 60
+    # Modality rows go with their entries
+    image, _ = _all_pages(store, limit=500, modality="image")
+    assert len(image) == 30
+
+
+def test_purge_by_row_count_keeps_the_newest(store):
+    assert store.purge(max_rows=25) == 75
+    entries, _ = _all_pages(store, limit=500)
+    assert [entry["case_id"] for entry in entries] == [f"case-{i}" for i in range(99, 74, -1)]
+    assert store.purge(max_rows=25) == 0
+
+
+def test_purge_without_limits_deletes_nothing(store):
+    assert store.purge() == 0
+    assert store.count() == 100
+
+
+def test_time_window_and_purge_follow_created_at_across_interleaved_batches(tmp_path):
+    # Two workers flush their own batches, so ids do not follow created_at
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add_many([_entry(0, case_id="a0", created_at=100.0), _entry(1, case_id="a1", created_at=101.4)])
+    store.add_many([_entry(2, case_id="b0", created_at=100.5), _entry(3, case_id="b1", created_at=101.0)])
+
+    entries, _ = _all_pages(store, limit=2, since=100.2, until=102)
+    assert [entry["case_id"] for entry in entries] == ["b1", "b0", "a1"]
+    entries, _ = _all_pages(store, limit=1, since=100.2, until=101.2, modality="image")
+    assert [entry["case_id"] for entry in entries] == ["b1"]
+
+    assert store.purge(older_than=100.7) == 2
+    entries, _ = _all_pages(store, limit=10)
+    assert [entry["case_id"] for entry in entries] == ["b1", "a1"]
+    assert store.purge(max_rows=1, chunk=1) == 1
+    assert [entry["case_id"] for entry in store.query()[0]] == ["a1"]
+    store.close()
+
+
+def _summarize(results):
+    findings = [f"{k}: {v}" for k, v in results.get("text_analysis", {}).items() if not hasattr(v, "shape")]
+    return {"findings": findings, "recommendations": [], "confidence": 0.9}
+
+
+def test_recorder_queues_only_the_stored_columns(tmp_path):
+    recorder = HistoryRecorder(_summarize, history_dir=str(tmp_path), queue_size=2, flush_interval=0.01)
+    results = {"text_analysis": {"summary": "cough", "embeddings": np.zeros((1, 768), dtype=np.float32)}}
+    for i in range(3):
+        recorder.record(results, ["text"], endpoint="/analyze", case_id=f"case-{i}")
+
+    queued = list(recorder._queue.queue)
+    assert len(queued) == 2 and recorder.dropped == 1
+    assert not any(isinstance(value, np.ndarray) for entry in queued for value in entry.values())
+
+    recorder.start()
+    recorder.stop()
+    page, _ = recorder.store.query()
+    assert [entry["case_id"] for entry in page] == ["case-1", "case-0"]
+    assert page[0]["findings"] == ["summary: cough"]
+    recorder.store.close()
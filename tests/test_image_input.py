@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from app.ai_models.image_input import ImageInput
+
+
+@pytest.mark.parametrize("shape", [(480, 640), (640, 480), (100, 150), (224, 224), (1024, 300)])
+def test_clip_pixel_values_match_clip_image_processor(shape):
+    rng = np.random.default_rng(sum(shape))
+    # Smooth gradients plus noise, like a photo rather than pure noise
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    base = np.stack([x * 255 / shape[1], y * 255 / shape[0], (x + y) * 127 / sum(shape)], axis=-1)
+    rgb = np.clip(base + rng.normal(0, 20, base.shape), 0, 255).astype(np.uint8)
+
+    processor = transformers.CLIPImageProcessor()
+    expected = processor(images=rgb, return_tensors="pt")["pixel_values"]
+    actual = ImageInput(rgb).clip_pixel_values(processor)
+
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), atol=1e-4)
@@ -0,0 +1,25 @@
+import pytest
+
+from app.ai_models.lexicon import DEFAULT_LEXICON_PATH, MedicalTermExtractor
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return MedicalTermExtractor.from_file(DEFAULT_LEXICON_PATH)
+
+
+@pytest.mark.parametrize("text, symptoms, negated", [
+    ("No fever, cough for three days", ["cough"], ["fever"]),
+    ("no fever; headache", ["headache"], ["fever"]),
+    ("denies fever but has cough", ["cough"], ["fever"]),
+    ("no fever or cough", [], ["fever", "cough"]),
+])
+def test_negation_stops_at_clause_breaks(extractor, text, symptoms, negated):
+    summary = extractor.summarize(text)
+    assert summary["symptoms"] == symptoms
+    assert summary["negated_symptoms"] == negated
+
+
+def test_family_and_allergy_scopes_carry_across_commas(extractor):
+    assert extractor.summarize("Mother has diabetes, hypertension")["family_history"] == ["diabetes", "hypertension"]
+    assert extractor.summarize("allergic to penicillin, sulfa")["allergies"] == ["penicillin", "sulfa drugs"]
@@ -0,0 +1,30 @@
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.ai_models import profiling
+from app.ai_models.telemetry import span
+
+
+def test_torch_scopes_stay_with_the_profiled_call():
+    seen = {}
+
+    def unprofiled():
+        seen["other"] = profiling.torch_active()
+
+    def profiled():
+        seen["profiled"] = profiling.torch_active()
+        # A request running alongside, in a context of its own
+        other = threading.Thread(target=unprofiled)
+        other.start()
+        other.join()
+        with span("model.forward", model="tiny"):
+            return torch.ones(8) @ torch.ones(8)
+
+    result, artifact = profiling.profile_call(profiled, mode="torch")
+    assert float(result) == 8.0
+    assert seen == {"profiled": True, "other": False}
+    assert profiling.torch_active() is False
+    assert "tiny" in artifact["torch_operators"]["by_model"]
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app.ai_models import residency
+from app.ai_models.residency import ResidencyManager
+
+MB = 2**20
+
+
+class _Model:
+    def __init__(self, name, size_mb=1):
+        self.name = name
+        self.size = int(size_mb * MB)
+
+
+@pytest.fixture(autouse=True)
+def fixed_footprints(monkeypatch):
+    # Footprints come from the models themselves, not from this process's RSS
+    monkeypatch.setattr(residency, "tensor_bytes", lambda obj: obj.size)
+    monkeypatch.setattr(residency, "process_rss", lambda: 0)
+    monkeypatch.setattr(residency, "_release_memory", lambda: None)
+
+
+def _manager(names, budget_mb, **kwargs):
+    calls = {name: 0 for name in names}
+
+    def loader(name):
+        def load():
+            calls[name] += 1
+            return _Model(name)
+        return load
+
+    manager = ResidencyManager({name: loader(name) for name in names}, budget_mb=budget_mb,
+                               pinned=kwargs.pop("pinned", []), idle_seconds=kwargs.pop("idle_seconds", 0), **kwargs)
+    return manager, calls
+
+
+def test_least_recently_used_is_evicted_to_fit_the_budget():
+    manager, calls = _manager(["a", "b", "c"], budget_mb=2)
+    manager.get("a")
+    manager.get("b")
+    manager.get("a")
+    manager.get("c")
+    assert set(manager.resident()) == {"a", "c"}
+    assert manager.resident_bytes == 2 * MB
+
+    manager.get("b")
+    assert set(manager.resident()) == {"b", "c"}
+    assert calls == {"a": 1, "b": 2, "c": 1}
+    assert [event["event"] for event in manager.events].count("evict") == 2
+    assert manager.stats()["models"]["b"]["loads"] == 2
+
+
+def test_pinned_and_in_use_models_are_not_evicted():
+    manager, _ = _manager(["a", "b", "c"], budget_mb=1, pinned=["a"])
+    manager.get("a")
+    with manager.use("b"):
+        manager.get("c")
+        # Nothing evictable: the load proceeds over budget and says so
+        assert set(manager.resident()) == {"a", "b", "c"}
+        assert manager.events[-1]["event"] == "over_budget"
+    # Releasing "b" settles the overrun, least recently used first
+    assert set(manager.resident()) == {"a"}
+    assert manager.evict("a") is False
+
+
+def test_concurrent_requests_share_a_single_load():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(threading.get_ident())
+        started.set()
+        release.wait(5)
+        return _Model("slow")
+
+    manager = ResidencyManager({"slow": load}, budget_mb=0, pinned=[], idle_seconds=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get("slow"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert manager.stats()["models"]["slow"]["hits"] >= 7
+
+
+def test_idle_models_are_evicted_unless_in_use():
+    manager, _ = _manager(["a", "b"], budget_mb=0, idle_seconds=0.01)
+    manager.get("a")
+    with manager.use("b"):
+        time.sleep(0.05)
+        assert manager.evict_idle() == ["a"]
+    assert set(manager.resident()) == {"b"}
+
+
+def test_models_inherited_across_a_fork_are_not_evicted(monkeypatch):
+    manager, _ = _manager(["a", "b"], budget_mb=1)
+    manager.get("a")
+    # As seen from a forked child
+    parent = os.getpid()
+    monkeypatch.setattr(residency.os, "getpid", lambda: parent + 1)
+    assert manager.stats()["models"]["a"]["inherited"] is True
+    assert manager.evict("a") is False
+    manager.get("b")
+    assert set(manager.resident()) == {"a", "b"}
+
+
+def test_unknown_models_are_rejected():
+    manager, _ = _manager(["a"], budget_mb=1)
+    with pytest.raises(KeyError):
+        manager.get("b")
+    with pytest.raises(ValueError):
+        ResidencyManager({"a": lambda: None}, budget_mb=1, pinned=["b"])
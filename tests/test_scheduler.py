@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+
+from app.ai_models.cancellation import CancelToken, Cancelled
+from app.scheduler import FairScheduler, QueueFull, QueueTimeout
+
+QUEUES = {
+    "text": {"weight": 8.0, "limit": 4, "max_depth": 16, "reserved": 1},
+    "video": {"weight": 1.0, "limit": 4, "max_depth": 16, "reserved": 0},
+}
+
+
+def test_hold_admits_a_thread_through_the_loop():
+    async def main():
+        scheduler = FairScheduler(QUEUES, total_slots=2)
+        loop = asyncio.get_running_loop()
+        inside = []
+
+        def job():
+            with scheduler.hold(loop, "video", poll_interval=0.01):
+                inside.append(scheduler.stats()["queues"]["video"]["running"])
+
+        await loop.run_in_executor(None, job)
+        assert inside == [1]
+        assert scheduler.running == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_hold_gives_up_its_place():
+    async def main():
+        scheduler = FairScheduler(QUEUES, total_slots=2)
+        loop = asyncio.get_running_loop()
+        token = CancelToken()
+
+        def job():
+            with scheduler.hold(loop, "video", cancel=token, poll_interval=0.01):
+                pass
+
+        # Video may only take the one slot text doesn't reserve
+        async with scheduler.slot("video"):
+            waiting = loop.run_in_executor(None, job)
+            while scheduler.queues["video"].depth == 0:
+                await asyncio.sleep(0.01)
+            token.cancel("job cancelled")
+            with pytest.raises(Cancelled):
+                await waiting
+        await asyncio.sleep(0.05)
+        assert scheduler.running == 0
+        assert scheduler.queues["video"].depth == 0
+
+    asyncio.run(main())
+
+
+def test_slots_are_shared_in_proportion_to_weight():
+    async def main():
+        scheduler = FairScheduler({
+            "heavy": {"weight": 1.0, "limit": 4, "max_depth": 64},
+            "light": {"weight": 3.0, "limit": 4, "max_depth": 64},
+        }, total_slots=1)
+        order = []
+
+        async def request(name):
+            async with scheduler.slot(name):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*[request(name) for _ in range(20) for name in ("heavy", "light")])
+        # While both queues are backlogged, light gets three slots for each of heavy's
+        first = order[:20]
+        assert first.count("light") == 15 and first.count("heavy") == 5
+        assert order.count("heavy") == order.count("light") == 20
+
+    asyncio.run(main())
+
+
+def test_urgent_requests_go_first():
+    async def main():
+        scheduler = FairScheduler(QUEUES, total_slots=2)
+        order = []
+
+        async def request(priority):
+            async with scheduler.slot("text", priority):
+                order.append(priority)
+                await asyncio.sleep(0)
+
+        async with scheduler.slot("text"), scheduler.slot("text"):
+            tasks = [asyncio.ensure_future(request(p)) for p in ("batch", "normal", "urgent")]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order[0] == "urgent" and order[-1] == "batch"
+
+    asyncio.run(main())
+
+
+def test_reserved_slot_is_held_back_from_other_queues():
+    async def main():
+        scheduler = FairScheduler(QUEUES, total_slots=3)
+        held = asyncio.Event()
+
+        async def video():
+            async with scheduler.slot("video"):
+                await held.wait()
+
+        videos = [asyncio.ensure_future(video()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        # Two of three slots go to video; the third stays free for text
+        assert scheduler.queues["video"].running == 2
+        assert scheduler.queues["video"].depth == 1
+        async with scheduler.slot("text", timeout=0.1):
+            assert scheduler.running == 3
+        held.set()
+        await asyncio.gather(*videos)
+        assert scheduler.running == 0
+
+    asyncio.run(main())
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        scheduler = FairScheduler({"video": {"weight": 1.0, "limit": 1, "max_depth": 1}}, total_slots=1)
+        async with scheduler.slot("video"):
+            waiter = asyncio.ensure_future(scheduler.slot("video").__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFull):
+                async with scheduler.slot("video"):
+                    pass
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        assert scheduler.queues["video"].rejected == 1
+        assert scheduler.queues["video"].depth == 0
+
+    asyncio.run(main())
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    async def main():
+        scheduler = FairScheduler(QUEUES, total_slots=1)
+        async with scheduler.slot("video"):
+            with pytest.raises(QueueTimeout):
+                async with scheduler.slot("video", timeout=0.01):
+                    pass
+            assert scheduler.queues["video"].depth == 0
+        assert scheduler.running == 0
+        assert scheduler.queues["video"].timed_out == 1
+
+    asyncio.run(main())
+
+
+def test_slot_granted_as_the_waiter_gives_up_is_handed_back():
+    async def main():
+        scheduler = FairScheduler(QUEUES, total_slots=1)
+        first = scheduler.slot("video")
+        await first.__aenter__()
+        waiter = asyncio.ensure_future(scheduler.slot("video").__aenter__())
+        await asyncio.sleep(0)
+        # Release the slot (granting it to the waiter) and cancel the waiter
+        # before it resumes: it must hand the slot back rather than leak it
+        await first.__aexit__(None, None, None)
+        assert scheduler.running == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.running == 0
+        assert scheduler.queues["video"].running == 0
+        async with scheduler.slot("video", timeout=0.1):
+            pass
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app import serialization
+from app.serialization import decode_array, negotiate, prepare, render
+
+
+def _results():
+    return {
+        "image_analysis": {
+            "features": np.linspace(0, 1, 8, dtype=np.float32).reshape(2, 4),
+            "heatmap": np.arange(6, dtype=np.uint8).reshape(2, 3),
+            "confidence": np.float32(0.75),
+            "findings": ["opacity"]
+        },
+        "text_analysis": {"embeddings": [np.ones(3, dtype=np.float32)], "entities": []}
+    }
+
+
+def test_embeddings_are_omitted_unless_requested():
+    tree, arrays = prepare(_results())
+    assert tree["image_analysis"]["features"] == {"omitted": True, "shape": [2, 4]}
+    assert tree["text_analysis"]["embeddings"] == [{"omitted": True, "shape": [3]}]
+    assert tree["image_analysis"]["confidence"] == 0.75
+    assert arrays == {}
+
+    tree, _ = prepare(_results(), include_embeddings=True, embedding_dtype="float16")
+    features = decode_array(tree["image_analysis"]["features"])
+    assert features.dtype == np.float16
+    np.testing.assert_allclose(features, _results()["image_analysis"]["features"], atol=1e-3)
+    # Non-embedding arrays keep their dtype
+    assert decode_array(tree["image_analysis"]["heatmap"]).dtype == np.uint8
+
+
+def test_unknown_embedding_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        prepare(_results(), embedding_dtype="int8")
+
+
+def test_negotiate_falls_back_to_json():
+    assert negotiate(None) == "application/json"
+    assert negotiate("text/html, */*") == "application/json"
+    assert negotiate("application/x-npz") == "application/x-npz"
+
+
+def test_json_round_trip():
+    response = render(_results(), include_embeddings=True, embedding_dtype="float32")
+    assert response.media_type == "application/json"
+    tree = json.loads(response.body)
+    np.testing.assert_array_equal(decode_array(tree["image_analysis"]["heatmap"]), np.arange(6).reshape(2, 3))
+    np.testing.assert_array_equal(decode_array(tree["image_analysis"]["features"]),
+                                  _results()["image_analysis"]["features"])
+
+
+def test_json_without_orjson(monkeypatch):
+    monkeypatch.setattr(serialization, "orjson", None)
+    tree = json.loads(render(_results()).body)
+    assert tree["image_analysis"]["findings"] == ["opacity"]
+
+
+def test_msgpack_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    response = render(_results(), accept="application/x-msgpack", include_embeddings=True)
+    assert response.media_type == "application/msgpack"
+    tree = msgpack.unpackb(response.body, raw=False)
+    heatmap = tree["image_analysis"]["heatmap"]
+    assert heatmap["encoding"] == "bytes"
+    np.testing.assert_array_equal(decode_array(heatmap), np.arange(6).reshape(2, 3))
+    assert decode_array(tree["text_analysis"]["embeddings"][0]).dtype == np.float16
+
+
+def test_npz_members_match_their_refs():
+    response = render(_results(), accept="application/x-npz", include_embeddings=True)
+    assert response.media_type == "application/x-npz"
+    with np.load(io.BytesIO(response.body)) as npz:
+        meta = json.loads(npz["__json__"].tobytes())
+        heatmap = meta["results"]["image_analysis"]["heatmap"]
+        assert heatmap["encoding"] == "npz"
+        np.testing.assert_array_equal(npz[meta["members"][heatmap["ref"]]], np.arange(6).reshape(2, 3))
+        features = meta["results"]["image_analysis"]["features"]
+        assert npz[meta["members"][features["ref"]]].shape == (2, 4)